@@ -3,6 +3,9 @@ from discord.ext import commands
 from discord import app_commands
 import time
 
+from utils.metrics import INTERACTION_DEFER, INTERACTION_RESPONSE
+from utils.timeline import TIMELINE
+
 class Boot(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
@@ -18,6 +21,7 @@ class Boot(commands.Cog):
         # Renderの復帰待ちでコマンドがタイムアウトするのを防ぎます。
         # ephemeral=Falseで公開応答（全員に見える）として defer 
         await interaction.response.defer(ephemeral=False) 
+        INTERACTION_DEFER.observe(time.time() - start_time, command="boot")
 
         # --- ここでRenderのWeb Serviceがスリープから復帰し、BOTの処理が完全に始まる ---
 
@@ -25,13 +29,22 @@ class Boot(commands.Cog):
         end_time = time.time()
         elapsed_time = round(end_time - start_time, 2)
         
-        # 4. 最終応答（Follow-up）を送信
+        # 4. プロセス起動からの各フェーズの所要時間（どこで時間がかかったか）
+        lines = [
+            f"{phase['label']}: +{phase['delta']:.2f}秒 (累計 {phase['at']:.2f}秒)"
+            for phase in TIMELINE.breakdown()
+        ]
+        
+        # 5. 最終応答（Follow-up）を送信
         message = (
             "🤖 **BOTがスリープから復帰しました！**\n"
-            f"⏳ 起動までに **{elapsed_time}** 秒かかりました！"
+            f"⏳ 起動までに **{elapsed_time}** 秒かかりました！\n\n"
+            "📋 **起動フェーズの内訳**\n"
+            "```\n" + "\n".join(lines) + "\n```"
         )
         # deferしたインタラクションに対する最終的な応答を送信
         await interaction.followup.send(message)
+        INTERACTION_RESPONSE.observe(time.time() - start_time, command="boot")
 
 # Cogsをセットアップするための必須関数
 async def setup(bot: commands.Bot):
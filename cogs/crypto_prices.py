@@ -3,228 +3,816 @@ from discord.ext import commands
 from discord import app_commands
 import aiohttp
 import asyncio
-from datetime import datetime, timedelta
-from typing import Optional, Dict
+import functools
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+import os
+from typing import Optional, Dict, Callable, Awaitable, Hashable, List, Set, Tuple
+
+from utils.alerts import ABOVE, BELOW, AlertStore
+from utils.cluster import CLUSTER_ID, ClusterClient, cluster_status, owns_guild
+from utils.coingecko import CoinGeckoClient, CryptoAPIError, create_session
+from utils.coins import CoinRegistry
+from utils.metrics import (
+    CACHE_ENTRIES, CACHE_HIT_RATIO, CACHE_LOOKUPS, DEADLINE_FALLBACKS, EMBED_CACHE_LOOKUPS, INTERACTION_DEFER,
+    INTERACTION_RESPONSE
+)
+from utils.history import HISTORY_WINDOW, PriceHistory, sparkline, summarize
+from utils.logs import span, trace
+from utils.providers import HedgedPriceFetcher, create_price_fetcher, fill_missing
+from utils.snapshot import PriceSnapshotStore
+from utils.sources import PriceSource, create_price_source
+from utils.watches import WATCH_EDITS, Watch, WatchStore
+
+logger = logging.getLogger(__name__)
+
+# ドロップダウンメニューの custom_id。再起動後も以前に送ったメニューを受け付けられるよう固定する
+CRYPTO_SELECT_ID = "crypto_prices:select"
+
+# ドロップダウンメニューに表示する暗号通貨
+CRYPTO_OPTIONS = [
+    discord.SelectOption(label="Bitcoin (BTC)", value="bitcoin", emoji="🪙"),
+    discord.SelectOption(label="Ethereum (ETH)", value="ethereum", emoji="💎"),
+    discord.SelectOption(label="Ripple (XRP)", value="ripple", emoji="💧"),
+    discord.SelectOption(label="Cardano (ADA)", value="cardano", emoji="🎴"),
+    discord.SelectOption(label="Solana (SOL)", value="solana", emoji="☀️"),
+    discord.SelectOption(label="Polkadot (DOT)", value="polkadot", emoji="🔴"),
+    discord.SelectOption(label="Dogecoin (DOGE)", value="dogecoin", emoji="🐕"),
+    discord.SelectOption(label="Avalanche (AVAX)", value="avalanche-2", emoji="🔺"),
+    discord.SelectOption(label="Chainlink (LINK)", value="chainlink", emoji="🔗"),
+    discord.SelectOption(label="Polygon (MATIC)", value="matic-network", emoji="🟣"),
+    discord.SelectOption(label="Litecoin (LTC)", value="litecoin", emoji="⚡"),
+    discord.SelectOption(label="Uniswap (UNI)", value="uniswap", emoji="🦄"),
+    discord.SelectOption(label="Binance Coin (BNB)", value="binancecoin", emoji="💰"),
+    discord.SelectOption(label="Tron (TRX)", value="tron", emoji="⚙️"),
+    discord.SelectOption(label="Stellar (XLM)", value="stellar", emoji="⭐"),
+    discord.SelectOption(label="Monero (XMR)", value="monero", emoji="🔒"),
+    discord.SelectOption(label="Cosmos (ATOM)", value="cosmos", emoji="🌌"),
+    discord.SelectOption(label="Algorand (ALGO)", value="algorand", emoji="🔷"),
+    discord.SelectOption(label="VeChain (VET)", value="vechain", emoji="✅"),
+    discord.SelectOption(label="Filecoin (FIL)", value="filecoin", emoji="📁"),
+    discord.SelectOption(label="Tezos (XTZ)", value="tezos", emoji="🔵"),
+    discord.SelectOption(label="Shiba Inu (SHIB)", value="shiba-inu", emoji="🐶"),
+    discord.SelectOption(label="Bitcoin Cash (BCH)", value="bitcoin-cash", emoji="💵"),
+    discord.SelectOption(label="Aptos (APT)", value="aptos", emoji="🅰️"),
+    discord.SelectOption(label="Near Protocol (NEAR)", value="near", emoji="🔷"),
+]
+
+# 通貨ID -> 表示名
+CRYPTO_LABELS = {opt.value: opt.label for opt in CRYPTO_OPTIONS}
+
+# /crypto_list で一覧表示する暗号通貨
+LIST_CRYPTO_IDS = [
+    "bitcoin", "ethereum", "ripple", "cardano", "solana",
+    "polkadot", "dogecoin", "avalanche-2", "chainlink", "matic-network",
+]
+
+# 先読み対象（メニュー + 一覧）。順序を保ったまま重複を除く
+PREFETCH_CRYPTO_IDS = list(dict.fromkeys([opt.value for opt in CRYPTO_OPTIONS] + LIST_CRYPTO_IDS))
+
+# 先読みの間隔（秒）。キャッシュ期限(60秒)より短くして、期限切れ前に更新する
+PREFETCH_INTERVAL = float(os.environ.get("CRYPTO_PREFETCH_INTERVAL", 45))
+
+# 応答期限（秒）。期限内に最新の価格が揃わなければ、最後に取得した価格で先に応答し、
+# 取得でき次第同じメッセージを書き換える（0以下なら取得完了まで待つ）
+RESPONSE_DEADLINE = float(os.environ.get("CRYPTO_RESPONSE_DEADLINE", 0.5))
+
+# 期限切れで先に送ったメッセージのフッター
+PENDING_NOTE = "⏳ 最新の価格を取得中"
+REFRESH_FAILED_NOTE = "⚠️ 最新の価格を取得できませんでした"
+
+# /crypto_watch のメッセージを更新する間隔（秒）。全ウォッチをこの周期でまとめて更新する
+WATCH_INTERVAL = float(os.environ.get("CRYPTO_WATCH_INTERVAL", 60))
+
+# 同じチャンネルのメッセージを続けて編集する間隔（秒）。チャンネルごとのレート制限（5回/5秒程度）に収める
+WATCH_CHANNEL_EDIT_INTERVAL = 1.5
+WATCH_EDIT_CONCURRENCY = 5  # 全チャンネル合計の同時編集数
+
+# 1サーバーあたりのウォッチの上限と、1つのウォッチに表示できる通貨の上限（Embedのフィールド数）
+MAX_WATCHES_PER_GUILD = int(os.environ.get("CRYPTO_MAX_WATCHES_PER_GUILD", 10))
+MAX_WATCH_COINS = 25
+
+# スナップショットを保存する最小間隔（秒）
+SNAPSHOT_INTERVAL = float(os.environ.get("CRYPTO_SNAPSHOT_INTERVAL", 60))
+
+# 1人あたりの価格アラートの上限
+MAX_ALERTS_PER_USER = int(os.environ.get("CRYPTO_MAX_ALERTS_PER_USER", 25))
+
+# /crypto_chart で選べる期間（表示名 -> 秒）
+CHART_WINDOWS = {"1時間": 3600, "6時間": 6 * 3600, "24時間": HISTORY_WINDOW}
+
+def data_timestamp(fetched_at: Optional[float]) -> datetime:
+    """Embedに表示する時刻（データの取得時刻。不明なら現在時刻）"""
+    if fetched_at is None:
+        return discord.utils.utcnow()
+    return datetime.fromtimestamp(fetched_at, tz=timezone.utc)
+
+def format_usd(value: float) -> str:
+    """USD価格の表示（1ドル未満は小数点以下8桁）"""
+    return f"${value:,.2f}" if value >= 1 else f"${value:.8f}"
+
+def format_jpy(value: Optional[float]) -> str:
+    """JPY価格の表示（代替プロバイダーのみで値がない場合は N/A）"""
+    if value is None:
+        return "N/A"
+    return f"¥{value:,.2f}" if value >= 1 else f"¥{value:.8f}"
+
+def footer_text(from_cache: bool, stale: bool, provider: str = "CoinGecko", note: Optional[str] = None) -> str:
+    """Embedのフッター。古いデータの場合はその旨を明示する（noteがあれば添えて表示）"""
+    text = f"データ提供: {provider} API"
+    if note:
+        text += f" ({note}・表示は前回取得したデータ)" if stale else f" ({note})"
+    elif stale:
+        text += " (前回取得したデータ・更新中)"
+    elif from_cache:
+        text += " (キャッシュ)"
+    return text
+
+def build_crypto_embed(crypto_id, crypto_data, from_cache=False, stale=False, fetched_at=None,
+                       label=None, note=None) -> discord.Embed:
+    """暗号通貨情報のEmbedを作成（label はコイン一覧での表示名）"""
+    crypto_name = CRYPTO_LABELS.get(crypto_id) or label or crypto_id.title()
+    
+    embed = discord.Embed(
+        title=f"💰 {crypto_name}",
+        color=discord.Color.gold(),
+        timestamp=data_timestamp(fetched_at)
+    )
+    
+    # 価格情報
+    usd_price = crypto_data.get('usd', 0)
+    jpy_price = crypto_data.get('jpy')
+    btc_price = crypto_data.get('btc')
+    
+    embed.add_field(
+        name="💵 USD",
+        value=f"${usd_price:,.2f}" if usd_price >= 1 else f"${usd_price:.8f}",
+        inline=True
+    )
+    embed.add_field(
+        name="💴 JPY",
+        value=format_jpy(jpy_price),
+        inline=True
+    )
+    embed.add_field(
+        name="🪙 BTC",
+        value=f"{btc_price:.8f}" if btc_price is not None else "N/A",
+        inline=True
+    )
+    
+    # 24時間変動率
+    change_24h = crypto_data.get('usd_24h_change')
+    if change_24h is not None:
+        change_emoji = "📈" if change_24h > 0 else "📉"
+        change_color = "+" if change_24h > 0 else ""
+        
+        embed.add_field(
+            name=f"{change_emoji} 24時間変動",
+            value=f"{change_color}{change_24h:.2f}%",
+            inline=True
+        )
+    
+    # 時価総額
+    market_cap = crypto_data.get('usd_market_cap')
+    if market_cap and market_cap > 0:
+        embed.add_field(
+            name="📊 時価総額 (USD)",
+            value=f"${market_cap:,.0f}",
+            inline=True
+        )
+    
+    # 24時間取引量
+    volume_24h = crypto_data.get('usd_24h_vol')
+    if volume_24h and volume_24h > 0:
+        embed.add_field(
+            name="📦 24時間取引量 (USD)",
+            value=f"${volume_24h:,.0f}",
+            inline=True
+        )
+    
+    embed.set_footer(text=footer_text(from_cache, stale, crypto_data.get('provider', "CoinGecko"), note))
+    return embed
+
+def build_list_embed(data, from_cache=False, stale=False, fetched_at=None, note=None,
+                     title="📊 主要暗号通貨 価格一覧", labels=None) -> discord.Embed:
+    """一覧表示用のEmbedを作成（labels はメニューにない通貨の表示名）"""
+    embed = discord.Embed(
+        title=title,
+        color=discord.Color.gold(),
+        timestamp=data_timestamp(fetched_at)
+    )
+    
+    for crypto_id, crypto_data in data.items():
+        name = CRYPTO_LABELS.get(crypto_id) or (labels or {}).get(crypto_id) or crypto_id.title()
+        usd_price = crypto_data.get('usd', 0)
+        jpy_price = crypto_data.get('jpy')
+        change_24h = crypto_data.get('usd_24h_change')
+        
+        usd_str = f"${usd_price:,.2f}" if usd_price >= 1 else f"${usd_price:.8f}"
+        jpy_str = format_jpy(jpy_price)
+        
+        if change_24h is not None:
+            change_emoji = "📈" if change_24h > 0 else "📉"
+            change_text = f"{change_emoji} {change_24h:+.2f}%"
+        else:
+            change_text = "N/A"
+        
+        embed.add_field(
+            name=name,
+            value=f"💵 {usd_str}\n💴 {jpy_str}\n{change_text}",
+            inline=True
+        )
+    
+    providers = sorted({crypto_data.get('provider', "CoinGecko") for crypto_data in data.values()})
+    embed.set_footer(text=footer_text(from_cache, stale, " / ".join(providers) or "CoinGecko", note))
+    return embed
+
+def embed_digest(embed: discord.Embed) -> str:
+    """Embedの表示内容のハッシュ（取得時刻は除く）。変わっていなければメッセージを編集しない"""
+    content = embed.to_dict()
+    content.pop("timestamp", None)
+    return hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+class EmbedCache:
+    """作成済みEmbedのキャッシュ
+    
+    表示条件（種類・キー・ロケール・キャッシュ表示）ごとに、最新の価格データ版のEmbedを1つだけ保持する。
+    価格データが更新されると版が変わるので、古いEmbedは次の参照時に作り直される。
+    """
+    def __init__(self, max_entries=1024):
+        self.embeds: OrderedDict[tuple, tuple] = OrderedDict()  # key -> (版, Embed)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+    
+    def get_or_build(self, key: tuple, version: Hashable, builder: Callable[[], discord.Embed]) -> discord.Embed:
+        entry = self.embeds.get(key)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            self.embeds.move_to_end(key)
+            return entry[1]
+        
+        self.misses += 1
+        embed = builder()
+        self.embeds[key] = (version, embed)
+        self.embeds.move_to_end(key)
+        while len(self.embeds) > self.max_entries:
+            self.embeds.popitem(last=False)
+        return embed
+
+# 通貨IDの一覧を受け取り、通貨ID -> データ を返す取得処理
+BatchLoader = Callable[[List[str]], Awaitable[Dict[str, object]]]
+
+
+async def fetch_prices(cache: "CryptoCache", fetcher, crypto_ids: List[str]) -> Dict[str, dict]:
+    """通貨ごとの価格をまとめて取得（遅い・失敗時は代替プロバイダーも使う）。
+    
+    /crypto と /crypto_list で同じ項目（全項目）を取得するので、どちらで取得したデータも共有できる。
+    代替プロバイダーにない項目はキャッシュ済みのデータから補う。
+    """
+    with span("upstream_fetch"):
+        data = await fetcher.fetch(crypto_ids)
+    # BTC建て価格は同じ応答のビットコインの価格で求める（応答になければキャッシュの値）
+    bitcoin = data.get("bitcoin") or cache.peek("bitcoin") or {}
+    return {
+        crypto_id: fill_missing(crypto_data, cache.peek(crypto_id), bitcoin.get("usd"))
+        for crypto_id, crypto_data in data.items()
+    }
+
+
+async def within_deadline(future: asyncio.Future, deadline: Optional[float] = None) -> bool:
+    """futureが期限内に完了したか（期限を過ぎても処理は止めない）。deadlineが0以下なら完了まで待つ"""
+    if deadline is None:
+        deadline = RESPONSE_DEADLINE
+    if deadline > 0:
+        done, _ = await asyncio.wait([future], timeout=deadline)
+        return bool(done)
+    await asyncio.wait([future])
+    return True
+
+
+async def edit_when_ready(message, lookup: asyncio.Future, render: Callable[[object], discord.Embed],
+                          render_failed: Callable[[], discord.Embed], command: str, record: bool = True):
+    """先に送ったメッセージを、取得が完了したら同じメッセージのまま書き換える
+    
+    record=False の場合は DEADLINE_FALLBACKS に数えない（古いデータを送った後の裏での更新）。
+    """
+    try:
+        with span("cache_lookup"):
+            data = await lookup
+    except Exception as e:
+        logger.warning(f"⚠️ 期限後の価格の取得に失敗しました ({command}): {e}")
+        data = None
+    if data:
+        embed = render(data)
+        outcome = "updated"
+    else:
+        embed = render_failed()
+        outcome = "failed"
+    if record:
+        DEADLINE_FALLBACKS.inc(command=command, outcome=outcome)
+    try:
+        with span("edit"):
+            await message.edit(embed=embed)
+    except Exception as e:
+        logger.warning(f"⚠️ メッセージの書き換えに失敗しました ({command}): {e}")
+
+
+async def send_embed(interaction: discord.Interaction, render: Callable[[], discord.Embed], ephemeral: bool):
+    """Embedを送信し、送信したメッセージを返す（失敗時はNone）"""
+    try:
+        embed = render()
+        with span("send"):
+            return await interaction.followup.send(embed=embed, ephemeral=ephemeral, wait=True)
+    except Exception as e:
+        logger.exception(f"Embed送信エラー: {str(e)}")
+        await interaction.followup.send("❌ データの表示中にエラーが発生しました。", ephemeral=ephemeral)
+        return None
+
+
+async def refreshed(cache: "CryptoCache", keys: List[str], refreshing: asyncio.Future) -> Optional[Dict[str, object]]:
+    """裏での再取得の完了を待ち、更新後のデータを返す（失敗して古いままならNone）"""
+    await refreshing
+    if cache.summary(keys)[0]:
+        return None
+    data = {key: cache.peek(key) for key in keys}
+    return {key: value for key, value in data.items() if value is not None}
+
+
+# render(通貨ID -> データ, from_cache, stale, note) で応答のEmbedを作る
+EmbedRenderer = Callable[[Dict[str, object], bool, bool, Optional[str]], discord.Embed]
+
+
+async def respond_with_deadline(interaction: discord.Interaction, command: str, received: float,
+                                cache: "CryptoCache", keys: List[str], loader: "BatchLoader",
+                                render: EmbedRenderer, ephemeral: bool = False):
+    """deferしたインタラクションにキャッシュ経由の価格で応答する（/crypto のメニュー・/crypto <coin>・/crypto_list で共通）
+    
+    - キャッシュにあれば即座に送る。古いデータなら裏での再取得が終わり次第、同じメッセージを書き換える
+    - 取得が必要で RESPONSE_DEADLINE 内に揃わなければ、最後に取得したデータを先に送って後で書き換える
+    - 取得に失敗しても、最後に取得したデータがあればそれで応答する
+    """
+    responded = False
+    try:
+        # キャッシュにない通貨だけをまとめて1回で取得（同じ通貨への同時リクエストは1回にまとめる）
+        from_cache = all(key in cache for key in keys)
+        lookup = asyncio.ensure_future(cache.get_many(keys, loader))
+        last_known = {key: cache.last_known(key) for key in keys if cache.last_known(key) is not None}
+        ready = not last_known
+        if not ready:
+            with span("cache_lookup"):
+                ready = await within_deadline(lookup)
+        if not ready:
+            # 期限内に揃わなければ最後に取得したデータを先に送り、取得でき次第同じメッセージを書き換える
+            message = await send_embed(interaction, lambda: render(last_known, True, True, PENDING_NOTE), ephemeral)
+            INTERACTION_RESPONSE.observe(time.perf_counter() - received, command=command)
+            responded = True
+            if message is not None:
+                await edit_when_ready(
+                    message, lookup,
+                    lambda data: render(data, False, cache.summary(list(data))[0], None),
+                    lambda: render(last_known, True, True, REFRESH_FAILED_NOTE),
+                    command
+                )
+            return
+        
+        try:
+            with span("cache_lookup"):
+                data = await lookup
+        except CryptoAPIError as e:
+            if not last_known:
+                await interaction.followup.send(e.message, ephemeral=ephemeral)
+                return
+            # 期限内に失敗した場合（レート制限のクールダウン中など）も最後に取得したデータで応答する
+            DEADLINE_FALLBACKS.inc(command=command, outcome="error")
+            await send_embed(interaction, lambda: render(last_known, True, True, REFRESH_FAILED_NOTE), ephemeral)
+            return
+        
+        if not data:
+            await interaction.followup.send("❌ データが見つかりませんでした。", ephemeral=ephemeral)
+            return
+        
+        stale = cache.summary(list(data))[0]
+        message = await send_embed(interaction, lambda: render(data, from_cache, stale, None), ephemeral)
+        INTERACTION_RESPONSE.observe(time.perf_counter() - received, command=command)
+        responded = True
+        # 古いデータ（フッターは「更新中」）を送った場合は、裏での再取得の結果で書き換える
+        refreshing = cache.refreshing(list(data)) if stale else None
+        if message is not None and refreshing is not None:
+            await edit_when_ready(
+                message, asyncio.ensure_future(refreshed(cache, list(data), refreshing)),
+                lambda fresh: render(fresh, False, False, None),
+                lambda: render(data, True, True, REFRESH_FAILED_NOTE),
+                command, record=False
+            )
+    finally:
+        if not responded:
+            INTERACTION_RESPONSE.observe(time.perf_counter() - received, command=command)
+
 
 class CryptoCache:
-    """APIレスポンスをキャッシュするクラス"""
-    def __init__(self, cache_duration=60):
-        self.cache: Dict[str, tuple] = {}
+    """通貨ごとの価格データのキャッシュ（件数上限付きLRU + stale-while-revalidate）
+    
+    /crypto と /crypto_list は同じ通貨IDのエントリを共有する（一覧は通貨ごとのエントリから組み立てる）。
+    
+    - cache_duration秒以内のデータは「新鮮」としてそのまま返す
+    - stale_duration秒以内のデータは「古い」が即座に返し、裏で再取得する
+    - それより古いデータは取得完了まで待つ（ただし last_known() で応答期限切れ時の表示に使える）
+    - max_entriesを超えたら最も長く使われていないエントリから削除する
+    """
+    def __init__(self, cache_duration=60, stale_duration=600, max_entries=1024):
+        self.cache: OrderedDict[str, tuple] = OrderedDict()  # key -> (data, 保存時刻(monotonic), 取得時刻(UNIX時間), 版)
         self.cache_duration = cache_duration
+        self.stale_duration = max(stale_duration, cache_duration)
+        self.max_entries = max_entries
+        self._inflight: Dict[str, asyncio.Future] = {}  # キーごとの取得中タスク
+        self._version = 0  # データを保存するたびに増える版番号
+        
+        # 統計
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+    
+    def __contains__(self, key: str) -> bool:
+        """新鮮または古い（まだ返せる）データがあるか"""
+        return self._age(key) is not None
+    
+    def __len__(self) -> int:
+        return len(self.cache)
+    
+    def _age(self, key: str) -> Optional[float]:
+        """エントリの経過秒数。期限切れのエントリはNone（最後に取得したデータとしては残す）"""
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        age = time.monotonic() - entry[1]
+        if age >= self.stale_duration:
+            return None
+        return age
+    
+    def peek(self, key: str):
+        """新鮮・古いに関わらず、まだ返せるデータを返す（統計には数えない）"""
+        if self._age(key) is None:
+            return None
+        return self.cache[key][0]
+    
+    def last_known(self, key: str):
+        """期限切れを含め、最後に取得したデータを返す（統計には数えない）"""
+        entry = self.cache.get(key)
+        return entry[0] if entry else None
     
     def get(self, key: str):
-        if key in self.cache:
-            data, timestamp = self.cache[key]
-            if datetime.now() - timestamp < timedelta(seconds=self.cache_duration):
-                return data
+        """新鮮なデータのみ返す（統計には数えない）"""
+        age = self._age(key)
+        if age is not None and age < self.cache_duration:
+            self.cache.move_to_end(key)
+            return self.cache[key][0]
         return None
     
-    def set(self, key: str, data):
-        self.cache[key] = (data, datetime.now())
+    def set(self, key: str, data, fetched_at: Optional[float] = None):
+        self._version += 1
+        self.cache[key] = (data, time.monotonic(), fetched_at or time.time(), self._version)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+    
+    def version(self, key: str) -> int:
+        """データの版番号（更新されるたびに変わる。エントリがなければ0）"""
+        entry = self.cache.get(key)
+        return entry[3] if entry else 0
+    
+    def fetched_at(self, key: str) -> Optional[float]:
+        """データを取得した時刻（UNIX時間）"""
+        entry = self.cache.get(key)
+        return entry[2] if entry else None
+    
+    def is_stale(self, key: str) -> bool:
+        """新鮮期限を過ぎたデータか"""
+        age = self._age(key)
+        return age is not None and age >= self.cache_duration
+    
+    def items(self):
+        """スナップショット保存用に (key, data, 取得時刻) を返す"""
+        return [(key, data, fetched_at) for key, (data, _, fetched_at, _) in self.cache.items()]
+    
+    def restore(self, entries):
+        """スナップショットから復元する。
+        
+        保存からの経過時間に関わらず「古いデータ」として扱い、
+        次に参照された時点から stale_duration の間は即座に返しつつ裏で更新する。
+        """
+        stale_since = time.monotonic() - self.cache_duration
+        for key, data, fetched_at in entries:
+            if key not in self.cache:
+                self._version += 1
+                self.cache[key] = (data, stale_since, fetched_at, self._version)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+    
+    async def get_many(self, keys: List[str], loader: BatchLoader) -> Dict[str, object]:
+        """複数のキーをまとめて参照し、キャッシュにないものだけを1回のloader呼び出しで取得する。
+        
+        古いデータは即座に返し、古いキーはないキーと同じloader呼び出しで裏で更新する。
+        取得中のキーは新しく呼び出さず、その結果を待つ（シングルフライト）。
+        loaderの結果に含まれない（Noneの）キーはキャッシュせず、返り値にも含めない。
+        返り値はkeysの順に並ぶ。
+        """
+        keys = list(dict.fromkeys(keys))
+        result = {}
+        stale = []
+        missing = []
+        for key in keys:
+            age = self._age(key)
+            if age is None:
+                missing.append(key)
+                continue
+            self.cache.move_to_end(key)
+            result[key] = self.cache[key][0]
+            if age < self.cache_duration:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+                stale.append(key)
+        
+        if not stale and not missing:
+            return result
+        # 古いキーとないキーは1回のloader呼び出しにまとめ、待つのはないキーの結果だけ
+        futures = self.refresh(missing + stale, loader)[:len(missing)]
+        if missing:
+            self.misses += len(missing)
+            # 1人の呼び出し元がキャンセルされても、共有の取得処理は止めない
+            values = await asyncio.shield(asyncio.gather(*futures))
+            result.update((key, data) for key, data in zip(missing, values) if data is not None)
+        return {key: result[key] for key in keys if key in result}
+    
+    async def get_or_fetch(self, key: str, loader: BatchLoader):
+        """1件分の get_many（なければNone）"""
+        return (await self.get_many([key], loader)).get(key)
+    
+    def refresh(self, keys: List[str], loader: BatchLoader) -> List[asyncio.Future]:
+        """キーごとの取得処理を返す。取得中でないキーはまとめて1回のloader呼び出しで取得を開始する"""
+        loop = asyncio.get_running_loop()
+        new_keys = [key for key in keys if key not in self._inflight]
+        if new_keys:
+            for key in new_keys:
+                self._inflight[key] = loop.create_future()
+            task = asyncio.ensure_future(self._load(new_keys, loader))
+            task.add_done_callback(functools.partial(self._on_load_done, new_keys))
+        return [self._inflight[key] for key in keys]
+    
+    async def _load(self, keys: List[str], loader: BatchLoader) -> Dict[str, object]:
+        data = await loader(keys)
+        fetched_at = time.time()
+        for key in keys:
+            if data.get(key) is not None:
+                self.set(key, data[key], fetched_at)
+        return data
+    
+    def _on_load_done(self, keys: List[str], task: asyncio.Future):
+        for key in keys:
+            future = self._inflight.pop(key)
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+                # 裏での再取得が失敗しても、待っている呼び出し元がいなければ例外は捨てる
+                future.exception()
+            else:
+                future.set_result(task.result().get(key))
+    
+    def refreshing(self, keys: List[str]) -> Optional[asyncio.Future]:
+        """取得中のキーがあれば、その完了を待つfuture（取得の失敗は例外にしない）"""
+        futures = [self._inflight[key] for key in keys if key in self._inflight]
+        if not futures:
+            return None
+        return asyncio.gather(*futures, return_exceptions=True)
+    
+    def summary(self, keys: List[str]) -> Tuple[bool, Optional[float], tuple]:
+        """複数エントリの表示用の状態: (いずれかが古いか, 最も古い取得時刻, 版の組)"""
+        stale = any(self.is_stale(key) for key in keys)
+        fetched = [self.fetched_at(key) for key in keys if self.fetched_at(key) is not None]
+        return stale, min(fetched, default=None), tuple(self.version(key) for key in keys)
+    
+    def stats(self) -> dict:
+        """ヒット率などの統計"""
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self.cache),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.stale_hits) / total if total else 0.0,
+        }
 
 class CryptoView(discord.ui.View):
-    def __init__(self, cache: CryptoCache):
-        super().__init__(timeout=180)
+    """/crypto のドロップダウンメニュー
+    
+    timeout なし・固定の custom_id の永続ビュー。起動時に1つだけ bot.add_view で登録し、
+    どのメッセージのメニューが選ばれても共有のキャッシュで処理する（呼び出しごとのビューやタイマーは作らない）。
+    """
+    def __init__(self, cache: CryptoCache, fetcher: HedgedPriceFetcher, embeds: EmbedCache):
+        super().__init__(timeout=None)
         self.cache = cache
-        
+        self.fetcher = fetcher  # Cogが所有する共有の取得処理
+        self.embeds = embeds
+    
     @discord.ui.select(
+        custom_id=CRYPTO_SELECT_ID,
         placeholder="暗号通貨を選択してください",
-        options=[
-            discord.SelectOption(label="Bitcoin (BTC)", value="bitcoin", emoji="🪙"),
-            discord.SelectOption(label="Ethereum (ETH)", value="ethereum", emoji="💎"),
-            discord.SelectOption(label="Ripple (XRP)", value="ripple", emoji="💧"),
-            discord.SelectOption(label="Cardano (ADA)", value="cardano", emoji="🎴"),
-            discord.SelectOption(label="Solana (SOL)", value="solana", emoji="☀️"),
-            discord.SelectOption(label="Polkadot (DOT)", value="polkadot", emoji="🔴"),
-            discord.SelectOption(label="Dogecoin (DOGE)", value="dogecoin", emoji="🐕"),
-            discord.SelectOption(label="Avalanche (AVAX)", value="avalanche-2", emoji="🔺"),
-            discord.SelectOption(label="Chainlink (LINK)", value="chainlink", emoji="🔗"),
-            discord.SelectOption(label="Polygon (MATIC)", value="matic-network", emoji="🟣"),
-            discord.SelectOption(label="Litecoin (LTC)", value="litecoin", emoji="⚡"),
-            discord.SelectOption(label="Uniswap (UNI)", value="uniswap", emoji="🦄"),
-            discord.SelectOption(label="Binance Coin (BNB)", value="binancecoin", emoji="💰"),
-            discord.SelectOption(label="Tron (TRX)", value="tron", emoji="⚙️"),
-            discord.SelectOption(label="Stellar (XLM)", value="stellar", emoji="⭐"),
-            discord.SelectOption(label="Monero (XMR)", value="monero", emoji="🔒"),
-            discord.SelectOption(label="Cosmos (ATOM)", value="cosmos", emoji="🌌"),
-            discord.SelectOption(label="Algorand (ALGO)", value="algorand", emoji="🔷"),
-            discord.SelectOption(label="VeChain (VET)", value="vechain", emoji="✅"),
-            discord.SelectOption(label="Filecoin (FIL)", value="filecoin", emoji="📁"),
-            discord.SelectOption(label="Tezos (XTZ)", value="tezos", emoji="🔵"),
-            discord.SelectOption(label="Shiba Inu (SHIB)", value="shiba-inu", emoji="🐶"),
-            discord.SelectOption(label="Bitcoin Cash (BCH)", value="bitcoin-cash", emoji="💵"),
-            discord.SelectOption(label="Aptos (APT)", value="aptos", emoji="🅰️"),
-            discord.SelectOption(label="Near Protocol (NEAR)", value="near", emoji="🔷"),
-        ]
+        options=CRYPTO_OPTIONS
     )
     async def select_crypto(self, interaction: discord.Interaction, select: discord.ui.Select):
-        try:
-            await interaction.response.defer(ephemeral=True)
-        except:
-            return
-        
-        crypto_id = select.values[0]
-        
-        # キャッシュチェック
-        cached_data = self.cache.get(crypto_id)
-        if cached_data:
-            await self.send_crypto_embed(interaction, crypto_id, cached_data, select, from_cache=True)
-            return
-        
-        # API呼び出し（リトライ付き）
-        for attempt in range(3):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    url = f"https://api.coingecko.com/api/v3/simple/price?ids={crypto_id}&vs_currencies=usd,jpy,btc&include_24hr_change=true&include_market_cap=true&include_24hr_vol=true"
-                    
-                    async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            
-                            if crypto_id in data:
-                                # キャッシュに保存
-                                self.cache.set(crypto_id, data[crypto_id])
-                                await self.send_crypto_embed(interaction, crypto_id, data[crypto_id], select)
-                                return
-                            else:
-                                await interaction.followup.send("❌ データが見つかりませんでした。", ephemeral=True)
-                                return
-                        
-                        elif response.status == 429:
-                            # レート制限
-                            if attempt < 2:
-                                await asyncio.sleep(2 ** attempt)
-                                continue
-                            else:
-                                await interaction.followup.send(
-                                    "⚠️ APIのレート制限に達しました。しばらく待ってから再度お試しください。",
-                                    ephemeral=True
-                                )
-                                return
-                        
-                        else:
-                            # その他のHTTPエラー
-                            error_text = await response.text()
-                            print(f"API Error {response.status}: {error_text}")
-                            
-                            if attempt < 2:
-                                await asyncio.sleep(1)
-                                continue
-                            else:
-                                await interaction.followup.send(
-                                    f"❌ API エラー (ステータス: {response.status})\nしばらく待ってから再度お試しください。",
-                                    ephemeral=True
-                                )
-                                return
-            
-            except asyncio.TimeoutError:
-                if attempt < 2:
-                    await asyncio.sleep(1)
-                    continue
-                else:
-                    await interaction.followup.send("❌ API接続がタイムアウトしました。", ephemeral=True)
-                    return
-            
-            except Exception as e:
-                print(f"予期せぬエラー (試行 {attempt + 1}/3): {str(e)}")
-                if attempt < 2:
-                    await asyncio.sleep(1)
-                    continue
-                else:
-                    await interaction.followup.send(f"❌ エラーが発生しました: {str(e)}", ephemeral=True)
-                    return
+        await self.show_crypto(interaction, select.values[0], command="crypto_select")
     
-    async def send_crypto_embed(self, interaction, crypto_id, crypto_data, select, from_cache=False):
-        """暗号通貨情報のEmbedを送信"""
-        try:
-            # 選択された通貨名を取得
-            selected_option = next((opt for opt in select.options if opt.value == crypto_id), None)
-            crypto_name = selected_option.label if selected_option else crypto_id.title()
-            
-            embed = discord.Embed(
-                title=f"💰 {crypto_name}",
-                color=discord.Color.gold(),
-                timestamp=discord.utils.utcnow()
-            )
+    async def show_crypto(self, interaction: discord.Interaction, crypto_id: str, command: str, label=None):
+        """1通貨分の価格を表示（ドロップダウンと /crypto <coin> で共通）"""
+        with trace(command, str(interaction.id), crypto_id=crypto_id, guild_id=interaction.guild_id):
+            received = time.perf_counter()
+            try:
+                with span("defer"):
+                    await interaction.response.defer(ephemeral=True)
+            except:
+                return
             
-            # 価格情報
-            usd_price = crypto_data.get('usd', 0)
-            jpy_price = crypto_data.get('jpy', 0)
-            btc_price = crypto_data.get('btc', 0)
+            INTERACTION_DEFER.observe(time.perf_counter() - received, command=command)
             
-            embed.add_field(
-                name="💵 USD",
-                value=f"${usd_price:,.2f}" if usd_price >= 1 else f"${usd_price:.8f}",
-                inline=True
-            )
-            embed.add_field(
-                name="💴 JPY",
-                value=f"¥{jpy_price:,.2f}" if jpy_price >= 1 else f"¥{jpy_price:.8f}",
-                inline=True
+            await respond_with_deadline(
+                interaction, command, received, self.cache, [crypto_id], self.fetch_prices,
+                lambda data, from_cache, stale, note: self.crypto_embed(
+                    interaction, crypto_id, data[crypto_id], from_cache, stale,
+                    self.cache.fetched_at(crypto_id), label, note
+                ),
+                ephemeral=True
             )
-            embed.add_field(
-                name="🪙 BTC",
-                value=f"{btc_price:.8f}",
-                inline=True
+    
+    async def fetch_prices(self, crypto_ids: List[str]) -> Dict[str, dict]:
+        return await fetch_prices(self.cache, self.fetcher, crypto_ids)
+    
+    def crypto_embed(self, interaction, crypto_id, crypto_data, from_cache=False, stale=False, fetched_at=None,
+                     label=None, note=None) -> discord.Embed:
+        """暗号通貨情報のEmbed（同じデータ・表示条件なら作成済みのEmbedを再利用）"""
+        with span("render"):
+            return self.embeds.get_or_build(
+                ("coin", crypto_id, str(interaction.locale), from_cache, stale, note),
+                self.cache.version(crypto_id),
+                lambda: build_crypto_embed(crypto_id, crypto_data, from_cache, stale, fetched_at, label, note)
             )
-            
-            # 24時間変動率
-            change_24h = crypto_data.get('usd_24h_change')
-            if change_24h is not None:
-                change_emoji = "📈" if change_24h > 0 else "📉"
-                change_color = "+" if change_24h > 0 else ""
-                
-                embed.add_field(
-                    name=f"{change_emoji} 24時間変動",
-                    value=f"{change_color}{change_24h:.2f}%",
-                    inline=True
-                )
-            
-            # 時価総額
-            market_cap = crypto_data.get('usd_market_cap')
-            if market_cap and market_cap > 0:
-                embed.add_field(
-                    name="📊 時価総額 (USD)",
-                    value=f"${market_cap:,.0f}",
-                    inline=True
-                )
-            
-            # 24時間取引量
-            volume_24h = crypto_data.get('usd_24h_vol')
-            if volume_24h and volume_24h > 0:
-                embed.add_field(
-                    name="📦 24時間取引量 (USD)",
-                    value=f"${volume_24h:,.0f}",
-                    inline=True
-                )
-            
-            footer_text = "データ提供: CoinGecko API"
-            if from_cache:
-                footer_text += " (キャッシュ)"
-            embed.set_footer(text=footer_text)
-            
-            await interaction.followup.send(embed=embed, ephemeral=True)
-        
-        except Exception as e:
-            print(f"Embed送信エラー: {str(e)}")
-            await interaction.followup.send("❌ データの表示中にエラーが発生しました。", ephemeral=True)
-
 
 class CryptoPrices(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.ready = False
-        self.cache = CryptoCache(cache_duration=60)  # 60秒キャッシュ
+        self.cache = CryptoCache(cache_duration=60, stale_duration=600, max_entries=1024)  # 60秒新鮮 / 10分まで古いデータを返す
+        self.embeds = EmbedCache()
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.client: Optional[CoinGeckoClient] = None
+        self.source: Optional[PriceSource] = None
+        self.fetcher: Optional[HedgedPriceFetcher] = None  # クラスタモードでは ClusterClient
+        self.view: Optional[CryptoView] = None  # メニュー選択を受け付ける登録済みの永続ビュー
+        self.menu: Optional[CryptoView] = None  # メッセージに付けるメニュー（送信用）
+        self.snapshot = PriceSnapshotStore()
+        self.snapshot_saved_at = float("-inf")
+        self.history = PriceHistory()
+        self.alerts = AlertStore()
+        self.registry = CoinRegistry(priority=PREFETCH_CRYPTO_IDS)
+        self.watches = WatchStore()
+        self.watch_digests: Dict[int, str] = {}  # ウォッチID -> 最後に表示した内容のハッシュ
+        self.channel_edit_at: Dict[int, float] = {}  # チャンネルID -> 次に編集してよい時刻(monotonic)
+        self.watch_task: Optional[asyncio.Task] = None
+        self.alert_tasks: Set[asyncio.Task] = set()  # 送信中のアラート通知
+    
+    async def cog_load(self):
+        """スナップショットを復元し、価格の取得元を準備する"""
+        await self.load_snapshot()
+        await self.load_alerts()
+        await self.load_watches()
+        self.register_metrics()
+        
+        if CLUSTER_ID is not None:
+            # クラスタモード: 上流への問い合わせはリーダーの共有キャッシュに任せる（プロセス数に比例して増やさない）
+            client = ClusterClient(CLUSTER_ID, status=lambda: cluster_status(self.bot))
+            self.fetcher = client
+            self.source = client
+        else:
+            # CoinGecko用の共有HTTPセッション（接続を使い回してDNS/TLSのコストを削減）
+            self.session = create_session()
+            self.client = CoinGeckoClient(self.session)
+            self.fetcher = create_price_fetcher(self.session, self.client)
+            self.source = create_price_source(self.session, self.client, PREFETCH_CRYPTO_IDS, PREFETCH_INTERVAL)
+        await self.source.start(self.apply_prices)
+        
+        # メニューの選択は custom_id で登録済みのビューに届くため、過去に送ったメニューも再起動後にそのまま使える
+        self.view = CryptoView(self.cache, self.fetcher, self.embeds)
+        self.bot.add_view(self.view)
+        # 送信用は停止済みのビューにする（discord.py は停止済みのビューをメッセージごとに登録しない）
+        self.menu = CryptoView(self.cache, self.fetcher, self.embeds)
+        self.menu.stop()
+        
+        # クラスタモードでは一覧の取得はリーダーが行い、子プロセスは保存ファイルを読み直す
+        await self.registry.start(self.client)
+    
+    async def cog_unload(self):
+        """価格ソースを止め、スナップショットを保存して共有HTTPセッションを閉じる"""
+        if self.watch_task:
+            self.watch_task.cancel()
+        if self.view:
+            self.view.stop()  # 登録を解除（リロード時は cog_load で登録し直す）
+        if self.source:
+            await self.source.stop()
+        await self.registry.stop()
+        if self.alert_tasks:
+            # 索引から取り出し済みの通知は送り切る（待ちきれない分は諦める）
+            _, pending = await asyncio.wait(set(self.alert_tasks), timeout=5)
+            for task in pending:
+                task.cancel()
+        await self.save_snapshot()
+        if self.session and not self.session.closed:
+            await self.session.close()
+    
+    def register_metrics(self):
+        """キャッシュの統計を /metrics に公開"""
+        CACHE_LOOKUPS.set_function(lambda: self.cache.hits, result="hit")
+        CACHE_LOOKUPS.set_function(lambda: self.cache.stale_hits, result="stale")
+        CACHE_LOOKUPS.set_function(lambda: self.cache.misses, result="miss")
+        CACHE_HIT_RATIO.set_function(lambda: self.cache.stats()["hit_ratio"])
+        CACHE_ENTRIES.set_function(lambda: len(self.cache))
+        EMBED_CACHE_LOOKUPS.set_function(lambda: self.embeds.hits, result="hit")
+        EMBED_CACHE_LOOKUPS.set_function(lambda: self.embeds.misses, result="miss")
+    
+    async def load_snapshot(self):
+        """前回保存した価格をキャッシュに復元（古いデータとして扱う）"""
+        try:
+            entries = await asyncio.to_thread(self.snapshot.load)
+        except Exception as e:
+            logger.warning(f"⚠️ スナップショットの読み込みに失敗しました: {e}")
+            return
+        self.cache.restore(entries)
+        logger.info(
+            f"💾 スナップショットを復元しました: {len(entries)}件 / "
+            f"{self.snapshot.size_bytes / 1024:.1f}KB / {self.snapshot.last_load_ms:.1f}ms"
+        )
+    
+    async def load_alerts(self):
+        """保存済みの価格アラートを読み込む"""
+        try:
+            # クラスタモードでは担当するシャードのサーバー（とDM）のアラートだけを扱う
+            alerts = await asyncio.to_thread(self.alerts.read_saved, lambda guild_id: owns_guild(self.bot, guild_id))
+        except Exception as e:
+            logger.warning(f"⚠️ 価格アラートの読み込みに失敗しました: {e}")
+            return
+        # 索引の変更はイベントループ上で行う（価格更新時の発火判定と競合しないように）
+        count = self.alerts.replace(alerts)
+        logger.info(f"🔔 価格アラートを読み込みました: {count}件")
+    
+    async def load_watches(self):
+        """保存済みの自動更新メッセージを読み込む（更新はゲートウェイ接続後に始める）"""
+        try:
+            watches = await asyncio.to_thread(self.watches.read_saved, lambda guild_id: owns_guild(self.bot, guild_id))
+        except Exception as e:
+            logger.warning(f"⚠️ ウォッチの読み込みに失敗しました: {e}")
+            return
+        count = self.watches.replace(watches)
+        logger.info(f"📡 ウォッチを読み込みました: {count}件")
+    
+    async def save_snapshot(self):
+        """現在のキャッシュをスナップショットとして保存"""
+        self.snapshot_saved_at = time.monotonic()
+        if CLUSTER_ID not in (None, 0):
+            return  # クラスタモードでは全プロセスが同じ価格を持つため、保存はクラスタ0だけが行う
+        try:
+            await asyncio.to_thread(self.snapshot.save, self.cache.items())
+        except Exception as e:
+            logger.warning(f"⚠️ スナップショットの保存に失敗しました: {e}")
+    
+    async def apply_prices(self, data: Dict[str, dict], fetched_at: float):
+        """価格ソースから届いた価格をキャッシュ・履歴・アラートに反映する"""
+        for crypto_id, crypto_data in data.items():
+            self.cache.set(crypto_id, crypto_data, fetched_at)
+            self.history.record(crypto_id, fetched_at, crypto_data.get('usd'), crypto_data.get('provider', "CoinGecko"))
+        
+        self.check_alerts({crypto_id: crypto_data.get('usd') for crypto_id, crypto_data in data.items()})
+        
+        # ストリームでは頻繁に呼ばれるため、スナップショットの保存は間隔を空ける
+        if time.monotonic() - self.snapshot_saved_at >= SNAPSHOT_INTERVAL:
+            await self.save_snapshot()
     
     @commands.Cog.listener()
     async def on_ready(self):
-        """Cogが準備完了したことをマーク"""
+        """Cogが準備完了したことをマーク（再接続時にも呼ばれる）"""
         self.ready = True
-        print("✅ CryptoPrices Cog が準備完了しました")
+        if self.watch_task is None:
+            self.watch_task = asyncio.create_task(self.watch_loop(), name="crypto-watch")
+        logger.info("✅ CryptoPrices Cog が準備完了しました")
     
     @app_commands.command(name="crypto", description="暗号通貨の価格を表示します")
-    async def crypto_prices(self, interaction: discord.Interaction):
-        """暗号通貨の価格をドロップダウンから選択して表示"""
+    @app_commands.describe(coin="暗号通貨（名前・シンボルで検索。省略するとメニューから選択）")
+    async def crypto_prices(self, interaction: discord.Interaction, coin: Optional[str] = None):
+        """暗号通貨の価格を表示（coin を省略した場合はドロップダウンから選択）"""
+        received = time.perf_counter()
         try:
             # Botが準備完了しているか確認
             if not self.ready:
@@ -234,116 +822,448 @@ class CryptoPrices(commands.Cog):
                 )
                 return
             
-            view = CryptoView(self.cache)
+            if coin is not None:
+                await self.show_coin(interaction, coin)
+                return
+            
             embed = discord.Embed(
                 title="🪙 暗号通貨価格チェッカー",
                 description="下のドロップダウンメニューから暗号通貨を選択してください\n\n💡 価格データは60秒間キャッシュされます",
                 color=discord.Color.blue()
             )
-            await interaction.response.send_message(embed=embed, view=view)
+            await interaction.response.send_message(embed=embed, view=self.menu)
+            INTERACTION_DEFER.observe(time.perf_counter() - received, command="crypto")
         
         except discord.errors.NotFound:
-            print("⚠️ インタラクションがタイムアウトしました")
+            logger.warning("⚠️ インタラクションがタイムアウトしました")
         except Exception as e:
-            print(f"❌ crypto コマンドエラー: {e}")
+            logger.exception(f"❌ crypto コマンドエラー: {e}")
             try:
                 if not interaction.response.is_done():
                     await interaction.response.send_message("❌ エラーが発生しました", ephemeral=True)
             except:
                 pass
     
+    @crypto_prices.autocomplete("coin")
+    async def crypto_coin_autocomplete(self, interaction: discord.Interaction,
+                                       current: str) -> List[app_commands.Choice[str]]:
+        """コイン一覧の索引から前方一致する上位25件を返す"""
+        return [app_commands.Choice(name=coin.label, value=coin.coin_id) for coin in self.registry.search(current)]
+    
+    def resolve_coin(self, text: str) -> Optional[Tuple[str, Optional[str]]]:
+        """候補から選ばれたID、または入力された名前・シンボルを (通貨ID, 表示名) に解決"""
+        coin = self.registry.resolve(text)
+        if coin is not None:
+            return coin.coin_id, coin.label
+        if text.strip().lower() in CRYPTO_LABELS:
+            # コイン一覧をまだ取得できていない場合もメニューの通貨は表示できる
+            return text.strip().lower(), None
+        return None
+    
+    async def show_coin(self, interaction: discord.Interaction, text: str):
+        """/crypto <coin>: 指定された通貨の価格を表示"""
+        resolved = self.resolve_coin(text)
+        if resolved is None:
+            await interaction.response.send_message(
+                f"❌ 「{text[:50]}」に一致する暗号通貨が見つかりません。候補から選択してください。",
+                ephemeral=True
+            )
+            return
+        crypto_id, label = resolved
+        await self.view.show_crypto(interaction, crypto_id, command="crypto", label=label)
+    
     @app_commands.command(name="crypto_list", description="主要な暗号通貨の価格を一覧表示します")
     async def crypto_list(self, interaction: discord.Interaction):
         """人気の暗号通貨の価格を一覧表示"""
-        await interaction.response.defer()
+        with trace("crypto_list", str(interaction.id), guild_id=interaction.guild_id):
+            received = time.perf_counter()
+            with span("defer"):
+                await interaction.response.defer()
+            INTERACTION_DEFER.observe(time.perf_counter() - received, command="crypto_list")
+            
+            # 通貨ごとのキャッシュから組み立てる（/crypto で取得済みの通貨はそのまま使う）
+            await respond_with_deadline(
+                interaction, "crypto_list", received, self.cache, LIST_CRYPTO_IDS, self.fetch_prices,
+                lambda data, from_cache, stale, note: self.list_embed(interaction, data, from_cache, stale, note)
+            )
+    
+    async def fetch_prices(self, crypto_ids: List[str]) -> Dict[str, dict]:
+        return await fetch_prices(self.cache, self.fetcher, crypto_ids)
+    
+    def list_embed(self, interaction, data, from_cache=False, stale=False, note=None) -> discord.Embed:
+        """一覧表示用のEmbed（含まれる通貨の版がすべて同じなら作成済みのEmbedを再利用）"""
+        with span("render"):
+            _, fetched_at, versions = self.cache.summary(list(data))
+            return self.embeds.get_or_build(
+                ("list", "crypto_list", str(interaction.locale), from_cache, stale, note),
+                versions,
+                lambda: build_list_embed(data, from_cache, stale, fetched_at, note)
+            )
+    
+    @app_commands.command(name="crypto_chart", description="暗号通貨の価格推移と統計を表示します")
+    @app_commands.describe(coin="暗号通貨", window="集計する期間")
+    @app_commands.choices(
+        coin=[app_commands.Choice(name=opt.label, value=opt.value) for opt in CRYPTO_OPTIONS],
+        window=[app_commands.Choice(name=label, value=seconds) for label, seconds in CHART_WINDOWS.items()]
+    )
+    async def crypto_chart(self, interaction: discord.Interaction,
+                           coin: app_commands.Choice[str], window: app_commands.Choice[int]):
+        """メモリ上の価格履歴から推移を表示（APIは呼び出さない）"""
+        since = time.time() - window.value
+        timestamps, prices = self.history.window(coin.value, since)
+        if len(prices) < 2:
+            await interaction.response.send_message(
+                "⚠️ 価格履歴がまだ十分にありません。しばらく待ってから再度お試しください。",
+                ephemeral=True
+            )
+            return
         
-        # キャッシュチェック
-        cache_key = "crypto_list"
-        cached_data = self.cache.get(cache_key)
+        stats = summarize(prices)
+        change_emoji = "📈" if stats["change"] > 0 else "📉"
+        embed = discord.Embed(
+            title=f"{change_emoji} {coin.name} 価格推移 ({window.name})",
+            description=f"```\n{sparkline(prices)}\n```",
+            color=discord.Color.gold(),
+            timestamp=data_timestamp(timestamps[-1])
+        )
+        embed.add_field(name="💵 現在", value=format_usd(stats["last"]), inline=True)
+        embed.add_field(name="⬆️ 最高", value=format_usd(stats["max"]), inline=True)
+        embed.add_field(name="⬇️ 最低", value=format_usd(stats["min"]), inline=True)
+        embed.add_field(name="➗ 平均", value=format_usd(stats["mean"]), inline=True)
+        embed.add_field(name="🔀 期間中の変動", value=f"{stats['change']:+.2f}%", inline=True)
+        embed.add_field(name="🌪️ ボラティリティ", value=f"{stats['volatility']:.3f}%", inline=True)
+        providers = " / ".join(self.history.providers_since(coin.value, since)) or "CoinGecko"
+        embed.set_footer(text=f"データ提供: {providers} API ({stats['count']}件の価格から集計)")
         
-        if cached_data:
-            await self.send_list_embed(interaction, cached_data, from_cache=True)
+        await interaction.response.send_message(embed=embed)
+    
+    # --- 価格アラート ---
+    alert_group = app_commands.Group(name="crypto_alert", description="暗号通貨の価格アラートを管理します")
+    
+    @alert_group.command(name="add", description="価格が指定した値を超えた/下回ったときに通知します")
+    @app_commands.describe(coin="暗号通貨", direction="通知する条件", price="しきい値 (USD)")
+    @app_commands.choices(
+        coin=[app_commands.Choice(name=opt.label, value=opt.value) for opt in CRYPTO_OPTIONS],
+        direction=[
+            app_commands.Choice(name="以上になったら", value=ABOVE),
+            app_commands.Choice(name="以下になったら", value=BELOW),
+        ]
+    )
+    async def alert_add(self, interaction: discord.Interaction, coin: app_commands.Choice[str],
+                        direction: app_commands.Choice[str], price: app_commands.Range[float, 1e-8]):
+        """価格アラートを登録（現在の価格がすでに条件を満たしている場合は登録しない）"""
+        if len(self.alerts.for_user(interaction.user.id)) >= MAX_ALERTS_PER_USER:
+            await interaction.response.send_message(
+                f"⚠️ 登録できるアラートは1人あたり{MAX_ALERTS_PER_USER}件までです。",
+                ephemeral=True
+            )
+            return
+        
+        current = (self.cache.peek(coin.value) or {}).get('usd')
+        if current is not None and (current >= price if direction.value == ABOVE else current <= price):
+            await interaction.response.send_message(
+                f"⚠️ **{coin.name}** の現在の価格 ({format_usd(current)}) はすでに "
+                f"{format_usd(price)} {'以上' if direction.value == ABOVE else '以下'}です。",
+                ephemeral=True
+            )
             return
         
         try:
-            # 主要な暗号通貨のIDリスト
-            crypto_ids = "bitcoin,ethereum,ripple,cardano,solana,polkadot,dogecoin,avalanche-2,chainlink,matic-network"
-            
-            async with aiohttp.ClientSession() as session:
-                url = f"https://api.coingecko.com/api/v3/simple/price?ids={crypto_ids}&vs_currencies=usd,jpy&include_24hr_change=true"
-                
-                async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        self.cache.set(cache_key, data)
-                        await self.send_list_embed(interaction, data)
-                    
-                    elif response.status == 429:
-                        await interaction.followup.send(
-                            "⚠️ APIのレート制限に達しました。しばらく待ってから再度お試しください。"
-                        )
-                    
-                    else:
-                        error_text = await response.text()
-                        print(f"API Error {response.status}: {error_text}")
-                        await interaction.followup.send(
-                            f"❌ API エラー (ステータス: {response.status})"
-                        )
-        
-        except asyncio.TimeoutError:
-            await interaction.followup.send("❌ API接続がタイムアウトしました。")
+            alert = await asyncio.to_thread(
+                self.alerts.save, interaction.user.id, interaction.channel_id, coin.value, direction.value, price,
+                interaction.guild_id
+            )
         except Exception as e:
-            print(f"crypto_list エラー: {str(e)}")
-            await interaction.followup.send(f"❌ エラーが発生しました: {str(e)}")
-    
-    async def send_list_embed(self, interaction, data, from_cache=False):
-        """一覧表示用のEmbedを送信"""
-        embed = discord.Embed(
-            title="📊 主要暗号通貨 価格一覧",
-            color=discord.Color.gold(),
-            timestamp=discord.utils.utcnow()
+            logger.exception(f"❌ アラート登録エラー: {e}")
+            await interaction.response.send_message("❌ アラートの登録中にエラーが発生しました。", ephemeral=True)
+            return
+        self.alerts.index_alert(alert)
+        
+        await interaction.response.send_message(
+            f"🔔 アラート #{alert.alert_id} を登録しました: **{coin.name}** が "
+            f"{format_usd(price)} {direction.name}このチャンネルで通知します。",
+            ephemeral=True
         )
+    
+    @alert_group.command(name="list", description="登録中の価格アラートを表示します")
+    async def alert_list(self, interaction: discord.Interaction):
+        """自分のアラート一覧"""
+        alerts = self.alerts.for_user(interaction.user.id)
+        if not alerts:
+            await interaction.response.send_message("登録中のアラートはありません。", ephemeral=True)
+            return
         
-        crypto_names = {
-            "bitcoin": "Bitcoin (BTC)",
-            "ethereum": "Ethereum (ETH)",
-            "ripple": "Ripple (XRP)",
-            "cardano": "Cardano (ADA)",
-            "solana": "Solana (SOL)",
-            "polkadot": "Polkadot (DOT)",
-            "dogecoin": "Dogecoin (DOGE)",
-            "avalanche-2": "Avalanche (AVAX)",
-            "chainlink": "Chainlink (LINK)",
-            "matic-network": "Polygon (MATIC)"
-        }
+        lines = [
+            f"#{alert.alert_id} {CRYPTO_LABELS.get(alert.crypto_id, alert.crypto_id)} "
+            f"{'≥' if alert.direction == ABOVE else '≤'} {format_usd(alert.threshold)} (<#{alert.channel_id}>)"
+            for alert in alerts
+        ]
+        embed = discord.Embed(title="🔔 登録中の価格アラート", description="\n".join(lines), color=discord.Color.blue())
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    
+    @alert_group.command(name="remove", description="価格アラートを削除します")
+    @app_commands.describe(alert_id="削除するアラートの番号 (/crypto_alert list で確認)")
+    async def alert_remove(self, interaction: discord.Interaction, alert_id: int):
+        """自分のアラートを削除"""
+        alert = self.alerts.alerts.get(alert_id)
+        if alert is None or alert.user_id != interaction.user.id:
+            await interaction.response.send_message("❌ 指定されたアラートが見つかりません。", ephemeral=True)
+            return
         
-        for crypto_id, crypto_data in data.items():
-            name = crypto_names.get(crypto_id, crypto_id.title())
-            usd_price = crypto_data.get('usd', 0)
-            jpy_price = crypto_data.get('jpy', 0)
-            change_24h = crypto_data.get('usd_24h_change')
-            
-            usd_str = f"${usd_price:,.2f}" if usd_price >= 1 else f"${usd_price:.8f}"
-            jpy_str = f"¥{jpy_price:,.2f}" if jpy_price >= 1 else f"¥{jpy_price:.8f}"
-            
-            if change_24h is not None:
-                change_emoji = "📈" if change_24h > 0 else "📉"
-                change_text = f"{change_emoji} {change_24h:+.2f}%"
+        self.alerts.unindex([alert_id])
+        await asyncio.to_thread(self.alerts.delete_saved, [alert_id])
+        await interaction.response.send_message(f"🗑️ アラート #{alert_id} を削除しました。", ephemeral=True)
+    
+    def check_alerts(self, prices: Dict[str, float]) -> Optional[asyncio.Task]:
+        """更新された価格でアラートを判定し、通知は別タスクで送る
+        
+        価格ソースやクラスタの受信処理から呼ばれるため、Discordのレート制限で待たせないようにする。
+        """
+        triggered = self.alerts.pop_triggered(prices)
+        if not triggered:
+            return None
+        task = asyncio.create_task(self.notify_alerts(triggered, prices), name="crypto-alerts")
+        self.alert_tasks.add(task)
+        task.add_done_callback(self._on_alert_task_done)
+        return task
+    
+    def _on_alert_task_done(self, task: asyncio.Task):
+        self.alert_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("❌ アラート通知でエラーが発生しました", exc_info=task.exception())
+    
+    async def notify_alerts(self, triggered: list, prices: Dict[str, float]):
+        """発火したアラートを保存データから削除し、チャンネルごとにまとめて通知"""
+        try:
+            await asyncio.to_thread(self.alerts.delete_saved, [alert.alert_id for alert in triggered])
+        except Exception as e:
+            logger.warning(f"⚠️ 発火したアラートの削除に失敗しました: {e}")
+        
+        by_channel = defaultdict(list)
+        for alert in triggered:
+            by_channel[alert.channel_id].append(alert)
+        await asyncio.gather(*(
+            self.send_alert_batch(channel_id, alerts, prices) for channel_id, alerts in by_channel.items()
+        ))
+    
+    async def send_alert_batch(self, channel_id: int, alerts: list, prices: Dict[str, float]):
+        """1つのチャンネル宛てのアラートをまとめて送信（2000文字ごとに分割）"""
+        lines = []
+        for alert in alerts:
+            condition = "以上" if alert.direction == ABOVE else "以下"
+            lines.append(
+                f"🔔 <@{alert.user_id}> **{CRYPTO_LABELS.get(alert.crypto_id, alert.crypto_id)}** が "
+                f"{format_usd(alert.threshold)} {condition}になりました (現在 {format_usd(prices[alert.crypto_id])})"
+            )
+        
+        messages = []
+        current = ""
+        for line in lines:
+            if current and len(current) + len(line) + 1 > 2000:
+                messages.append(current)
+                current = ""
+            current = f"{current}\n{line}" if current else line
+        messages.append(current)
+        
+        try:
+            channel = self.bot.get_channel(channel_id) or await self.bot.fetch_channel(channel_id)
+            for content in messages:
+                await channel.send(content, allowed_mentions=discord.AllowedMentions(users=True))
+        except Exception as e:
+            logger.warning(f"⚠️ アラート通知の送信に失敗しました (チャンネル: {channel_id}): {e}")
+    
+    
+    # --- 自動更新メッセージ ---
+    watch_group = app_commands.Group(
+        name="crypto_watch", description="価格を自動更新するメッセージを管理します",
+        guild_only=True, default_permissions=discord.Permissions(manage_messages=True)
+    )
+    
+    @watch_group.command(name="start", description="このチャンネルに価格を自動更新するメッセージを作成します")
+    @app_commands.describe(coins="通貨（名前・シンボル・IDをカンマ区切り。省略時は主要10通貨）", pin="メッセージをピン留めする")
+    async def watch_start(self, interaction: discord.Interaction, coins: Optional[str] = None, pin: bool = True):
+        """自動更新メッセージを作成して登録"""
+        if len(self.watches.for_guild(interaction.guild_id)) >= MAX_WATCHES_PER_GUILD:
+            await interaction.response.send_message(
+                f"⚠️ 1つのサーバーで使えるウォッチは{MAX_WATCHES_PER_GUILD}件までです。", ephemeral=True
+            )
+            return
+        
+        crypto_ids = []
+        unknown = []
+        for text in (coins.replace("、", ",").split(",") if coins else LIST_CRYPTO_IDS):
+            if not text.strip():
+                continue
+            resolved = self.resolve_coin(text)
+            if resolved is None:
+                unknown.append(text.strip()[:30])
             else:
-                change_text = "N/A"
-            
-            embed.add_field(
-                name=name,
-                value=f"💵 {usd_str}\n💴 {jpy_str}\n{change_text}",
-                inline=True
+                crypto_ids.append(resolved[0])
+        crypto_ids = list(dict.fromkeys(crypto_ids))
+        if unknown or not crypto_ids:
+            await interaction.response.send_message(
+                f"❌ 見つからない暗号通貨があります: {', '.join(unknown) or '(未指定)'}", ephemeral=True
+            )
+            return
+        if len(crypto_ids) > MAX_WATCH_COINS:
+            await interaction.response.send_message(
+                f"⚠️ 1つのウォッチに表示できる通貨は{MAX_WATCH_COINS}件までです。", ephemeral=True
+            )
+            return
+        
+        await interaction.response.defer()
+        try:
+            data = await self.cache.get_many(crypto_ids, self.fetch_prices)
+        except CryptoAPIError as e:
+            await interaction.followup.send(e.message)
+            return
+        if not data:
+            await interaction.followup.send("❌ データが見つかりませんでした。")
+            return
+        
+        embed = self.watch_embed(crypto_ids, data)
+        message = await interaction.followup.send(embed=embed, wait=True)
+        try:
+            watch = await asyncio.to_thread(
+                self.watches.save, interaction.guild_id, interaction.channel_id, message.id, interaction.user.id, crypto_ids
             )
+        except Exception as e:
+            logger.exception(f"❌ ウォッチ登録エラー: {e}")
+            await interaction.followup.send("❌ ウォッチの登録中にエラーが発生しました。", ephemeral=True)
+            return
+        self.watches.track(watch)
+        self.watch_digests[watch.watch_id] = embed_digest(embed)
+        
+        notice = f"📡 ウォッチ #{watch.watch_id} を開始しました。{WATCH_INTERVAL:.0f}秒ごとに更新します。"
+        if pin:
+            try:
+                await self.watch_message(watch).pin(reason=f"/crypto_watch #{watch.watch_id}")
+            except discord.HTTPException as e:
+                logger.warning(f"⚠️ ウォッチ #{watch.watch_id} をピン留めできませんでした: {e}")
+                notice += "\n⚠️ ピン留めできませんでした（BOTにメッセージの管理権限が必要です）。"
+        await interaction.followup.send(notice, ephemeral=True)
+    
+    @watch_group.command(name="list", description="このサーバーの自動更新メッセージを表示します")
+    async def watch_list(self, interaction: discord.Interaction):
+        """サーバー内のウォッチ一覧"""
+        watches = self.watches.for_guild(interaction.guild_id)
+        if not watches:
+            await interaction.response.send_message("自動更新中のメッセージはありません。", ephemeral=True)
+            return
+        
+        lines = [
+            f"#{watch.watch_id} <#{watch.channel_id}> {len(watch.crypto_ids)}通貨 "
+            f"https://discord.com/channels/{watch.guild_id}/{watch.channel_id}/{watch.message_id}"
+            for watch in watches
+        ]
+        await interaction.response.send_message("📡 **自動更新中のメッセージ**\n" + "\n".join(lines), ephemeral=True)
+    
+    @watch_group.command(name="stop", description="メッセージの自動更新を停止します")
+    @app_commands.describe(watch_id="停止するウォッチの番号 (/crypto_watch list で確認)")
+    async def watch_stop(self, interaction: discord.Interaction, watch_id: int):
+        """ウォッチを停止してピン留めを外す"""
+        watch = self.watches.watches.get(watch_id)
+        if watch is None or watch.guild_id != interaction.guild_id:
+            await interaction.response.send_message("❌ 指定されたウォッチが見つかりません。", ephemeral=True)
+            return
         
-        footer_text = "データ提供: CoinGecko API"
-        if from_cache:
-            footer_text += " (キャッシュ)"
-        embed.set_footer(text=footer_text)
+        self.watches.untrack([watch_id])
+        self.watch_digests.pop(watch_id, None)
+        await asyncio.to_thread(self.watches.delete_saved, [watch_id])
+        try:
+            await self.watch_message(watch).unpin(reason=f"/crypto_watch stop #{watch_id}")
+        except discord.HTTPException:
+            pass
+        await interaction.response.send_message(f"⏹️ ウォッチ #{watch_id} を停止しました。", ephemeral=True)
+    
+    def watch_message(self, watch: Watch) -> discord.PartialMessage:
+        return self.bot.get_partial_messageable(watch.channel_id, guild_id=watch.guild_id).get_partial_message(
+            watch.message_id
+        )
+    
+    def watch_embed(self, crypto_ids, data) -> discord.Embed:
+        """自動更新メッセージのEmbed"""
+        labels = {}
+        for crypto_id in crypto_ids:
+            coin = self.registry.get(crypto_id)
+            if coin is not None:
+                labels[crypto_id] = coin.label
+        stale, fetched_at, _ = self.cache.summary(list(data))
+        # 取得に失敗して期限切れのデータ（last_known）を表示する場合も古いデータとして示す
+        stale = stale or any(crypto_id not in self.cache for crypto_id in data)
+        return build_list_embed(
+            data, stale=stale, fetched_at=fetched_at, note=f"🔄 {WATCH_INTERVAL:.0f}秒ごとに自動更新",
+            title="📡 暗号通貨 価格ウォッチ", labels=labels
+        )
+    
+    async def watch_loop(self):
+        """全ウォッチを1つの周期でまとめて更新する"""
+        while True:
+            started = time.monotonic()
+            try:
+                await self.update_watches()
+            except Exception as e:
+                logger.exception(f"❌ ウォッチの更新でエラーが発生しました: {e}")
+            await asyncio.sleep(max(0.0, WATCH_INTERVAL - (time.monotonic() - started)))
+    
+    async def update_watches(self):
+        """全ウォッチの通貨をまとめて取得し、表示が変わったメッセージだけを編集"""
+        if not self.watches:
+            return
+        
+        # 新鮮でない通貨だけを1回のリクエストでまとめて取得（先読み対象の通貨は通常キャッシュ済み）
+        due = [crypto_id for crypto_id in self.watches.crypto_ids() if self.cache.get(crypto_id) is None]
+        if due:
+            try:
+                await asyncio.gather(*self.cache.refresh(due, self.fetch_prices))
+            except CryptoAPIError as e:
+                logger.warning(f"⚠️ ウォッチ用の価格の取得に失敗しました: {e.message}")  # 前回取得したデータで続ける
         
-        await interaction.followup.send(embed=embed)
+        by_channel = defaultdict(list)
+        for watch in list(self.watches.watches.values()):
+            data = {}
+            for crypto_id in watch.crypto_ids:
+                crypto_data = self.cache.last_known(crypto_id)
+                if crypto_data is not None:
+                    data[crypto_id] = crypto_data
+            if not data:
+                continue
+            embed = self.watch_embed(watch.crypto_ids, data)
+            digest = embed_digest(embed)
+            if self.watch_digests.get(watch.watch_id) == digest:
+                WATCH_EDITS.inc(result="unchanged")
+                continue
+            by_channel[watch.channel_id].append((watch, embed, digest))
+        
+        semaphore = asyncio.Semaphore(WATCH_EDIT_CONCURRENCY)
+        await asyncio.gather(*(
+            self.edit_watch_messages(channel_id, edits, semaphore) for channel_id, edits in by_channel.items()
+        ))
+    
+    async def edit_watch_messages(self, channel_id: int, edits: list, semaphore: asyncio.Semaphore):
+        """1つのチャンネルのウォッチを、チャンネルごとのレート制限に収まる間隔で順に編集"""
+        for watch, embed, digest in edits:
+            wait = self.channel_edit_at.get(channel_id, 0.0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            async with semaphore:
+                self.channel_edit_at[channel_id] = time.monotonic() + WATCH_CHANNEL_EDIT_INTERVAL
+                try:
+                    await self.watch_message(watch).edit(embed=embed)
+                except (discord.NotFound, discord.Forbidden) as e:
+                    # メッセージが削除された・権限がなくなった場合はウォッチを終了する
+                    logger.info(f"📤 ウォッチ #{watch.watch_id} を終了しました (メッセージを編集できません: {e})")
+                    self.watches.untrack([watch.watch_id])
+                    self.watch_digests.pop(watch.watch_id, None)
+                    await asyncio.to_thread(self.watches.delete_saved, [watch.watch_id])
+                    WATCH_EDITS.inc(result="removed")
+                    continue
+                except discord.HTTPException as e:
+                    logger.warning(f"⚠️ ウォッチ #{watch.watch_id} の更新に失敗しました: {e}")
+                    WATCH_EDITS.inc(result="error")
+                    continue
+            self.watch_digests[watch.watch_id] = digest
+            WATCH_EDITS.inc(result="edited")
 
 
 async def setup(bot):
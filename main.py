@@ -1,115 +1,265 @@
+# 起動時間の計測のため、他のモジュールより先に読み込む
+from utils.timeline import TIMELINE
+
 import discord
 from discord.ext import commands
+import logging
 import os
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import threading
+from aiohttp import web
 import asyncio
+import hashlib
+import json
+import signal
 import sys
+import time
+from typing import Optional
+
+from utils.cluster import (
+    CLUSTER_ID, CLUSTER_PROCESSES, SHARD_COUNT, SHARD_IDS, ClusterLauncher, PriceLeader,
+    fetch_recommended_shards, shard_status
+)
+from utils.logs import setup_logging, slow_traces
+from utils.metrics import REGISTRY
+from utils.snapshot import DATA_DIR
+
+TIMELINE.mark("imports_done")
+
+logger = logging.getLogger("bot")
 
 # --- 1. BOTクライアントとセットアップ ---
 # intentsの設定
 intents = discord.Intents.default()
 intents.message_content = True  # メッセージコンテンツを取得（必要に応じて）
-client = commands.Bot(command_prefix='!', intents=intents)
 
-# --- 2. HTTPサーバーの設定（RenderのWeb Serviceとして必須） ---
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        # ヘルスチェック用のエンドポイント
-        if self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            
-            # BOTのステータス情報を返す
-            status = "Online" if client.is_ready() else "Starting..."
-            response = f"""
-            <html>
-            <head><title>Discord Bot Status</title></head>
-            <body>
-                <h1>Discord Bot is {status}!</h1>
-                <p>Bot User: {client.user if client.user else 'Not logged in'}</p>
-                <p>Guilds: {len(client.guilds) if client.is_ready() else 'N/A'}</p>
-            </body>
-            </html>
-            """
-            self.wfile.write(response.encode())
-        elif self.path == '/health':
-            # シンプルなヘルスチェック
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(b'{"status":"ok"}')
-        else:
-            self.send_response(404)
-            self.end_headers()
-
-    def log_message(self, format, *args):
-        # アクセスログを抑制（オプション）
-        pass
-
-def run_web_server():
-    """Webサーバーを起動"""
-    try:
-        port = int(os.environ.get("PORT", 8080))
-        server = HTTPServer(('0.0.0.0', port), HealthCheckHandler)
-        print(f"🌐 Webサーバーがポート {port} で起動しました")
-        server.serve_forever()
-    except Exception as e:
-        print(f"❌ Webサーバー起動エラー: {e}")
+# 読み込むCogs
+COGS = ['cogs.boot', 'cogs.crypto_prices']
 
-# --- 3. イベントとCogsの読み込み ---
-@client.event
-async def on_ready():
-    """BOT起動時の処理"""
-    print('=' * 50)
-    print(f'✅ ログイン成功: {client.user} (ID: {client.user.id})')
-    print(f'📊 接続サーバー数: {len(client.guilds)}')
-    print('=' * 50)
+# 前回同期したコマンドツリーのハッシュの保存先
+COMMAND_HASH_PATH = os.path.join(DATA_DIR, "command_tree.sha256")
+
+class Bot(commands.AutoShardedBot):
+    """シャード数はDiscordの推奨値（DISCORD_SHARD_COUNT で指定可）。クラスタモードでは担当するシャードだけに接続する"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.web_runner = None  # setup_hookで起動したWebサーバー
+        self.closing: Optional[asyncio.Task] = None  # SIGTERMで始めた終了処理
     
-    # Cogsを読み込む
-    cogs_list = ['cogs.boot', 'cogs.crypto_prices']
-    loaded_cogs = []
-    failed_cogs = []
+    async def setup_hook(self):
+        """ログイン後・ゲートウェイ接続前の初期化処理（再接続では呼ばれない）"""
+        TIMELINE.mark("login")
+        # Renderの停止やClusterLauncher.stopはSIGTERMで届く（Client.runが通常終了するのはCtrl+Cだけ）
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self.handle_sigterm)
+        # クラスタモードではリーダーがWebサーバーを持ち、各プロセスのシャードの状態をまとめて返す
+        if CLUSTER_ID is None:
+            try:
+                self.web_runner = await start_web_server()
+                TIMELINE.mark("web_server_up")
+            except Exception as e:
+                logger.exception(f"❌ Webサーバー起動エラー: {e}")
+        
+        await self.load_cogs()
+        TIMELINE.mark("cogs_loaded")
+        # コマンドはアプリケーション単位なので、同期はクラスタ0だけが行う
+        if CLUSTER_ID in (None, 0):
+            await self.sync_commands()
+        TIMELINE.mark("tree_synced")
     
-    for cog in cogs_list:
+    async def load_cogs(self):
+        """Cogsを並行して読み込む"""
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(self.load_extension(cog) for cog in COGS),
+            return_exceptions=True
+        )
+        
+        failed_cogs = []
+        for cog, result in zip(COGS, results):
+            if isinstance(result, Exception):
+                failed_cogs.append(cog)
+                logger.error(f"❌ Cog '{cog}' のロードエラー: {result}", exc_info=result)
+            else:
+                logger.info(f"✅ Cog '{cog}' をロードしました")
+        
+        logger.info(f"📦 ロード成功: {len(COGS) - len(failed_cogs)}/{len(COGS)} Cogs ({time.perf_counter() - started:.2f}秒)")
+        if failed_cogs:
+            logger.warning(f"⚠️  ロード失敗: {', '.join(failed_cogs)}")
+    
+    def command_tree_hash(self) -> str:
+        """スラッシュコマンド定義の安定したハッシュ"""
+        payload = []
+        for command in sorted(self.tree.get_commands(), key=lambda c: c.name):
+            try:
+                payload.append(command.to_dict(self.tree))
+            except TypeError:
+                # discord.py 2.4 より前は引数なし
+                payload.append(command.to_dict())
+        encoded = json.dumps([self.application_id, payload], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+    
+    async def sync_commands(self):
+        """コマンド定義が前回の同期から変わっている場合のみDiscordに同期"""
+        tree_hash = self.command_tree_hash()
+        try:
+            with open(COMMAND_HASH_PATH, encoding="utf-8") as f:
+                synced_hash = f.read().strip()
+        except OSError:
+            synced_hash = None
+        
+        if tree_hash == synced_hash:
+            logger.info("⏭️  コマンド定義に変更がないため同期をスキップしました")
+            return
+        
         try:
-            await client.load_extension(cog)
-            loaded_cogs.append(cog)
-            print(f"✅ Cog '{cog}' をロードしました")
+            logger.info("🔄 コマンドを同期中...")
+            synced = await self.tree.sync()
+            logger.info(
+                f"✅ {len(synced)} 個のコマンドを同期しました",
+                extra={"commands": [f"/{command.name}" for command in synced]}
+            )
         except Exception as e:
-            failed_cogs.append(cog)
-            print(f"❌ Cog '{cog}' のロードエラー: {e}")
+            logger.exception(f"❌ コマンド同期エラー: {e}")
+            return
+        
+        try:
+            os.makedirs(os.path.dirname(COMMAND_HASH_PATH), exist_ok=True)
+            with open(COMMAND_HASH_PATH, "w", encoding="utf-8") as f:
+                f.write(tree_hash)
+        except OSError as e:
+            logger.warning(f"⚠️ コマンド定義のハッシュを保存できませんでした: {e}")
     
-    print('-' * 50)
+    def handle_sigterm(self):
+        """close() でCogを外し（スナップショットを保存して）から終了する"""
+        if self.closing is None:
+            logger.warning("⚠️  終了シグナルを受け取りました。BOTを停止します")
+            self.closing = asyncio.create_task(self.close())
     
-    # スラッシュコマンドをDiscordに同期
+    async def close(self):
+        """BOT終了時にWebサーバーも停止"""
+        if self.web_runner:
+            await self.web_runner.cleanup()
+        await super().close()
+
+client = Bot(command_prefix='!', intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+
+# ゲートウェイのレイテンシ（未接続の間はNaN）
+GATEWAY_LATENCY = REGISTRY.gauge("discord_gateway_latency_seconds", "Discordゲートウェイのレイテンシ")
+GATEWAY_LATENCY.set_function(lambda: client.latency)
+
+# --- 2. HTTPサーバーの設定（RenderのWeb Serviceとして必須） ---
+# BOTと同じイベントループ上で動かすため、client の状態を安全に参照できる
+async def handle_index(request: web.Request) -> web.Response:
+    """BOTのステータス情報を返す"""
+    leader = request.app.get("leader")
+    if leader is not None:
+        # クラスタモード: 各プロセスから報告された状態を集計
+        health = leader.health(request.app["launcher"])
+        ready = health["ready"]
+        user = f"{len(health['clusters'])} clusters / {len(health['shards'])} shards"
+        guilds = health["guilds"]
+    else:
+        ready = client.is_ready()
+        user = client.user if client.user else 'Not logged in'
+        guilds = len(client.guilds) if ready else 'N/A'
+    status = "Online" if ready else "Starting..."
+    response = f"""
+    <html>
+    <head><title>Discord Bot Status</title></head>
+    <body>
+        <h1>Discord Bot is {status}!</h1>
+        <p>Bot User: {user}</p>
+        <p>Guilds: {guilds}</p>
+    </body>
+    </html>
+    """
+    return web.Response(text=response, content_type='text/html')
+
+async def handle_health(request: web.Request) -> web.Response:
+    """ヘルスチェック（起動フェーズごとの所要時間とシャードごとの状態を含む）"""
+    leader = request.app.get("leader")
+    if leader is not None:
+        # クラスタモード: リーダー自身の起動時間と、各プロセスから報告されたシャードの状態
+        return web.json_response({
+            "status": "ok",
+            **leader.health(request.app["launcher"]),
+            "startup": TIMELINE.to_dict(),
+        })
+    return web.json_response({
+        "status": "ok",
+        "ready": client.is_ready(),
+        "shards": shard_status(client),
+        "startup": TIMELINE.to_dict(),
+    })
+
+async def handle_traces(request: web.Request) -> web.Response:
+    """サンプリングした遅いインタラクションのトレース（新しい順、?limit= で件数を指定）
+    
+    クラスタモードでは子プロセスから報告されたトレースを返す。
+    """
     try:
-        print("🔄 コマンドを同期中...")
-        synced = await client.tree.sync()
-        print(f"✅ {len(synced)} 個のコマンドを同期しました:")
-        for command in synced:
-            print(f"   • /{command.name}: {command.description}")
-    except Exception as e:
-        print(f"❌ コマンド同期エラー: {e}")
+        limit = int(request.query.get("limit", 20))
+    except ValueError:
+        limit = 20
+    leader = request.app.get("leader")
+    traces = slow_traces(limit) if leader is None else leader.slow_traces(limit)
+    return web.json_response({"traces": traces})
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """Prometheus形式のメトリクス（クラスタモードでは子プロセスの分も cluster ラベルを付けて出力）"""
+    leader = request.app.get("leader")
+    return web.Response(
+        text=REGISTRY.render() if leader is None else REGISTRY.render_merged(leader.metrics),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    )
+
+async def start_web_server(leader: PriceLeader = None, launcher: ClusterLauncher = None) -> web.AppRunner:
+    """Webサーバーを起動（クラスタモードではリーダーと子プロセスの状態を渡す）"""
+    app = web.Application()
+    if leader is not None:
+        app["leader"] = leader
+        app["launcher"] = launcher
+    app.router.add_get('/', handle_index)
+    app.router.add_get('/health', handle_health)
+    app.router.add_get('/metrics', handle_metrics)
+    app.router.add_get('/traces', handle_traces)
     
-    print('-' * 50)
-    print(f"📦 ロード成功: {len(loaded_cogs)}/{len(cogs_list)} Cogs")
-    if failed_cogs:
-        print(f"⚠️  ロード失敗: {', '.join(failed_cogs)}")
-    print('=' * 50)
-    print("🚀 BOTの準備が完了しました！")
-    print('=' * 50)
+    # access_log=None でアクセスログを抑制
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = int(os.environ.get("PORT", 8080))
+    site = web.TCPSite(runner, '0.0.0.0', port)
+    await site.start()
+    logger.info(f"🌐 Webサーバーがポート {port} で起動しました")
+    return runner
+
+# --- 3. イベントとCogsの読み込み ---
+@client.event
+async def on_ready():
+    """BOT起動時・再接続時の処理（Cogsの読み込みとコマンド同期は setup_hook で済ませている）"""
+    TIMELINE.mark("gateway_ready")
+    logger.info(
+        f"🚀 BOTの準備が完了しました: {client.user} (ID: {client.user.id}) / 接続サーバー数: {len(client.guilds)}",
+        extra={"guilds": len(client.guilds), "startup": TIMELINE.elapsed("gateway_ready")}
+    )
+
+@client.event
+async def on_shard_ready(shard_id):
+    """シャードごとの接続完了時"""
+    logger.info(f"🧩 シャード {shard_id} の準備が完了しました", extra={"shard_id": shard_id})
+
+@client.event
+async def on_interaction(interaction):
+    """インタラクションの受信時（スラッシュコマンドに限らず、過去のメニューの選択でも起動の計測を終える）"""
+    TIMELINE.mark("first_interaction")
 
 @client.event
 async def on_guild_join(guild):
     """サーバーに参加した時"""
-    print(f"📥 新しいサーバーに参加: {guild.name} (ID: {guild.id})")
+    logger.info(f"📥 新しいサーバーに参加: {guild.name} (ID: {guild.id})")
 
 @client.event
 async def on_guild_remove(guild):
     """サーバーから退出した時"""
-    print(f"📤 サーバーから退出: {guild.name} (ID: {guild.id})")
+    logger.info(f"📤 サーバーから退出: {guild.name} (ID: {guild.id})")
 
 @client.event
 async def on_command_error(ctx, error):
@@ -121,68 +271,94 @@ async def on_command_error(ctx, error):
     elif isinstance(error, commands.BotMissingPermissions):
         await ctx.send("❌ BOTに必要な権限がありません。")
     else:
-        print(f"❌ コマンドエラー: {error}")
+        logger.error(f"❌ コマンドエラー: {error}", exc_info=error)
 
 @client.event
 async def on_error(event, *args, **kwargs):
     """一般的なエラーハンドリング"""
-    print(f"❌ エラーが発生しました (イベント: {event})")
-    import traceback
-    traceback.print_exc()
+    logger.exception(f"❌ エラーが発生しました (イベント: {event})")
 
 # --- 4. BOTの実行 ---
+async def run_cluster(token: str):
+    """クラスタモードのリーダー: 共有価格キャッシュとWebサーバーを持ち、シャードを分担する子プロセスを監視する"""
+    # 価格の取得元はCogと同じもの（子プロセスはリーダーにだけ問い合わせる）
+    from cogs.crypto_prices import PREFETCH_CRYPTO_IDS, PREFETCH_INTERVAL
+    from utils.coingecko import CoinGeckoClient, create_session
+    from utils.coins import CoinRegistry
+    from utils.providers import create_price_fetcher
+    from utils.sources import create_price_source
+    
+    shard_count = SHARD_COUNT or await fetch_recommended_shards(token)
+    processes = min(CLUSTER_PROCESSES, shard_count)
+    logger.info(f"🧩 クラスタモード: {shard_count} シャードを {processes} プロセスで分担します")
+    
+    session = create_session()
+    coingecko = CoinGeckoClient(session)
+    leader = PriceLeader(create_price_fetcher(session, coingecko))
+    source = create_price_source(session, coingecko, PREFETCH_CRYPTO_IDS, PREFETCH_INTERVAL)
+    registry = CoinRegistry(priority=PREFETCH_CRYPTO_IDS)  # 子プロセスは保存ファイルを読み直す
+    launcher = ClusterLauncher(shard_count, processes, os.path.abspath(__file__))
+    runner = None
+    
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    try:
+        await leader.start()
+        await source.start(leader.publish)
+        await registry.start(coingecko)
+        runner = await start_web_server(leader, launcher)
+        TIMELINE.mark("web_server_up")
+        launcher.start()
+        await stopping.wait()
+        logger.warning("⚠️  終了シグナルを受け取りました。子プロセスを停止します")
+    finally:
+        await launcher.stop()
+        await source.stop()
+        await registry.stop()
+        await leader.stop()
+        if runner:
+            await runner.cleanup()
+        await session.close()
+
 def main():
     """メイン処理"""
-    print("🤖 Discord BOTを起動中...")
+    # ログはキュー経由で別スレッドから書き出す（標準出力が遅くてもイベントループを止めない）
+    setup_logging()
+    logger.info("🤖 Discord BOTを起動中...")
     
     # 環境変数からトークンを取得
     DISCORD_BOT_TOKEN = os.environ.get("DISCORD_BOT_TOKEN")
     
     if not DISCORD_BOT_TOKEN:
-        print("=" * 50)
-        print("❌ エラー: DISCORD_BOT_TOKEN 環境変数が設定されていません")
-        print("=" * 50)
-        print("\n設定方法:")
-        print("1. Renderの環境変数設定で DISCORD_BOT_TOKEN を追加")
-        print("2. Discord Developer Portalからトークンを取得して設定")
-        print("=" * 50)
+        logger.error(
+            "❌ エラー: DISCORD_BOT_TOKEN 環境変数が設定されていません"
+            "（Discord Developer Portalでトークンを取得し、Renderの環境変数設定で DISCORD_BOT_TOKEN に設定してください）"
+        )
         sys.exit(1)
     
-    # Webサーバーを別スレッドで起動
-    server_thread = threading.Thread(target=run_web_server, daemon=True)
-    server_thread.start()
-    
-    # 起動前に少し待機（Renderの安定化のため）
-    import time
-    time.sleep(2)
-    
-    # BOTを起動
+    # BOTを起動（WebサーバーはBOTのsetup_hookで同じイベントループ上に起動する）
     try:
-        print("🔌 Discordに接続中...")
-        client.run(DISCORD_BOT_TOKEN)
+        if CLUSTER_PROCESSES > 1 and CLUSTER_ID is None:
+            asyncio.run(run_cluster(DISCORD_BOT_TOKEN))
+            return
+        logger.info("🔌 Discordに接続中...")
+        # discord.py のログもルートロガー（キュー）に流す
+        client.run(DISCORD_BOT_TOKEN, log_handler=None)
     except discord.errors.LoginFailure:
-        print("=" * 50)
-        print("❌ エラー: 不正なトークンが指定されました")
-        print("=" * 50)
-        print("Discord Developer Portalでトークンを確認してください")
+        logger.error("❌ エラー: 不正なトークンが指定されました（Discord Developer Portalでトークンを確認してください）")
         sys.exit(1)
     except discord.errors.PrivilegedIntentsRequired:
-        print("=" * 50)
-        print("❌ エラー: 特権インテントが有効になっていません")
-        print("=" * 50)
-        print("Discord Developer Portalで以下を有効化してください:")
-        print("- MESSAGE CONTENT INTENT")
-        print("- SERVER MEMBERS INTENT (必要に応じて)")
+        logger.error(
+            "❌ エラー: 特権インテントが有効になっていません"
+            "（Discord Developer Portalで MESSAGE CONTENT INTENT と、必要に応じて SERVER MEMBERS INTENT を有効化してください）"
+        )
         sys.exit(1)
     except KeyboardInterrupt:
-        print("\n⚠️  BOTを手動で停止しました")
+        logger.warning("⚠️  BOTを手動で停止しました")
         sys.exit(0)
     except Exception as e:
-        print("=" * 50)
-        print(f"❌ 予期せぬエラーが発生しました: {e}")
-        print("=" * 50)
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"❌ 予期せぬエラーが発生しました: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
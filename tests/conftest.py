@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# テスト対象のモジュールより先に、保存先を一時ディレクトリに差し替える
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="crypto-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,127 @@
+"""価格アラートのしきい値判定と通知"""
+import asyncio
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from cogs.crypto_prices import CryptoPrices
+from utils.alerts import ABOVE, BELOW, Alert, AlertStore
+
+
+def make_store(*thresholds) -> AlertStore:
+    """(方向, しきい値) ごとに bitcoin のアラートを1件ずつ持つ索引"""
+    store = AlertStore(path=os.path.join(tempfile.mkdtemp(), "alerts.sqlite3"))
+    store.replace([
+        Alert(alert_id, 1, 10, "bitcoin", direction, threshold, 0.0)
+        for alert_id, (direction, threshold) in enumerate(thresholds, start=1)
+    ])
+    return store
+
+
+def test_above_fires_at_and_over_threshold():
+    store = make_store((ABOVE, 100.0), (ABOVE, 100.0), (ABOVE, 101.0), (ABOVE, 99.0))
+    assert [a.alert_id for a in store.pop_triggered({"bitcoin": 98.0})] == []
+    assert sorted(a.alert_id for a in store.pop_triggered({"bitcoin": 100.0})) == [1, 2, 4]
+    # 発火したものは索引から外れ、同じ価格では再発火しない
+    assert store.pop_triggered({"bitcoin": 100.0}) == []
+    assert [a.alert_id for a in store.pop_triggered({"bitcoin": 101.0})] == [3]
+    assert len(store) == 0
+
+
+def test_below_fires_at_and_under_threshold():
+    store = make_store((BELOW, 100.0), (BELOW, 99.0), (BELOW, 100.5))
+    assert store.pop_triggered({"bitcoin": 101.0}) == []
+    assert sorted(a.alert_id for a in store.pop_triggered({"bitcoin": 100.0})) == [1, 3]
+    assert store.pop_triggered({"bitcoin": 99.5}) == []
+    assert [a.alert_id for a in store.pop_triggered({"bitcoin": 99.0})] == [2]
+
+
+def test_directions_and_coins_are_independent():
+    store = make_store((ABOVE, 100.0), (BELOW, 90.0))
+    assert store.pop_triggered({"ethereum": 1000.0, "bitcoin": None}) == []
+    assert store.pop_triggered({"bitcoin": 95.0}) == []
+    assert [a.direction for a in store.pop_triggered({"bitcoin": 85.0})] == [BELOW]
+    assert [a.alert_id for a in store.for_user(1)] == [1]
+
+
+def test_unindexed_alert_does_not_fire():
+    store = make_store((ABOVE, 100.0), (ABOVE, 100.0))
+    store.unindex([1])
+    assert [a.alert_id for a in store.pop_triggered({"bitcoin": 150.0})] == [2]
+
+
+class SlowChannel:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.sent = []
+    
+    async def send(self, content, **kwargs):
+        await asyncio.sleep(self.delay)  # レート制限で待たされる送信
+        self.sent.append(content)
+
+
+def test_apply_prices_does_not_wait_for_notifications():
+    channel = SlowChannel(delay=0.5)
+    cog = CryptoPrices(SimpleNamespace(get_channel=lambda channel_id: channel))
+    cog.alerts = make_store((ABOVE, 100.0))
+    cog.snapshot_saved_at = time.monotonic()
+    
+    async def scenario():
+        started = time.perf_counter()
+        await cog.apply_prices({"bitcoin": {"usd": 120.0}}, time.time())
+        elapsed = time.perf_counter() - started
+        assert cog.alert_tasks
+        await asyncio.gather(*cog.alert_tasks)
+        return elapsed
+    
+    elapsed = asyncio.run(scenario())
+    assert elapsed < 0.1
+    assert cog.cache.peek("bitcoin") == {"usd": 120.0}
+    assert len(channel.sent) == 1 and "<@1>" in channel.sent[0]
+    assert not cog.alert_tasks
+
+
+def test_alert_task_failures_are_logged(caplog):
+    cog = CryptoPrices(SimpleNamespace())
+    cog.alerts = make_store((ABOVE, 100.0))
+    
+    async def failing(triggered, prices):
+        raise RuntimeError("boom")
+    
+    cog.notify_alerts = failing
+    
+    async def scenario():
+        task = cog.check_alerts({"bitcoin": 100.0})
+        with pytest.raises(RuntimeError):
+            await task
+        await asyncio.sleep(0)
+    
+    asyncio.run(scenario())
+    assert "アラート通知でエラー" in caplog.text
+    assert not cog.alert_tasks
+
+
+def test_alert_already_met_is_rejected():
+    cog = CryptoPrices(SimpleNamespace())
+    cog.alerts = make_store()
+    cog.cache.set("bitcoin", {"usd": 120.0})
+    replies = []
+    interaction = SimpleNamespace(
+        user=SimpleNamespace(id=1), channel_id=10, guild_id=None,
+        response=SimpleNamespace(send_message=lambda content, **kwargs: asyncio.sleep(0, replies.append(content)))
+    )
+    above = SimpleNamespace(name="以上になったら", value=ABOVE)
+    below = SimpleNamespace(name="以下になったら", value=BELOW)
+    coin = SimpleNamespace(name="Bitcoin (BTC)", value="bitcoin")
+    
+    async def scenario():
+        await CryptoPrices.alert_add.callback(cog, interaction, coin, above, 110.0)
+        await CryptoPrices.alert_add.callback(cog, interaction, coin, below, 100.0)
+    
+    asyncio.run(scenario())
+    assert "すでに" in replies[0]
+    assert "登録しました" in replies[1]
+    assert [(a.direction, a.threshold) for a in cog.alerts.for_user(1)] == [(BELOW, 100.0)]
@@ -0,0 +1,11 @@
+"""負荷試験の集計"""
+from tools.bench import percentile
+
+
+def test_percentile_nearest_rank():
+    assert percentile(range(1, 21), 95) == 19
+    assert percentile(range(1, 11), 50) == 5
+    assert percentile(range(1, 101), 99) == 99
+    assert percentile(range(1, 101), 100) == 100
+    assert percentile([3.0, 1.0, 2.0], 0) == 1.0
+    assert percentile([], 95) == 0.0
@@ -0,0 +1,83 @@
+"""CryptoCache のシングルフライトと一括取得"""
+import asyncio
+import time
+
+import aiohttp
+
+from cogs.crypto_prices import CryptoCache, CryptoView, EmbedCache
+from tests.helpers import serve
+from tools import mock_coingecko
+from tools.bench import FakeInteraction, FakeSelect
+from utils.coingecko import CoinGeckoClient
+from utils.providers import CoinGeckoProvider, HedgedPriceFetcher
+
+
+class CountingLoader:
+    """呼び出しごとに受け取ったキーを記録する loader"""
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.calls = []
+    
+    async def __call__(self, keys):
+        self.calls.append(list(keys))
+        await asyncio.sleep(self.delay)
+        return {key: {"usd": 1.0} for key in keys}
+
+
+def make_stale(cache: CryptoCache, key: str):
+    cache.set(key, {"usd": 0.5})
+    data, _, fetched_at, version = cache.cache[key]
+    cache.cache[key] = (data, time.monotonic() - cache.cache_duration - 1, fetched_at, version)
+
+
+def test_stale_and_missing_keys_share_one_loader_call():
+    cache = CryptoCache(cache_duration=60, stale_duration=600)
+    loader = CountingLoader()
+    
+    async def scenario():
+        make_stale(cache, "stale")
+        result = await cache.get_many(["stale", "missing"], loader)
+        await asyncio.sleep(0.1)  # 裏での更新の完了を待つ
+        return result
+    
+    result = asyncio.run(scenario())
+    assert loader.calls == [["missing", "stale"]]
+    assert list(result) == ["stale", "missing"]
+    assert result["stale"] == {"usd": 0.5}  # 古いデータは待たずに返す
+    assert cache.peek("stale") == {"usd": 1.0}
+
+
+def test_stale_only_returns_without_waiting():
+    cache = CryptoCache(cache_duration=60, stale_duration=600)
+    loader = CountingLoader(delay=1.0)
+    
+    async def scenario():
+        make_stale(cache, "bitcoin")
+        started = time.perf_counter()
+        result = await cache.get_many(["bitcoin"], loader)
+        return result, time.perf_counter() - started
+    
+    result, elapsed = asyncio.run(scenario())
+    assert result == {"bitcoin": {"usd": 0.5}}
+    assert elapsed < 0.5
+    assert loader.calls == [["bitcoin"]]
+
+
+def test_simultaneous_selects_share_one_upstream_request():
+    coingecko = mock_coingecko.make_app(latency=0.2)
+    
+    async def scenario():
+        async with serve(coingecko) as url, aiohttp.ClientSession() as session:
+            client = CoinGeckoClient(session, rate_per_min=6000, base_url=f"{url}/api/v3")
+            fetcher = HedgedPriceFetcher([CoinGeckoProvider(client)])
+            view = CryptoView(CryptoCache(cache_duration=60, stale_duration=600), fetcher, EmbedCache())
+            interactions = [FakeInteraction(user_id) for user_id in range(100)]
+            await asyncio.gather(*(
+                CryptoView.select_crypto(view, interaction, FakeSelect("bitcoin"))
+                for interaction in interactions
+            ))
+            return interactions
+    
+    interactions = asyncio.run(scenario())
+    assert coingecko["stats"]["requests"] == 1
+    assert all(interaction.ok for interaction in interactions)
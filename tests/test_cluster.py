@@ -0,0 +1,180 @@
+"""クラスタモードでの子プロセスからリーダーへの集約"""
+import asyncio
+import os
+import tempfile
+import time
+
+import aiohttp
+import pytest
+
+from tests.helpers import serve
+from tools import mock_coingecko
+from utils import logs
+from utils.cluster import ClusterClient, PriceLeader
+from utils.coingecko import CoinGeckoClient, CryptoAPIError
+from utils.metrics import Registry
+from utils.providers import CoinGeckoProvider, HedgedPriceFetcher
+
+
+def test_render_merged_labels_child_samples():
+    local = Registry()
+    local.counter("lookups_total", "問い合わせ数", ["result"]).inc(result="hit")
+    child = Registry()
+    child.counter("lookups_total", "問い合わせ数", ["result"]).inc(2, result="fetch")
+    child.gauge("guilds", "サーバー数").set(5)
+    
+    text = local.render_merged({0: child.collect()})
+    
+    assert text.count("# TYPE lookups_total counter") == 1
+    assert 'lookups_total{result="hit"} 1.0' in text
+    assert 'lookups_total{cluster="0",result="fetch"} 2.0' in text
+    assert 'guilds{cluster="0"} 5.0' in text
+
+
+def test_leader_receives_child_metrics_and_traces(monkeypatch):
+    monkeypatch.setattr(logs, "SLOW_TRACE_THRESHOLD", 0.0)
+    monkeypatch.setattr(logs, "SLOW_TRACES", type(logs.SLOW_TRACES)(maxlen=10))
+    with logs.trace("crypto", "trace-1"):
+        with logs.span("render"):
+            pass
+    path = os.path.join(tempfile.mkdtemp(), "cluster.sock")
+    
+    async def scenario():
+        leader = PriceLeader(fetcher=None, path=path)
+        await leader.start()
+        client = ClusterClient(3, path=path, status=lambda: {"ready": True, "guilds": 1})
+        await client.start(lambda data, fetched_at: None)
+        try:
+            for _ in range(100):
+                if 3 in leader.metrics:
+                    break
+                await asyncio.sleep(0.02)
+        finally:
+            await client.stop()
+            await leader.stop()
+        return leader
+    
+    leader = asyncio.run(scenario())
+    assert leader.clusters[3]["guilds"] == 1
+    assert any(family["name"] == "crypto_cluster_lookups_total" for family in leader.metrics[3])
+    traces = leader.slow_traces(5)
+    assert [trace["trace_id"] for trace in traces] == ["trace-1"]
+    assert traces[0]["cluster"] == 3
+    assert traces[0]["spans"][0]["name"] == "render"
+
+
+async def start_cluster(path, base_url, session, clusters=3):
+    """模擬CoinGeckoに向けたリーダーと、接続済みの子プロセス（ClusterClient）を起動"""
+    client = CoinGeckoClient(session, rate_per_min=6000, max_attempts=1, base_url=f"{base_url}/api/v3")
+    leader = PriceLeader(HedgedPriceFetcher([CoinGeckoProvider(client)]), path=path)
+    await leader.start()
+    received = {cluster_id: [] for cluster_id in range(clusters)}
+    children = []
+    for cluster_id in range(clusters):
+        async def handler(data, fetched_at, cluster_id=cluster_id):
+            received[cluster_id].append(data)
+        
+        child = ClusterClient(cluster_id, path=path, timeout=5)
+        await child.start(handler)
+        children.append(child)
+    await wait_for(lambda: all(child.connected for child in children) and len(leader.writers) == clusters)
+    return leader, children, received
+
+
+async def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "条件を満たしませんでした"
+        await asyncio.sleep(0.02)
+
+
+def test_children_share_one_upstream_request():
+    coingecko = mock_coingecko.make_app(latency=0.2)
+    path = os.path.join(tempfile.mkdtemp(), "cluster.sock")
+    
+    async def scenario():
+        async with serve(coingecko) as url, aiohttp.ClientSession() as session:
+            leader, children, _ = await start_cluster(path, url, session)
+            try:
+                results = await asyncio.gather(*(
+                    child.fetch(["bitcoin", "ethereum"]) for child in children for _ in range(5)
+                ))
+                # 取得済みの通貨はリーダーのキャッシュから返す
+                cached = await children[0].fetch(["ethereum", "bitcoin"])
+            finally:
+                for child in children:
+                    await child.stop()
+                await leader.stop()
+            return results, cached
+    
+    results, cached = asyncio.run(scenario())
+    assert coingecko["stats"]["requests"] == 1
+    assert all(set(result) == {"bitcoin", "ethereum"} for result in results)
+    assert cached["bitcoin"] == results[0]["bitcoin"]
+
+
+def test_prices_are_broadcast_to_every_child():
+    coingecko = mock_coingecko.make_app()
+    path = os.path.join(tempfile.mkdtemp(), "cluster.sock")
+    
+    async def scenario():
+        async with serve(coingecko) as url, aiohttp.ClientSession() as session:
+            leader, children, received = await start_cluster(path, url, session)
+            try:
+                await leader.publish({"bitcoin": {"usd": 123.0}}, time.time())
+                await wait_for(lambda: all(received.values()))
+                # 後から接続した子プロセスには、手元の価格をまとめて渡す
+                late = []
+                
+                async def handler(data, fetched_at):
+                    late.append(data)
+                
+                child = ClusterClient(9, path=path)
+                await child.start(handler)
+                await wait_for(lambda: late)
+                await child.stop()
+            finally:
+                for child in children:
+                    await child.stop()
+                await leader.stop()
+            return received, late
+    
+    received, late = asyncio.run(scenario())
+    assert all(data == [{"bitcoin": {"usd": 123.0}}] for data in received.values())
+    assert late == [{"bitcoin": {"usd": 123.0}}]
+    assert coingecko["stats"]["requests"] == 0
+
+
+def test_child_fails_fast_and_reconnects_when_leader_goes_away():
+    coingecko = mock_coingecko.make_app(latency=1.0)
+    path = os.path.join(tempfile.mkdtemp(), "cluster.sock")
+    
+    async def scenario():
+        async with serve(coingecko) as url, aiohttp.ClientSession() as session:
+            leader, children, _ = await start_cluster(path, url, session, clusters=1)
+            child = children[0]
+            try:
+                in_flight = asyncio.ensure_future(child.fetch(["bitcoin"]))
+                await wait_for(lambda: coingecko["stats"]["requests"] == 1)
+                await leader.stop()
+                # 応答待ちの問い合わせはタイムアウトを待たずに失敗する
+                with pytest.raises(CryptoAPIError):
+                    await asyncio.wait_for(in_flight, 1.0)
+                await wait_for(lambda: not child.connected)
+                with pytest.raises(CryptoAPIError):
+                    await child.fetch(["bitcoin"])
+                
+                # リーダーが戻ったら再接続して問い合わせられる
+                client = CoinGeckoClient(session, rate_per_min=6000, base_url=f"{url}/api/v3")
+                leader = PriceLeader(HedgedPriceFetcher([CoinGeckoProvider(client)]), path=path)
+                await leader.start()
+                await wait_for(lambda: child.connected, timeout=10)
+                data = await child.fetch(["bitcoin"])
+            finally:
+                await child.stop()
+                await leader.stop()
+            return data, child.reconnects
+    
+    data, reconnects = asyncio.run(scenario())
+    assert "usd" in data["bitcoin"]
+    assert reconnects >= 1
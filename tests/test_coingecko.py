@@ -0,0 +1,72 @@
+"""CoinGeckoクライアントの送信ペース制御とレート制限（429）の扱い"""
+import asyncio
+import time
+from email.utils import formatdate
+
+import aiohttp
+import pytest
+
+from tests.helpers import serve
+from tools import mock_coingecko
+from utils.coingecko import CoinGeckoClient, RateLimitedError, TokenBucket, parse_retry_after
+
+
+def test_token_bucket_allows_burst_then_paces():
+    bucket = TokenBucket(rate=20.0, capacity=3)
+    
+    async def scenario():
+        started = time.monotonic()
+        finished = []
+        for _ in range(5):
+            await bucket.acquire()
+            finished.append(time.monotonic() - started)
+        return finished
+    
+    finished = asyncio.run(scenario())
+    assert finished[2] < 0.03  # 容量分はすぐに通る
+    assert finished[3] >= 0.04 and finished[4] >= 0.09  # 以降は1/rate秒ごと
+
+
+def test_token_bucket_rate_adapts_within_bounds():
+    bucket = TokenBucket(rate=8.0, capacity=1)
+    bucket.slow_down()
+    assert bucket.rate == 4.0
+    for _ in range(10):
+        bucket.slow_down()
+    assert bucket.rate == 1.0  # 元の1/8より下げない
+    bucket.speed_up()
+    assert bucket.rate == pytest.approx(1.8)
+    for _ in range(20):
+        bucket.speed_up()
+    assert bucket.rate == 8.0
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("5", 5.0), ("0.5", 0.5), ("-3", 0.0), (None, None), ("", None), ("soon", None),
+])
+def test_parse_retry_after_seconds(value, expected):
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_http_date():
+    assert parse_retry_after(formatdate(time.time() + 30, usegmt=True)) == pytest.approx(30, abs=2)
+    assert parse_retry_after(formatdate(time.time() - 30, usegmt=True)) == 0.0
+
+
+def test_cooldown_after_429_rejects_without_calling_upstream():
+    app = mock_coingecko.make_app(latency=0.0, rate_limit=1.0, retry_after=30)
+    
+    async def scenario():
+        async with serve(app) as base_url, aiohttp.ClientSession() as session:
+            client = CoinGeckoClient(session, rate_per_min=600, max_attempts=1, base_url=f"{base_url}/api/v3")
+            with pytest.raises(RateLimitedError) as first:
+                await client.simple_price(["bitcoin"])
+            with pytest.raises(RateLimitedError) as second:
+                await client.simple_price(["bitcoin"])
+            return client, first.value, second.value
+    
+    client, first, second = asyncio.run(scenario())
+    assert app["stats"]["requests"] == 1  # クールダウン中の2回目は上流に送らない
+    assert first.retry_in == pytest.approx(30, abs=1)  # Retry-After を優先
+    assert 0 < second.retry_in <= first.retry_in
+    assert client.bucket.rate == client.bucket.max_rate / 2
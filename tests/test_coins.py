@@ -0,0 +1,73 @@
+"""オートコンプリート用のコイン索引の順位付けと件数の上限"""
+import pytest
+
+from tools.mock_coingecko import fake_coins
+from utils.coins import HOT_RANGE, MAX_CHOICES, Coin, CoinIndex
+
+COINS = [
+    Coin("bitcoin", "btc", "Bitcoin"),
+    Coin("bitcoin-cash", "bch", "Bitcoin Cash"),
+    Coin("btcx", "btcx", "BTCX"),
+    Coin("bt", "bt", "BT"),
+    Coin("wrapped-bitcoin", "wbtc", "Wrapped Bitcoin"),
+    Coin("shiba-inu", "shib", "Shiba Inu"),
+    Coin("ethereum", "eth", "Ethereum"),
+]
+
+
+def many(count: int):
+    """モックサーバーと同じ疑似的なコイン一覧"""
+    return [Coin(c["id"], c["symbol"], c["name"]) for c in fake_coins(count)]
+
+
+def ids(coins):
+    return [coin.coin_id for coin in coins]
+
+
+def test_priority_then_exact_then_shorter_key():
+    index = CoinIndex(COINS, priority=["ethereum", "bitcoin-cash"])
+    # 優先リストの通貨が先、残りは完全一致 > キーが短い順
+    assert ids(index.search("b")) == ["bitcoin-cash", "bt", "bitcoin", "btcx", "wrapped-bitcoin"]
+    assert ids(index.search("bt")) == ["bt", "bitcoin", "btcx"]
+    assert ids(index.search("BTC ")) == ["bitcoin", "btcx"]
+    assert ids(index.search("bitcoin")) == ["bitcoin-cash", "bitcoin", "wrapped-bitcoin"]
+
+
+def test_each_coin_is_listed_once_and_later_words_match():
+    index = CoinIndex(COINS)
+    # bitcoin は ID・名前の両方で一致するが1件だけ
+    assert ids(index.search("bitcoin")) == ["bitcoin", "wrapped-bitcoin", "bitcoin-cash"]
+    assert ids(index.search("inu")) == ["shiba-inu"]
+    assert index.search("doge") == []
+
+
+def test_empty_query_returns_priority_order():
+    index = CoinIndex(COINS, priority=["ethereum", "missing", "bitcoin"])
+    assert ids(index.search("")) == ["ethereum", "bitcoin"]
+    assert ids(index.search("  ", limit=1)) == ["ethereum"]
+
+
+@pytest.mark.parametrize("limit", [1, 3, MAX_CHOICES])
+def test_search_respects_limit(limit):
+    index = CoinIndex(many(3000))
+    for query in ("a", "b", "c"):
+        results = index.search(query, limit)
+        assert len(results) == limit
+        assert len(set(results)) == limit
+
+
+def test_precomputed_prefixes_match_full_ranking():
+    index = CoinIndex(many(12000), priority=["bitcoin", "ethereum"])
+    assert index.hot  # 候補の多い接頭辞は作成時に計算される
+    for prefix in list(index.hot)[:50]:
+        matches = [e for e in index.entries if e[0].startswith(prefix)]
+        assert len(matches) > HOT_RANGE
+        assert ids(index.search(prefix)) == ids(index.coins[i] for i in CoinIndex._top(matches, prefix))
+
+
+def test_resolve_accepts_id_symbol_or_name():
+    index = CoinIndex(COINS)
+    assert index.resolve("Bitcoin").coin_id == "bitcoin"
+    assert index.resolve("ETH").coin_id == "ethereum"
+    assert index.resolve("wrapped-bitcoin").coin_id == "wrapped-bitcoin"
+    assert index.resolve("bitc") is None  # 前方一致だけでは決めない
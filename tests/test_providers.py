@@ -0,0 +1,179 @@
+"""ヘッジ付きリクエスト・フェイルオーバー・ヘルスによる除外（tools の模擬サーバーを使う）"""
+import asyncio
+import time
+
+import aiohttp
+import pytest
+
+from cogs.crypto_prices import CryptoCache, fetch_prices
+from tests.helpers import serve
+from tools import mock_coingecko, mock_price_stream
+from utils import providers
+from utils.coingecko import CoinGeckoClient, CryptoAPIError
+from utils.providers import BinanceProvider, CoinGeckoProvider, HedgedPriceFetcher, PriceProvider
+
+
+async def run_fetcher(coingecko_app, binance_app, scenario, max_attempts=3):
+    """2つの模擬サーバーに向けた HedgedPriceFetcher で scenario(fetcher) を実行"""
+    async with serve(coingecko_app) as coingecko_url, serve(binance_app) as binance_url:
+        async with aiohttp.ClientSession() as session:
+            client = CoinGeckoClient(
+                session, rate_per_min=6000, max_attempts=max_attempts, base_url=f"{coingecko_url}/api/v3"
+            )
+            fetcher = HedgedPriceFetcher([
+                CoinGeckoProvider(client),
+                BinanceProvider(session, base_url=f"{binance_url}/api/v3"),
+            ])
+            return await scenario(fetcher)
+
+
+def test_slow_primary_is_hedged_after_delay(monkeypatch):
+    monkeypatch.setattr(providers, "HEDGE_DEFAULT_DELAY", 0.2)
+    coingecko = mock_coingecko.make_app(latency=2.0)
+    binance = mock_price_stream.make_app(latency=0.05)
+    
+    async def scenario(fetcher):
+        started = time.perf_counter()
+        data = await fetcher.fetch(["bitcoin", "ethereum"])
+        return data, time.perf_counter() - started
+    
+    data, elapsed = asyncio.run(run_fetcher(coingecko, binance, scenario))
+    assert data["bitcoin"]["provider"] == "Binance"
+    assert set(data) == {"bitcoin", "ethereum"}
+    # ヘッジまでの待ち時間 + 代替プロバイダーの応答時間で返り、遅い主プロバイダーは待たない
+    assert 0.2 <= elapsed < 1.0
+    assert binance["stats"]["requests"] == 1
+
+
+def test_fast_primary_is_not_hedged():
+    coingecko = mock_coingecko.make_app(latency=0.01)
+    binance = mock_price_stream.make_app(latency=0.05)
+    
+    data = asyncio.run(run_fetcher(coingecko, binance, lambda fetcher: fetcher.fetch(["bitcoin"])))
+    assert "provider" not in data["bitcoin"]
+    assert binance["stats"]["requests"] == 0
+
+
+def test_hedge_winner_missing_coins_are_filled_from_primary(monkeypatch):
+    monkeypatch.setattr(providers, "HEDGE_DEFAULT_DELAY", 0.2)
+    coingecko = mock_coingecko.make_app(latency=0.6)
+    binance = mock_price_stream.make_app(latency=0.05)
+    
+    data = asyncio.run(run_fetcher(coingecko, binance, lambda fetcher: fetcher.fetch(["bitcoin", "matic-network"])))
+    # Binanceにない matic-network は実行中のCoinGeckoの応答から補う（追加のリクエストは出さない）
+    assert set(data) == {"bitcoin", "matic-network"}
+    assert data["bitcoin"]["provider"] == "Binance"
+    assert coingecko["stats"]["requests"] == 1
+
+
+def test_partial_winner_with_stub_providers():
+    class Stub(PriceProvider):
+        def __init__(self, name, delay, coins=None):
+            self.name = name
+            self.delay = delay
+            self.coins = coins
+            self.calls = []
+        
+        def supports(self, crypto_id):
+            return self.coins is None or crypto_id in self.coins
+        
+        async def fetch(self, crypto_ids):
+            self.calls.append(list(crypto_ids))
+            await asyncio.sleep(self.delay)
+            return {c: {"usd": 1.0, "provider": self.name} for c in crypto_ids if self.supports(c)}
+    
+    primary = Stub("primary", 0.0)
+    alt = Stub("alt", 0.0, coins={"bitcoin"})
+    fetcher = HedgedPriceFetcher([primary, alt])
+    
+    async def scenario():
+        # 主プロバイダーを除外して、部分的にしか扱えない代替プロバイダーが先に応答する状況にする
+        fetcher.health["primary"].ejected_until = time.monotonic() + 60
+        return await fetcher.fetch(["bitcoin", "matic-network"])
+    
+    data = asyncio.run(scenario())
+    assert data["bitcoin"]["provider"] == "alt"
+    assert data["matic-network"]["provider"] == "primary"
+    assert primary.calls == [["matic-network"]]
+
+
+def test_failover_on_primary_error():
+    coingecko = mock_coingecko.make_app(latency=0.01, rate_limit=1.0, retry_after=60)
+    binance = mock_price_stream.make_app(latency=0.05)
+    
+    async def scenario(fetcher):
+        started = time.perf_counter()
+        data = await fetcher.fetch(["bitcoin"])
+        return data, time.perf_counter() - started
+    
+    data, elapsed = asyncio.run(run_fetcher(coingecko, binance, scenario, max_attempts=1))
+    assert data["bitcoin"]["provider"] == "Binance"
+    # 失敗したらヘッジの待ち時間を待たずに次のプロバイダーへ
+    assert elapsed < providers.HEDGE_DEFAULT_DELAY
+    assert coingecko["stats"]["rate_limited"] == 1
+
+
+def test_unhealthy_primary_is_ejected_from_rotation():
+    coingecko = mock_coingecko.make_app(latency=0.01, rate_limit=1.0, retry_after=60)
+    binance = mock_price_stream.make_app(latency=0.01)
+    
+    async def scenario(fetcher):
+        health = fetcher.health["coingecko"]
+        for _ in range(health.max_failures):
+            await fetcher.fetch(["bitcoin"])
+        assert not health.healthy
+        binance_before = binance["stats"]["requests"]
+        data = await fetcher.fetch(["bitcoin"])
+        # 除外中は主プロバイダーに送らず、代替プロバイダーに直接送る
+        assert fetcher._candidates(["bitcoin"])[0].name == "binance"
+        assert binance["stats"]["requests"] == binance_before + 1
+        return data
+    
+    data = asyncio.run(run_fetcher(coingecko, binance, scenario, max_attempts=1))
+    assert data["bitcoin"]["provider"] == "Binance"
+    # 429 は1回だけ（以降はクールダウン中として送信前に失敗し、除外後は送らない）
+    assert coingecko["stats"]["requests"] == 1
+
+
+def test_failover_raises_when_every_provider_fails():
+    coingecko = mock_coingecko.make_app(latency=0.01, rate_limit=1.0, retry_after=60)
+    binance = mock_price_stream.make_app(latency=0.01, error_rate=1.0)
+    
+    async def scenario(fetcher):
+        with pytest.raises(CryptoAPIError):
+            await fetcher.fetch(["bitcoin"])
+    
+    asyncio.run(run_fetcher(coingecko, binance, scenario, max_attempts=1))
+    assert coingecko["stats"]["requests"] == 1
+    assert binance["stats"]["requests"] == 1
+
+
+class StubFetcher:
+    def __init__(self, data):
+        self.data = data
+    
+    async def fetch(self, crypto_ids):
+        return {crypto_id: self.data[crypto_id] for crypto_id in crypto_ids}
+
+
+def test_alt_provider_btc_prices_follow_bitcoin():
+    cache = CryptoCache(cache_duration=60, stale_duration=600)
+    cache.set("bitcoin", {"usd": 100.0, "jpy": 15000.0, "btc": 1.0, "usd_market_cap": 2e12})
+    cache.set("ethereum", {"usd": 5.0, "jpy": 750.0, "btc": 0.05, "usd_market_cap": 6e11})
+    # Binanceが勝った場合の応答（USD建てのみ）: ビットコイン +2%、イーサリアム -1.54%
+    fetcher = StubFetcher({
+        "bitcoin": {"usd": 102.0, "provider": "Binance"},
+        "ethereum": {"usd": 4.923, "provider": "Binance"},
+    })
+    
+    data = asyncio.run(fetch_prices(cache, fetcher, ["bitcoin", "ethereum"]))
+    assert data["bitcoin"]["btc"] == 1.0
+    assert data["ethereum"]["btc"] == pytest.approx(4.923 / 102.0)
+    assert data["ethereum"]["jpy"] == pytest.approx(750.0 * 4.923 / 5.0)
+    assert data["bitcoin"]["usd_market_cap"] == pytest.approx(2e12 * 1.02)
+
+
+def test_fill_missing_drops_btc_price_without_bitcoin():
+    filled = providers.fill_missing({"usd": 4.923}, {"usd": 5.0, "jpy": 750.0, "btc": 0.05})
+    assert "btc" not in filled
+    assert filled["jpy"] == pytest.approx(738.45)
@@ -0,0 +1,162 @@
+"""応答期限・古いデータでの応答・後からの書き換え（respond_with_deadline）"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from cogs import crypto_prices
+from cogs.crypto_prices import PENDING_NOTE, REFRESH_FAILED_NOTE, CryptoCache, CryptoView, EmbedCache
+from utils.coingecko import CryptoAPIError
+
+
+class Message:
+    def __init__(self, embed):
+        self.embeds = [embed]
+    
+    async def edit(self, embed=None, **kwargs):
+        self.embeds.append(embed)
+
+
+class Followup:
+    def __init__(self):
+        self.messages = []
+        self.texts = []
+    
+    async def send(self, content=None, embed=None, **kwargs):
+        if embed is None:
+            self.texts.append(content)
+            return None
+        message = Message(embed)
+        self.messages.append(message)
+        return message
+
+
+def make_interaction():
+    async def defer(**kwargs):
+        pass
+    
+    return SimpleNamespace(
+        id=1, guild_id=None, locale="ja", followup=Followup(), response=SimpleNamespace(defer=defer)
+    )
+
+
+class Fetcher:
+    """delay 秒後に price を返す（error を指定すると失敗する）"""
+    def __init__(self, price=200.0, delay=0.0, error=False):
+        self.price = price
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+    
+    async def fetch(self, crypto_ids):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise CryptoAPIError("❌ API エラー (ステータス: 500)")
+        return {crypto_id: {"usd": self.price, "jpy": self.price * 150, "btc": 1.0} for crypto_id in crypto_ids}
+
+
+def age(cache: CryptoCache, key: str, seconds: float):
+    data, _, fetched_at, version = cache.cache[key]
+    cache.cache[key] = (data, time.monotonic() - seconds, fetched_at, version)
+
+
+def show(cache: CryptoCache, fetcher: Fetcher, monkeypatch, deadline: float = 0.1):
+    monkeypatch.setattr(crypto_prices, "RESPONSE_DEADLINE", deadline)
+    interaction = make_interaction()
+    
+    async def scenario():
+        view = CryptoView(cache, fetcher, EmbedCache())
+        await view.show_crypto(interaction, "bitcoin", command="crypto")
+    
+    asyncio.run(scenario())
+    return interaction.followup
+
+
+def footers(message: Message):
+    return [embed.footer.text for embed in message.embeds]
+
+
+def usd(embed) -> str:
+    return next(field.value for field in embed.fields if field.name == "💵 USD")
+
+
+def test_fresh_data_is_sent_once_without_edit(monkeypatch):
+    cache = CryptoCache(cache_duration=60, stale_duration=600)
+    cache.set("bitcoin", {"usd": 100.0})
+    fetcher = Fetcher()
+    followup = show(cache, fetcher, monkeypatch)
+    
+    [message] = followup.messages
+    assert footers(message) == ["データ提供: CoinGecko API (キャッシュ)"]
+    assert fetcher.calls == 0
+
+
+def test_stale_data_is_edited_after_background_refresh(monkeypatch):
+    cache = CryptoCache(cache_duration=60, stale_duration=600)
+    cache.set("bitcoin", {"usd": 100.0})
+    age(cache, "bitcoin", 120)
+    followup = show(cache, Fetcher(price=200.0, delay=0.05), monkeypatch)
+    
+    [message] = followup.messages
+    assert "更新中" in message.embeds[0].footer.text
+    assert usd(message.embeds[0]) == "$100.00"
+    # 裏での再取得が終わったら「更新中」のままにせず書き換える
+    assert len(message.embeds) == 2
+    assert usd(message.embeds[1]) == "$200.00"
+    assert message.embeds[1].footer.text == "データ提供: CoinGecko API"
+
+
+def test_stale_refresh_failure_is_shown(monkeypatch):
+    cache = CryptoCache(cache_duration=60, stale_duration=600)
+    cache.set("bitcoin", {"usd": 100.0})
+    age(cache, "bitcoin", 120)
+    followup = show(cache, Fetcher(delay=0.05, error=True), monkeypatch)
+    
+    [message] = followup.messages
+    assert REFRESH_FAILED_NOTE in message.embeds[-1].footer.text
+
+
+def test_deadline_sends_last_known_then_edits(monkeypatch):
+    cache = CryptoCache(cache_duration=60, stale_duration=600)
+    cache.set("bitcoin", {"usd": 100.0})
+    age(cache, "bitcoin", 3600)  # 期限切れ（待つ必要がある）が、最後に取得したデータはある
+    started = time.perf_counter()
+    followup = show(cache, Fetcher(price=200.0, delay=0.3), monkeypatch, deadline=0.05)
+    
+    [message] = followup.messages
+    assert PENDING_NOTE in message.embeds[0].footer.text
+    assert usd(message.embeds[0]) == "$100.00"
+    assert usd(message.embeds[1]) == "$200.00"
+    assert PENDING_NOTE not in message.embeds[1].footer.text
+    assert time.perf_counter() - started >= 0.3
+
+
+def test_deadline_edit_shows_failure(monkeypatch):
+    cache = CryptoCache(cache_duration=60, stale_duration=600)
+    cache.set("bitcoin", {"usd": 100.0})
+    age(cache, "bitcoin", 3600)
+    followup = show(cache, Fetcher(delay=0.2, error=True), monkeypatch, deadline=0.05)
+    
+    [message] = followup.messages
+    assert footers(message)[0].endswith(f"({PENDING_NOTE}・表示は前回取得したデータ)")
+    assert footers(message)[1].endswith(f"({REFRESH_FAILED_NOTE}・表示は前回取得したデータ)")
+    assert usd(message.embeds[1]) == "$100.00"
+
+
+@pytest.mark.parametrize("has_last_known", [True, False])
+def test_error_within_deadline(monkeypatch, has_last_known):
+    cache = CryptoCache(cache_duration=60, stale_duration=600)
+    if has_last_known:
+        cache.set("bitcoin", {"usd": 100.0})
+        age(cache, "bitcoin", 3600)
+    followup = show(cache, Fetcher(error=True), monkeypatch, deadline=1.0)
+    
+    if has_last_known:
+        [message] = followup.messages
+        assert footers(message) == [f"データ提供: CoinGecko API ({REFRESH_FAILED_NOTE}・表示は前回取得したデータ)"]
+        assert followup.texts == []
+    else:
+        assert followup.messages == []
+        assert followup.texts == ["❌ API エラー (ステータス: 500)"]
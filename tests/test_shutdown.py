@@ -0,0 +1,72 @@
+"""SIGTERMでの終了時にスナップショットを保存する（Renderの停止・ClusterLauncher.stop）"""
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Discordには接続せず、setup_hook（Cogの読み込み）だけを行ってから終了を待つBOT
+CHILD = """
+import asyncio
+import sys
+import main
+
+client = main.client
+
+async def login(token):
+    await client.setup_hook()
+
+async def connect(reconnect=True):
+    client.get_cog("CryptoPrices").cache.set("bitcoin", {"usd": 123.0})
+    print("ready", file=sys.stderr, flush=True)  # ログ（標準出力）と混ざらないようにする
+    while not client.is_closed():
+        await asyncio.sleep(0.05)
+
+async def sync_commands():
+    pass
+
+client.login = login
+client.connect = connect
+client.sync_commands = sync_commands
+main.main()
+"""
+
+
+def test_sigterm_saves_snapshot():
+    data_dir = tempfile.mkdtemp(prefix="crypto-shutdown-")
+    env = {
+        **os.environ,
+        "DATA_DIR": data_dir,
+        "DISCORD_BOT_TOKEN": "test",
+        "PORT": "0",
+        "COINGECKO_API_URL": "http://127.0.0.1:9/api/v3",  # 接続できない宛先（外部には送らない）
+        "CRYPTO_ALT_PROVIDER": "none",
+        "LOG_FORMAT": "text",
+    }
+    env.pop("DISCORD_CLUSTER_ID", None)
+    env.pop("DISCORD_CLUSTER_PROCESSES", None)
+    log = tempfile.TemporaryFile(mode="w+")
+    process = subprocess.Popen(
+        [sys.executable, "-c", CHILD], cwd=ROOT, env=env, stdout=log, stderr=subprocess.PIPE, text=True
+    )
+    try:
+        assert process.stderr.readline().strip() == "ready", process.stderr.read()
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=20)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        log.seek(0)
+        output = log.read()
+        log.close()
+    
+    assert process.returncode == 0, output
+    conn = sqlite3.connect(os.path.join(data_dir, "price_snapshot.sqlite3"))
+    try:
+        rows = conn.execute("SELECT key, data FROM prices").fetchall()
+    finally:
+        conn.close()
+    assert ("bitcoin", '{"usd":123.0}') in rows
@@ -0,0 +1,100 @@
+"""WebSocketの価格ストリームの再接続（tools.mock_price_stream を使う）と価格の提供元の表示"""
+import asyncio
+import logging
+import re
+import time
+from types import SimpleNamespace
+
+import aiohttp
+
+from cogs.crypto_prices import CryptoPrices
+from tests.helpers import serve
+from tools import mock_coingecko, mock_price_stream
+from utils import sources
+from utils.coingecko import CoinGeckoClient
+from utils.sources import CoinGeckoRestSource, TickerStreamSource
+
+
+def test_stream_reconnects_with_backoff_after_drop(monkeypatch, caplog):
+    monkeypatch.setattr(sources.random, "uniform", lambda low, high: 0.0)
+    caplog.set_level(logging.INFO, logger=sources.logger.name)
+    stream = mock_price_stream.make_app(interval=0.05, drop_after=0.2)
+    coingecko = mock_coingecko.make_app(latency=0.01)
+    received = []
+    
+    async def handler(data, fetched_at):
+        received.append(data)
+    
+    async def scenario():
+        async with serve(stream) as stream_url, serve(coingecko) as coingecko_url:
+            async with aiohttp.ClientSession() as session:
+                client = CoinGeckoClient(session, rate_per_min=6000, base_url=f"{coingecko_url}/api/v3")
+                rest = CoinGeckoRestSource(client, ["bitcoin", "ethereum"], interval=300)
+                source = TickerStreamSource(session, rest, url=f"{stream_url}/stream", flush_interval=0.1)
+                await source.start(handler)
+                try:
+                    for _ in range(100):
+                        if stream["connections"] >= 3:
+                            break
+                        await asyncio.sleep(0.05)
+                finally:
+                    await source.stop()
+                return source
+    
+    source = asyncio.run(scenario())
+    assert stream["connections"] >= 3
+    assert source.reconnects >= 2
+    assert not source.connected
+    # 接続に成功するたびにバックオフは初期値に戻る
+    delays = [float(m) for m in re.findall(r"(\d+\.\d)秒後に再接続", caplog.text)]
+    assert delays and all(delay == 1.0 for delay in delays)
+    # RESTの初回取得に加えて、ストリームの更新がハンドラーに届いている
+    assert coingecko["stats"]["requests"] == 1
+    assert len(received) > 1
+
+
+def test_stream_prices_credit_binance():
+    rest = CoinGeckoRestSource(None, ["bitcoin", "ethereum"], interval=300)
+    source = TickerStreamSource(None, rest, symbols={"bitcoin": "BTCUSDT"})
+    received = []
+    
+    async def handler(data, fetched_at):
+        received.append(data)
+    
+    source.handler = handler
+    rest_prices = {"bitcoin": {"usd": 100.0, "jpy": 15000.0}, "ethereum": {"usd": 10.0, "jpy": 1500.0}}
+    
+    async def scenario():
+        await source._on_rest_prices(rest_prices, 0.0)
+        source._on_ticker({"s": "BTCUSDT", "c": "110", "o": "100", "q": "5"})
+        await source._on_rest_prices(rest_prices, 1.0)
+    
+    asyncio.run(scenario())
+    assert "provider" not in received[0]["bitcoin"]
+    # ストリームの価格を残したままRESTで補正したデータも、USD価格の提供元はBinance
+    assert received[1]["bitcoin"]["provider"] == "Binance"
+    assert received[1]["bitcoin"]["usd"] == 110.0
+    assert "provider" not in received[1]["ethereum"]
+
+
+def test_chart_footer_credits_recorded_providers():
+    cog = CryptoPrices(SimpleNamespace())
+    cog.snapshot_saved_at = float("inf")
+    sent = []
+    interaction = SimpleNamespace(response=SimpleNamespace(
+        send_message=lambda *args, **kwargs: asyncio.sleep(0, sent.append(kwargs))
+    ))
+    coin = SimpleNamespace(name="Bitcoin (BTC)", value="bitcoin")
+    window = SimpleNamespace(name="1時間", value=3600)
+    
+    async def scenario():
+        now = time.time()
+        await cog.apply_prices({"bitcoin": {"usd": 100.0, "provider": "Binance"}}, now - 120)
+        await cog.apply_prices({"bitcoin": {"usd": 101.0, "provider": "Binance"}}, now - 60)
+        await CryptoPrices.crypto_chart.callback(cog, interaction, coin, window)
+        await cog.apply_prices({"bitcoin": {"usd": 102.0}}, now)
+        await CryptoPrices.crypto_chart.callback(cog, interaction, coin, window)
+    
+    asyncio.run(scenario())
+    assert sent[0]["embed"].footer.text.startswith("データ提供: Binance API (2件")
+    assert sent[1]["embed"].footer.text.startswith("データ提供: Binance / CoinGecko API (3件")
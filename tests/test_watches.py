@@ -0,0 +1,114 @@
+"""ウォッチの定期更新（表示が変わったときだけ編集し、消えたメッセージのウォッチは終了する）"""
+import asyncio
+import os
+import tempfile
+from types import SimpleNamespace
+
+import discord
+
+import cogs.crypto_prices as crypto_prices
+from cogs.crypto_prices import CryptoPrices
+from utils.watches import WatchStore
+
+
+class Message:
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.embeds = []
+    
+    async def edit(self, embed):
+        if self.error is not None:
+            raise self.error
+        self.embeds.append(embed)
+
+
+class Bot:
+    """get_partial_messageable(...).get_partial_message(...) でメッセージIDごとの Message を返す"""
+    def __init__(self):
+        self.messages = {}
+    
+    def get_partial_messageable(self, channel_id, guild_id=None):
+        return SimpleNamespace(get_partial_message=lambda message_id: self.messages[message_id])
+
+
+def make_cog(*message_ids):
+    bot = Bot()
+    cog = CryptoPrices(bot)
+    cog.watches = WatchStore(path=os.path.join(tempfile.mkdtemp(), "watches.sqlite3"))
+    for message_id in message_ids:
+        bot.messages[message_id] = Message()
+        cog.watches.track(cog.watches.save(1, 10, message_id, 1, ["bitcoin"]))
+    return cog, bot
+
+
+def test_watch_edits_only_when_prices_change(monkeypatch):
+    monkeypatch.setattr(crypto_prices, "WATCH_CHANNEL_EDIT_INTERVAL", 0.0)
+    cog, bot = make_cog(100, 101)
+    cog.cache.set("bitcoin", {"usd": 100.0, "jpy": 15000.0})
+    
+    asyncio.run(cog.update_watches())
+    assert [len(bot.messages[i].embeds) for i in (100, 101)] == [1, 1]
+    
+    # 同じ表示になる周期では編集しない
+    asyncio.run(cog.update_watches())
+    assert [len(bot.messages[i].embeds) for i in (100, 101)] == [1, 1]
+    
+    cog.cache.set("bitcoin", {"usd": 101.0, "jpy": 15150.0})
+    asyncio.run(cog.update_watches())
+    assert [len(bot.messages[i].embeds) for i in (100, 101)] == [2, 2]
+
+
+def test_watch_loop_fires_every_interval(monkeypatch):
+    monkeypatch.setattr(crypto_prices, "WATCH_INTERVAL", 0.05)
+    cog, _ = make_cog()
+    calls = []
+    
+    async def update_watches():
+        calls.append(asyncio.get_running_loop().time())
+        if len(calls) == 2:
+            raise RuntimeError("boom")  # 1回の失敗でループは止まらない
+    
+    cog.update_watches = update_watches
+    
+    async def scenario():
+        task = asyncio.create_task(cog.watch_loop())
+        await asyncio.sleep(0.23)
+        task.cancel()
+    
+    asyncio.run(scenario())
+    assert 4 <= len(calls) <= 5
+    assert all(b - a >= 0.04 for a, b in zip(calls, calls[1:]))
+
+
+def test_watch_is_removed_when_message_is_gone(monkeypatch):
+    monkeypatch.setattr(crypto_prices, "WATCH_CHANNEL_EDIT_INTERVAL", 0.0)
+    cog, bot = make_cog(100, 101)
+    gone = SimpleNamespace(status=404, reason="Not Found")
+    bot.messages[100].error = discord.NotFound(gone, "Unknown Message")
+    cog.cache.set("bitcoin", {"usd": 100.0, "jpy": 15000.0})
+    
+    asyncio.run(cog.update_watches())
+    assert [w.message_id for w in cog.watches.watches.values()] == [101]
+    assert [w.message_id for w in cog.watches.read_saved()] == [101]
+    assert len(bot.messages[101].embeds) == 1
+    
+    # 終了したウォッチは次の周期から編集を試みない
+    bot.messages[100].error = AssertionError("edited a removed watch")
+    cog.cache.set("bitcoin", {"usd": 101.0, "jpy": 15150.0})
+    asyncio.run(cog.update_watches())
+    assert len(bot.messages[101].embeds) == 2
+
+
+def test_watch_footer_marks_expired_prices():
+    cog, bot = make_cog(100)
+    cog.cache.set("bitcoin", {"usd": 100.0, "jpy": 15000.0})
+    data, stored, fetched_at, version = cog.cache.cache["bitcoin"]
+    cog.cache.cache["bitcoin"] = (data, stored - 3600, fetched_at - 3600, version)  # 期限切れ（last_known のみ）
+    
+    async def failing(crypto_ids):
+        raise crypto_prices.CryptoAPIError("upstream down")
+    
+    cog.fetch_prices = failing
+    asyncio.run(cog.update_watches())
+    footer = bot.messages[100].embeds[0].footer.text
+    assert "自動更新" in footer and "前回取得したデータ" in footer
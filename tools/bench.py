@@ -0,0 +1,220 @@
+"""/crypto のメニュー選択と /crypto_list の負荷試験
+
+模擬CoinGecko（tools.mock_coingecko）を起動し、偽のインタラクションでCogのハンドラーを
+同時実行ユーザー数 N で呼び出して、レイテンシ・スループット・上流呼び出し回数・キャッシュヒット率を計測する。
+
+使い方:
+    python -m tools.bench --users 100 --requests 10 --latency 0.2 --rate-limit 0.05 --output bench.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from aiohttp import web
+
+from tools.mock_coingecko import make_app
+from tools.mock_price_stream import make_app as make_binance_app
+
+INTERACTION_IDS = itertools.count(1)  # 偽のインタラクションID（トレースIDに使われる）
+
+
+def percentile(values, q: float) -> float:
+    """q (0-100) パーセンタイル（最近傍法）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self._done = False
+    
+    def is_done(self) -> bool:
+        return self._done
+    
+    async def defer(self, **kwargs):
+        self._done = True
+    
+    async def send_message(self, content=None, **kwargs):
+        self._done = True
+        self.interaction.record(content, kwargs)
+
+
+class FakeMessage:
+    def __init__(self, interaction):
+        self.interaction = interaction
+    
+    async def edit(self, **kwargs):
+        self.interaction.edits += 1
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+    
+    async def send(self, content=None, **kwargs):
+        self.interaction.record(content, kwargs)
+        return FakeMessage(self.interaction)
+
+
+class FakeInteraction:
+    """ハンドラーが使う属性だけを持つ偽の discord.Interaction"""
+    def __init__(self, user_id: int):
+        self.id = next(INTERACTION_IDS)
+        self.user = SimpleNamespace(id=user_id)
+        self.guild_id = None
+        self.channel_id = 1
+        self.locale = "ja"
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.started = time.perf_counter()
+        self.finished = None
+        self.ok = False
+        self.edits = 0  # 期限切れで先に送ったメッセージの書き換え回数
+    
+    def record(self, content, kwargs):
+        if self.finished is None:
+            self.finished = time.perf_counter()
+            self.ok = kwargs.get("embed") is not None
+
+
+class FakeSelect:
+    def __init__(self, value: str):
+        self.values = [value]
+
+
+async def run_user(cog, scenario: str, user_id: int, requests: int, think: float, results: list):
+    from cogs.crypto_prices import CRYPTO_OPTIONS, CryptoView
+    
+    coins = [opt.value for opt in CRYPTO_OPTIONS]
+    for _ in range(requests):
+        kind = scenario if scenario != "mixed" else random.choice(("select", "list"))
+        interaction = FakeInteraction(user_id)
+        if kind == "select":
+            await CryptoView.select_crypto(cog.view, interaction, FakeSelect(random.choice(coins)))
+        else:
+            await cog.crypto_list.callback(cog, interaction)
+        end = interaction.finished or time.perf_counter()
+        results.append({"kind": kind, "latency": end - interaction.started, "ok": interaction.ok})
+        if think:
+            await asyncio.sleep(random.uniform(0, think * 2))
+
+
+async def run(args) -> dict:
+    mock = make_app(args.latency, args.jitter, args.rate_limit, args.timeout)
+    runner = web.AppRunner(mock)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    # ヘッジ先の代替プロバイダーも模擬サーバーに向ける（実際のBinanceには送らない）
+    alt_mock = make_binance_app(latency=args.alt_latency)
+    alt_runner = web.AppRunner(alt_mock)
+    await alt_runner.setup()
+    await web.TCPSite(alt_runner, "127.0.0.1", args.alt_port).start()
+    
+    from cogs.crypto_prices import CryptoPrices
+    
+    cog = CryptoPrices(bot=SimpleNamespace(add_view=lambda view: None))
+    cog.ready = True
+    await cog.cog_load()
+    # コイン一覧（/coins/list）の取得は計測対象外（upstream_calls は価格の取得だけを数える）
+    await cog.registry.stop()
+    if not args.prefetch:
+        # 先読みを止め、ハンドラー経由の取得だけを計測する
+        await cog.source.stop()
+        cog.cache.cache.clear()
+    else:
+        await asyncio.sleep(args.warmup)
+    
+    upstream_before = mock["stats"]["requests"]
+    alt_before = alt_mock["stats"]["requests"]
+    cache_before = cog.cache.stats()
+    results = []
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_user(cog, args.scenario, user_id, args.requests, args.think, results)
+        for user_id in range(args.users)
+    ))
+    elapsed = time.perf_counter() - started
+    cache_after = cog.cache.stats()
+    upstream = {key: value for key, value in mock["stats"].items()}
+    alt_calls = alt_mock["stats"]["requests"] - alt_before
+    
+    await cog.cog_unload()
+    await runner.cleanup()
+    await alt_runner.cleanup()
+    
+    latencies = [r["latency"] for r in results]
+    lookups = sum(cache_after[k] - cache_before[k] for k in ("hits", "stale_hits", "misses"))
+    hits = sum(cache_after[k] - cache_before[k] for k in ("hits", "stale_hits"))
+    return {
+        "config": {
+            "scenario": args.scenario, "users": args.users, "requests_per_user": args.requests,
+            "think": args.think, "prefetch": args.prefetch, "upstream_latency": args.latency,
+            "upstream_jitter": args.jitter, "rate_limit": args.rate_limit, "timeout": args.timeout,
+            "alt_provider": args.alt_provider,
+        },
+        "requests": len(results),
+        "errors": sum(1 for r in results if not r["ok"]),
+        "elapsed_seconds": elapsed,
+        "throughput_rps": len(results) / elapsed if elapsed else 0.0,
+        "latency_seconds": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies, default=0.0),
+        },
+        "upstream_calls": upstream["requests"] - upstream_before,
+        "upstream": upstream,
+        "alt_upstream_calls": alt_calls,
+        "cache_hit_ratio": hits / lookups if lookups else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="暗号通貨コマンドの負荷試験")
+    parser.add_argument("--scenario", choices=("select", "list", "mixed"), default="mixed")
+    parser.add_argument("--users", type=int, default=50, help="同時実行ユーザー数")
+    parser.add_argument("--requests", type=int, default=10, help="ユーザーあたりのリクエスト数")
+    parser.add_argument("--think", type=float, default=0.0, help="リクエスト間の平均待ち時間（秒）")
+    parser.add_argument("--prefetch", action="store_true", help="一括先読みを有効にして計測する")
+    parser.add_argument("--warmup", type=float, default=1.0, help="先読み有効時の計測前の待ち時間（秒）")
+    parser.add_argument("--port", type=int, default=8765, help="模擬CoinGeckoのポート")
+    parser.add_argument("--latency", type=float, default=0.1, help="模擬CoinGeckoの応答遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="429を返す確率")
+    parser.add_argument("--timeout", type=float, default=0.0, help="応答しない確率")
+    parser.add_argument("--alt-provider", choices=("binance", "none"), default="binance",
+                        help="ヘッジ先の代替プロバイダー（binance は模擬Binanceに送る）")
+    parser.add_argument("--alt-port", type=int, default=9001, help="模擬Binanceのポート")
+    parser.add_argument("--alt-latency", type=float, default=0.05, help="模擬Binanceの応答遅延（秒）")
+    parser.add_argument("--output", help="結果のJSONを書き出すファイル（省略時は標準出力）")
+    args = parser.parse_args()
+    
+    # Cogの読み込み前に接続先と保存先を差し替える
+    os.environ["COINGECKO_API_URL"] = f"http://127.0.0.1:{args.port}/api/v3"
+    os.environ["BINANCE_API_URL"] = f"http://127.0.0.1:{args.alt_port}/api/v3"
+    os.environ["CRYPTO_ALT_PROVIDER"] = args.alt_provider
+    os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="crypto-bench-"))
+    os.environ.setdefault("COINGECKO_RATE_PER_MIN", "600")
+    
+    report = asyncio.run(run(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text, file=sys.stdout if not args.output else sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
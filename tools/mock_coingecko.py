@@ -0,0 +1,118 @@
+"""ローカル検証用のCoinGecko API（/api/v3/simple/price と /api/v3/coins/list の代わり）
+
+使い方:
+    python -m tools.mock_coingecko --port 8765 --latency 0.2 --rate-limit 0.05
+    COINGECKO_API_URL=http://127.0.0.1:8765/api/v3 python main.py
+"""
+import argparse
+import asyncio
+import random
+import string
+import zlib
+
+from aiohttp import web
+
+
+def fake_price(crypto_id: str) -> float:
+    """通貨IDから決まる疑似的な価格（呼び出しごとに少し揺らす）"""
+    base = (zlib.crc32(crypto_id.encode()) % 100000) / 10 + 0.01
+    return base * (1 + random.gauss(0, 0.001))
+
+
+# /coins/list の先頭に並べる実在の通貨（残りは疑似的に生成する）
+KNOWN_COINS = [
+    ("bitcoin", "btc", "Bitcoin"), ("ethereum", "eth", "Ethereum"), ("ripple", "xrp", "XRP"),
+    ("cardano", "ada", "Cardano"), ("solana", "sol", "Solana"), ("dogecoin", "doge", "Dogecoin"),
+    ("shiba-inu", "shib", "Shiba Inu"), ("wrapped-bitcoin", "wbtc", "Wrapped Bitcoin"),
+]
+
+
+def fake_coins(count: int) -> list:
+    """/coins/list 形式の疑似的なコイン一覧（同じ count なら毎回同じ内容）"""
+    rng = random.Random(count)
+    coins = [{"id": coin_id, "symbol": symbol, "name": name} for coin_id, symbol, name in KNOWN_COINS]
+    for i in range(count - len(coins)):
+        word = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10)))
+        suffix = rng.choice(["", "", " Token", " Inu", " Protocol", " Finance"])
+        coins.append({"id": f"{word}-{i}", "symbol": word[:rng.randint(2, 5)], "name": word.title() + suffix})
+    return coins
+
+
+def make_app(latency: float = 0.1, jitter: float = 0.0, rate_limit: float = 0.0,
+             timeout: float = 0.0, hang: float = 30.0, retry_after: int = 1,
+             coin_count: int = 12000) -> web.Application:
+    """模擬サーバーを作成
+    
+    - latency/jitter: 応答までの遅延（秒）とその揺らぎ
+    - rate_limit: 429 を返す確率
+    - timeout: 応答せずに hang 秒待つ（クライアント側でタイムアウトさせる）確率
+    - coin_count: /coins/list が返すコインの数
+    呼び出し回数は app["stats"] に記録される。
+    """
+    stats = {"requests": 0, "ok": 0, "rate_limited": 0, "timeouts": 0}
+    
+    async def simple_price(request: web.Request) -> web.Response:
+        stats["requests"] += 1
+        roll = random.random()
+        if roll < timeout:
+            stats["timeouts"] += 1
+            await asyncio.sleep(hang)
+            return web.json_response({})
+        await asyncio.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+        if roll < timeout + rate_limit:
+            stats["rate_limited"] += 1
+            return web.json_response(
+                {"status": {"error_code": 429, "error_message": "rate limited"}},
+                status=429, headers={"Retry-After": str(retry_after)}
+            )
+        
+        stats["ok"] += 1
+        vs_currencies = request.query.get("vs_currencies", "usd").split(",")
+        data = {}
+        for crypto_id in filter(None, request.query.get("ids", "").split(",")):
+            usd = fake_price(crypto_id)
+            entry = {}
+            for currency in vs_currencies:
+                entry[currency] = {"usd": usd, "jpy": usd * 150, "btc": usd / 65000}.get(currency, usd)
+            if request.query.get("include_24hr_change") == "true":
+                entry["usd_24h_change"] = random.uniform(-5, 5)
+            if request.query.get("include_market_cap") == "true":
+                entry["usd_market_cap"] = usd * 1e8
+            if request.query.get("include_24hr_vol") == "true":
+                entry["usd_24h_vol"] = usd * 1e6
+            data[crypto_id] = entry
+        return web.json_response(data)
+    
+    coins = fake_coins(coin_count)
+    
+    async def coins_list(request: web.Request) -> web.Response:
+        stats["requests"] += 1
+        await asyncio.sleep(latency)
+        stats["ok"] += 1
+        return web.json_response(coins)
+    
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_get("/api/v3/simple/price", simple_price)
+    app.router.add_get("/api/v3/coins/list", coins_list)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカル検証用のCoinGecko API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.1, help="応答遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="応答遅延の揺らぎ（秒）")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="429を返す確率")
+    parser.add_argument("--timeout", type=float, default=0.0, help="応答しない確率")
+    parser.add_argument("--coins", type=int, default=12000, help="/coins/list が返すコインの数")
+    args = parser.parse_args()
+    web.run_app(
+        make_app(args.latency, args.jitter, args.rate_limit, args.timeout, coin_count=args.coins),
+        host=args.host, port=args.port
+    )
+
+
+if __name__ == "__main__":
+    main()
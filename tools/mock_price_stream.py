@@ -0,0 +1,110 @@
+"""ローカル検証用のBinance API（miniTicker 複合ストリームと /api/v3/ticker/24hr の代わり）
+
+使い方:
+    python -m tools.mock_price_stream --port 9001
+    CRYPTO_PRICE_SOURCE=websocket CRYPTO_STREAM_URL=ws://127.0.0.1:9001/stream python main.py
+    BINANCE_API_URL=http://127.0.0.1:9001/api/v3 python main.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+# シンボル -> 初期価格(USD)
+DEFAULT_PRICES = {
+    "BTCUSDT": 65000.0, "ETHUSDT": 3200.0, "XRPUSDT": 0.55, "ADAUSDT": 0.45, "SOLUSDT": 150.0,
+    "DOTUSDT": 6.5, "DOGEUSDT": 0.12, "AVAXUSDT": 30.0, "LINKUSDT": 14.0, "LTCUSDT": 80.0,
+    "UNIUSDT": 8.0, "BNBUSDT": 580.0, "TRXUSDT": 0.12, "XLMUSDT": 0.1, "ATOMUSDT": 7.0,
+    "ALGOUSDT": 0.15, "VETUSDT": 0.025, "FILUSDT": 4.5, "XTZUSDT": 0.8, "SHIBUSDT": 0.000018,
+    "BCHUSDT": 400.0, "APTUSDT": 7.5, "NEARUSDT": 5.0,
+}
+
+
+def make_app(interval: float = 1.0, drop_after: float = 0.0, latency: float = 0.05,
+             error_rate: float = 0.0) -> web.Application:
+    """模擬サーバーを作成
+    
+    - /stream: 接続ごとに、購読されたシンボルのランダムウォーク価格を interval 秒ごとに送信する。
+      drop_after > 0 の場合はその秒数で接続を切り、クライアントの再接続を確認できる。
+    - /api/v3/ticker/24hr: latency 秒後に応答し、error_rate の確率で 500 を返す。
+      呼び出し回数は app["stats"] に記録される。
+    """
+    stats = {"requests": 0, "errors": 0}
+    
+    async def ticker_24hr(request: web.Request) -> web.Response:
+        stats["requests"] += 1
+        await asyncio.sleep(latency)
+        if random.random() < error_rate:
+            stats["errors"] += 1
+            return web.json_response({"code": -1000, "msg": "internal error"}, status=500)
+        symbols = json.loads(request.query.get("symbols", "[]"))
+        tickers = []
+        for symbol in symbols:
+            price = DEFAULT_PRICES.get(symbol, 1.0) * (1 + random.gauss(0, 0.001))
+            tickers.append({
+                "symbol": symbol,
+                "lastPrice": f"{price:.8f}",
+                "priceChangePercent": f"{random.uniform(-5, 5):.3f}",
+                "quoteVolume": f"{price * 1_000_000:.2f}",
+            })
+        return web.json_response(tickers)
+
+    async def stream(request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        request.app["connections"] += 1
+        
+        streams = request.query.get("streams", "")
+        symbols = [name.split("@")[0].upper() for name in streams.split("/") if name]
+        prices = {symbol: DEFAULT_PRICES.get(symbol, 1.0) for symbol in symbols}
+        opens = dict(prices)
+        started = time.monotonic()
+        
+        try:
+            while not ws.closed:
+                if drop_after and time.monotonic() - started > drop_after:
+                    await ws.close()
+                    break
+                for symbol in symbols:
+                    prices[symbol] *= 1 + random.gauss(0, 0.001)
+                    await ws.send_str(json.dumps({
+                        "stream": f"{symbol.lower()}@miniTicker",
+                        "data": {
+                            "e": "24hrMiniTicker", "E": int(time.time() * 1000), "s": symbol,
+                            "c": f"{prices[symbol]:.8f}", "o": f"{opens[symbol]:.8f}",
+                            "q": f"{prices[symbol] * 1_000_000:.2f}",
+                        },
+                    }))
+                await asyncio.sleep(interval)
+        except ConnectionResetError:
+            pass
+        return ws
+    
+    app = web.Application()
+    app["connections"] = 0
+    app["stats"] = stats
+    app.router.add_get("/stream", stream)
+    app.router.add_get("/api/v3/ticker/24hr", ticker_24hr)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカル検証用のティッカーストリーム")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--interval", type=float, default=1.0, help="送信間隔（秒）")
+    parser.add_argument("--drop-after", type=float, default=0.0, help="指定秒数で接続を切る（0で無効）")
+    parser.add_argument("--latency", type=float, default=0.05, help="REST APIの応答遅延（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="REST APIが500を返す確率")
+    args = parser.parse_args()
+    web.run_app(
+        make_app(args.interval, args.drop_after, args.latency, args.error_rate),
+        host=args.host, port=args.port
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import math
+import os
+import sqlite3
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from utils.snapshot import DATA_DIR, connect_sqlite
+
+ABOVE = "above"
+BELOW = "below"
+
+
+class Alert(NamedTuple):
+    alert_id: int
+    user_id: int
+    channel_id: int
+    crypto_id: str
+    direction: str  # ABOVE: 価格が threshold 以上になったら / BELOW: 以下になったら
+    threshold: float
+    created_at: float
+    guild_id: Optional[int] = None  # DMの場合はNone（シャードの担当判定に使う）
+
+
+class AlertStore:
+    """価格アラートの保存と、価格更新時のしきい値判定
+    
+    通貨・方向ごとに (しきい値, ID) のソート済みリストを持ち、
+    価格が更新されたら二分探索で発火するアラートだけを取り出す（O(log n + k)）。
+    保存データを扱う read_saved / save / delete_saved は別スレッドで実行し、索引（replace / index_alert /
+    unindex / pop_triggered）はイベントループのスレッドだけで変更する（価格更新時の発火判定と競合させない）。
+    """
+    def __init__(self, path: str = os.path.join(DATA_DIR, "alerts.sqlite3")):
+        self.path = path
+        self.alerts: Dict[int, Alert] = {}
+        # (crypto_id, direction) -> [(threshold, alert_id), ...]（昇順）
+        self.index: Dict[Tuple[str, str], List[Tuple[float, int]]] = defaultdict(list)
+        self.by_user: Dict[int, set] = defaultdict(set)
+    
+    def _connect(self) -> sqlite3.Connection:
+        return connect_sqlite(
+            self.path,
+            "CREATE TABLE IF NOT EXISTS alerts ("
+            "alert_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, channel_id INTEGER NOT NULL, "
+            "crypto_id TEXT NOT NULL, direction TEXT NOT NULL, threshold REAL NOT NULL, created_at REAL NOT NULL, "
+            "guild_id INTEGER)"
+        )
+    
+    def __len__(self) -> int:
+        return len(self.alerts)
+    
+    def read_saved(self, owns: Optional[Callable[[Optional[int]], bool]] = None) -> List[Alert]:
+        """保存済みのアラートを読み込む（索引は変更しない）
+        
+        owns を渡すと、guild_id についてTrueを返すアラートだけを返す（クラスタモードで担当外のサーバーを除く）。
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT alert_id, user_id, channel_id, crypto_id, direction, threshold, created_at, guild_id FROM alerts"
+            ).fetchall()
+        finally:
+            conn.close()
+        if owns is not None:
+            rows = [row for row in rows if owns(row[-1])]
+        return [Alert(*row) for row in rows]
+    
+    def replace(self, alerts: List[Alert]) -> int:
+        """索引を読み込んだアラートで作り直す"""
+        self.alerts.clear()
+        self.index.clear()
+        self.by_user.clear()
+        for alert in alerts:
+            self.alerts[alert.alert_id] = alert
+            self.index[(alert.crypto_id, alert.direction)].append((alert.threshold, alert.alert_id))
+            self.by_user[alert.user_id].add(alert.alert_id)
+        for entries in self.index.values():
+            entries.sort()
+        return len(alerts)
+    
+    def index_alert(self, alert: Alert):
+        """保存したアラートを索引に追加"""
+        self.alerts[alert.alert_id] = alert
+        insort(self.index[(alert.crypto_id, alert.direction)], (alert.threshold, alert.alert_id))
+        self.by_user[alert.user_id].add(alert.alert_id)
+    
+    def unindex(self, alert_ids: List[int]):
+        """アラートを索引から外す（保存データの削除は delete_saved で行う）"""
+        for alert_id in alert_ids:
+            alert = self.alerts.pop(alert_id, None)
+            if alert is None:
+                continue
+            entries = self.index[(alert.crypto_id, alert.direction)]
+            i = bisect_left(entries, (alert.threshold, alert.alert_id))
+            if i < len(entries) and entries[i][1] == alert.alert_id:
+                del entries[i]
+            self.by_user[alert.user_id].discard(alert.alert_id)
+    
+    def save(self, user_id: int, channel_id: int, crypto_id: str, direction: str, threshold: float,
+             guild_id: Optional[int] = None) -> Alert:
+        """アラートを保存して返す（索引への追加は index_alert で行う）"""
+        created_at = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    "INSERT INTO alerts (user_id, channel_id, crypto_id, direction, threshold, created_at, guild_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (user_id, channel_id, crypto_id, direction, threshold, created_at, guild_id)
+                )
+        finally:
+            conn.close()
+        return Alert(cursor.lastrowid, user_id, channel_id, crypto_id, direction, threshold, created_at, guild_id)
+    
+    def delete_saved(self, alert_ids: List[int]):
+        """保存済みのアラートだけを削除（索引からは取り出し済みのもの）"""
+        if not alert_ids:
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("DELETE FROM alerts WHERE alert_id = ?", [(alert_id,) for alert_id in alert_ids])
+        finally:
+            conn.close()
+    
+    def for_user(self, user_id: int) -> List[Alert]:
+        return sorted((self.alerts[alert_id] for alert_id in self.by_user.get(user_id, ())), key=lambda a: a.alert_id)
+    
+    def pop_triggered(self, prices: Dict[str, float]) -> List[Alert]:
+        """価格に達したアラートを索引から取り出して返す（保存データの削除は呼び出し元で行う）"""
+        triggered = []
+        for crypto_id, price in prices.items():
+            if price is None:
+                continue
+            above = self.index.get((crypto_id, ABOVE))
+            if above:
+                # しきい値 <= 価格 のものは先頭から連続している
+                k = bisect_right(above, (price, math.inf))
+                triggered.extend(self.alerts[alert_id] for _, alert_id in above[:k])
+                del above[:k]
+            below = self.index.get((crypto_id, BELOW))
+            if below:
+                # しきい値 >= 価格 のものは末尾まで連続している
+                k = bisect_left(below, (price, -math.inf))
+                triggered.extend(self.alerts[alert_id] for _, alert_id in below[k:])
+                del below[k:]
+        for alert in triggered:
+            self.alerts.pop(alert.alert_id, None)
+            self.by_user[alert.user_id].discard(alert.alert_id)
+        return triggered
@@ -0,0 +1,451 @@
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import signal
+import sys
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import aiohttp
+
+from utils.coingecko import CryptoAPIError
+from utils.logs import slow_traces
+from utils.metrics import REGISTRY
+from utils.snapshot import DATA_DIR
+from utils.sources import PriceSource
+
+logger = logging.getLogger(__name__)
+
+# クラスタモードで起動する子プロセス数（1ならクラスタを使わず、このプロセスでBOTを動かす）
+CLUSTER_PROCESSES = int(os.environ.get("DISCORD_CLUSTER_PROCESSES", 1))
+
+# ランチャーが子プロセスに渡す設定（子プロセスでのみ設定される）
+CLUSTER_ID = int(os.environ["DISCORD_CLUSTER_ID"]) if os.environ.get("DISCORD_CLUSTER_ID") else None
+
+# シャード数（未設定ならDiscordの推奨値）と、このプロセスが担当するシャード（未設定なら全シャード）
+SHARD_COUNT = int(os.environ["DISCORD_SHARD_COUNT"]) if os.environ.get("DISCORD_SHARD_COUNT") else None
+SHARD_IDS = [int(s) for s in os.environ.get("DISCORD_SHARD_IDS", "").split(",") if s.strip()] or None
+
+# リーダー（ランチャー）と子プロセスをつなぐUnixソケット
+CLUSTER_SOCKET = os.environ.get("DISCORD_CLUSTER_SOCKET", os.path.join(DATA_DIR, "cluster.sock"))
+
+# 子プロセスを順番に起動する間隔（秒）。IDENTIFYのレート制限に同時にかからないようにする
+CLUSTER_STAGGER = float(os.environ.get("DISCORD_CLUSTER_STAGGER", 5))
+
+STATUS_INTERVAL = 10  # 子プロセスがシャードの状態を報告する間隔（秒）
+MAX_MESSAGE = 4 * 1024 * 1024  # ソケットで受け付ける1行（1メッセージ）の上限
+
+DISCORD_GATEWAY_BOT_URL = "https://discord.com/api/v10/gateway/bot"
+
+CLUSTER_LOOKUPS = REGISTRY.counter(
+    "crypto_cluster_lookups_total", "子プロセスからの価格問い合わせ（共有キャッシュのヒット/上流への取得）", ["result"]
+)
+CLUSTER_CONNECTED = REGISTRY.gauge(
+    "crypto_cluster_connected_processes", "リーダーに接続中の子プロセス数"
+)
+
+
+def split_shards(shard_count: int, processes: int) -> List[List[int]]:
+    """シャードをプロセス数で連続した範囲に分割"""
+    size = math.ceil(shard_count / processes)
+    return [list(range(start, min(start + size, shard_count))) for start in range(0, shard_count, size)]
+
+
+def owns_guild(bot, guild_id: Optional[int]) -> bool:
+    """このプロセスのシャードがサーバーを担当しているか（DMはシャード0が受け取る）"""
+    shard_ids = getattr(bot, "shard_ids", None)
+    if shard_ids is None or not bot.shard_count:
+        return True
+    shard_id = 0 if guild_id is None else (guild_id >> 22) % bot.shard_count
+    return shard_id in shard_ids
+
+
+def shard_status(bot) -> Dict[str, dict]:
+    """シャードごとの接続状態（/health 用）"""
+    shards = getattr(bot, "shards", None)
+    if not shards:
+        return {}
+    guilds = Counter(guild.shard_id for guild in bot.guilds)
+    status = {}
+    for shard_id, shard in sorted(shards.items()):
+        latency = shard.latency
+        status[str(shard_id)] = {
+            "connected": not shard.is_closed(),
+            "latency_ms": round(latency * 1000, 1) if math.isfinite(latency) else None,
+            "guilds": guilds[shard_id],
+        }
+    return status
+
+
+def cluster_status(bot) -> dict:
+    """子プロセスからリーダーに報告する状態"""
+    return {
+        "ready": bot.is_ready(),
+        "guilds": len(bot.guilds),
+        "shards": shard_status(bot),
+    }
+
+
+async def fetch_recommended_shards(token: str) -> int:
+    """Discordが推奨するシャード数を取得"""
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+        async with session.get(DISCORD_GATEWAY_BOT_URL, headers={"Authorization": f"Bot {token}"}) as response:
+            response.raise_for_status()
+            data = await response.json()
+    return int(data["shards"])
+
+
+def encode(message: dict) -> bytes:
+    """ソケットに流すメッセージ（1行1JSON）"""
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+
+class PriceLeader:
+    """クラスタのリーダー（ランチャープロセス）が持つ共有の価格キャッシュ
+    
+    上流への問い合わせはすべてリーダーに集約し、Unixソケットで子プロセスとやりとりする。
+    - "prices": 価格ソースの更新を全プロセスにブロードキャスト
+    - "fetch": 子プロセスのキャッシュにない通貨の問い合わせに応答（同じ通貨の同時取得は1回にまとめる）
+    - "status": 子プロセスから届いたシャードの状態・メトリクス・遅いトレースを集計（Webサーバーはリーダーだけが持つため）
+    """
+    def __init__(self, fetcher, path: str = CLUSTER_SOCKET, cache_duration: float = 60):
+        self.fetcher = fetcher  # HedgedPriceFetcher
+        self.path = path
+        self.cache_duration = cache_duration
+        # 通貨ID -> (データ, 取得時刻(UNIX時間), 保存時刻(単調時計))
+        self.prices: Dict[str, Tuple[dict, float, float]] = {}
+        self._inflight: Dict[Tuple[str, ...], asyncio.Future] = {}
+        self._answers: Set[asyncio.Task] = set()  # 応答中の問い合わせ
+        self.writers = set()
+        self.clusters: Dict[int, dict] = {}
+        # クラスタID -> 子プロセスから最後に届いたメトリクス（REGISTRY.collect() の結果）
+        self.metrics: Dict[int, List[dict]] = {}
+        # クラスタID -> 子プロセスでサンプリングされた遅いトレース（新しい順）
+        self.traces: Dict[int, List[dict]] = {}
+        self.server: Optional[asyncio.AbstractServer] = None
+        CLUSTER_CONNECTED.set_function(lambda: len(self.writers))
+    
+    async def start(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # 前回のプロセスが残したソケット
+        self.server = await asyncio.start_unix_server(self.handle, path=self.path, limit=MAX_MESSAGE)
+        logger.info(f"🔗 共有価格キャッシュを起動しました: {self.path}")
+    
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+        for task in [*self._answers, *self._inflight.values()]:
+            task.cancel()
+        await asyncio.gather(*self._answers, *self._inflight.values(), return_exceptions=True)
+        for writer in list(self.writers):
+            writer.close()
+        if self.server is not None:
+            await self.server.wait_closed()
+            self.server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+    
+    def store(self, data: Dict[str, dict], fetched_at: float):
+        now = time.monotonic()
+        for crypto_id, crypto_data in data.items():
+            self.prices[crypto_id] = (crypto_data, fetched_at, now)
+    
+    def broadcast(self, message: dict):
+        payload = encode(message)
+        for writer in list(self.writers):
+            if not writer.is_closing():
+                writer.write(payload)
+    
+    async def publish(self, data: Dict[str, dict], fetched_at: float):
+        """価格ソースのハンドラー: 保存して全プロセスに配信"""
+        self.store(data, fetched_at)
+        self.broadcast({"op": "prices", "data": data, "fetched_at": fetched_at})
+    
+    async def lookup(self, crypto_ids: List[str]) -> Dict[str, dict]:
+        """新鮮なものはキャッシュから返し、足りない通貨だけをまとめて取得"""
+        now = time.monotonic()
+        result = {}
+        missing = []
+        for crypto_id in crypto_ids:
+            entry = self.prices.get(crypto_id)
+            if entry is not None and now - entry[2] < self.cache_duration:
+                result[crypto_id] = entry[0]
+            else:
+                missing.append(crypto_id)
+        if not missing:
+            CLUSTER_LOOKUPS.inc(result="hit")
+            return result
+        
+        CLUSTER_LOOKUPS.inc(result="fetch")
+        key = tuple(sorted(missing))
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.fetcher.fetch(list(key)))
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._on_fetch_done(key, done))
+        result.update(await asyncio.shield(future))
+        return result
+    
+    def _on_fetch_done(self, key: Tuple[str, ...], future: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not future.cancelled() and future.exception() is None:
+            self.store(future.result(), time.time())
+    
+    async def answer(self, writer: asyncio.StreamWriter, message: dict):
+        """子プロセスからの問い合わせに応答"""
+        reply = {"op": "result", "id": message.get("id")}
+        try:
+            reply["data"] = await self.lookup(message.get("ids") or [])
+        except CryptoAPIError as e:
+            reply["error"] = e.message
+        except Exception as e:
+            logger.exception(f"❌ 共有キャッシュでの価格取得エラー: {e}")
+            reply["error"] = "❌ データの取得中にエラーが発生しました。"
+        if not writer.is_closing():
+            writer.write(encode(reply))
+    
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """子プロセス1つ分の接続"""
+        self.writers.add(writer)
+        cluster_id = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                op = message.get("op")
+                if op == "hello":
+                    cluster_id = int(message["cluster"])
+                    self.clusters.setdefault(cluster_id, {})["connected"] = True
+                    self.send_warmup(writer)
+                elif op == "status" and cluster_id is not None:
+                    self.clusters[cluster_id].update(message.get("status") or {})
+                    self.clusters[cluster_id]["reported_at"] = time.time()
+                    if message.get("metrics") is not None:
+                        self.metrics[cluster_id] = message["metrics"]
+                    if message.get("traces") is not None:
+                        self.traces[cluster_id] = message["traces"]
+                elif op == "fetch":
+                    task = asyncio.create_task(self.answer(writer, message))
+                    self._answers.add(task)
+                    task.add_done_callback(self._answers.discard)
+        except (ConnectionError, ValueError, asyncio.LimitOverrunError) as e:
+            logger.warning(f"⚠️ クラスタ {cluster_id} との通信エラー: {e}")
+        finally:
+            self.writers.discard(writer)
+            if cluster_id is not None:
+                self.clusters[cluster_id].update(connected=False, ready=False)
+            writer.close()
+    
+    def send_warmup(self, writer: asyncio.StreamWriter):
+        """接続してきた子プロセスに、手元の価格をまとめて渡す"""
+        by_fetched_at: Dict[float, Dict[str, dict]] = {}
+        for crypto_id, (crypto_data, fetched_at, _) in self.prices.items():
+            by_fetched_at.setdefault(fetched_at, {})[crypto_id] = crypto_data
+        for fetched_at, data in sorted(by_fetched_at.items()):
+            writer.write(encode({"op": "prices", "data": data, "fetched_at": fetched_at}))
+    
+    def slow_traces(self, limit: int) -> List[dict]:
+        """子プロセスから届いた遅いトレースをまとめて新しい順に返す（インタラクションは子プロセスが処理する）"""
+        traces = [
+            {**trace, "cluster": cluster_id}
+            for cluster_id, reported in self.traces.items()
+            for trace in reported
+        ]
+        traces.sort(key=lambda trace: trace["started_at"], reverse=True)
+        return traces[:limit]
+    
+    def health(self, launcher: Optional["ClusterLauncher"] = None) -> dict:
+        """各プロセスから報告されたシャードの状態を集計"""
+        processes = launcher.status() if launcher else {}
+        clusters = {}
+        shards = {}
+        for cluster_id in sorted(set(self.clusters) | set(processes)):
+            reported = self.clusters.get(cluster_id, {})
+            clusters[str(cluster_id)] = {
+                **processes.get(cluster_id, {}),
+                "connected": reported.get("connected", False),
+                "ready": reported.get("ready", False),
+                "guilds": reported.get("guilds", 0),
+                "reported_at": reported.get("reported_at"),
+            }
+            shards.update(reported.get("shards") or {})
+        ready = bool(clusters) and all(cluster["ready"] for cluster in clusters.values())
+        return {
+            "ready": ready,
+            "guilds": sum(cluster["guilds"] for cluster in clusters.values()),
+            "clusters": clusters,
+            "shards": dict(sorted(shards.items(), key=lambda item: int(item[0]))),
+        }
+
+
+class ClusterClient(PriceSource):
+    """子プロセス側: リーダーの共有キャッシュを価格ソース兼取得処理として使う
+    
+    HedgedPriceFetcher と同じ fetch(crypto_ids) を持つので、Cogからはそのまま差し替えられる。
+    接続が切れた場合は再接続し、その間の問い合わせはCryptoAPIErrorにする（キャッシュで応答する）。
+    """
+    name = "cluster"
+    
+    def __init__(self, cluster_id: int, path: str = CLUSTER_SOCKET,
+                 status: Optional[Callable[[], dict]] = None, timeout: float = 15.0, max_backoff: float = 30.0):
+        super().__init__()
+        self.cluster_id = cluster_id
+        self.path = path
+        self.status = status
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self.reconnects = 0
+    
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+    
+    async def fetch(self, crypto_ids: List[str]) -> Dict[str, dict]:
+        if not self.connected:
+            raise CryptoAPIError("⚠️ 価格サーバーに接続できません。しばらく待ってから再度お試しください。")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            self.writer.write(encode({"op": "fetch", "id": request_id, "ids": list(crypto_ids)}))
+            reply = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise CryptoAPIError("❌ API接続がタイムアウトしました。")
+        finally:
+            self.pending.pop(request_id, None)
+        if "error" in reply:
+            raise CryptoAPIError(reply["error"])
+        return reply["data"]
+    
+    async def report_status(self):
+        while True:
+            if self.status is not None and self.connected:
+                try:
+                    self.writer.write(encode({
+                        "op": "status", "status": self.status(),
+                        "metrics": REGISTRY.collect(), "traces": slow_traces(),
+                    }))
+                except Exception as e:
+                    logger.warning(f"⚠️ クラスタの状態を報告できませんでした: {e}")
+            await asyncio.sleep(STATUS_INTERVAL)
+    
+    async def receive(self, reader: asyncio.StreamReader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            op = message.get("op")
+            if op == "result":
+                future = self.pending.get(message.get("id"))
+                if future is not None and not future.done():
+                    future.set_result(message)
+            elif op == "prices" and message.get("data"):
+                try:
+                    await self.handler(message["data"], message["fetched_at"])
+                except Exception as e:
+                    logger.exception(f"❌ 共有キャッシュからの価格の反映でエラーが発生しました: {e}")
+    
+    async def run(self):
+        backoff = 1.0
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=MAX_MESSAGE)
+            except OSError as e:
+                logger.warning(f"⚠️ 共有価格キャッシュに接続できません: {e}（{backoff:.0f}秒後に再接続）")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            
+            backoff = 1.0
+            self.writer = writer
+            writer.write(encode({"op": "hello", "cluster": self.cluster_id}))
+            logger.info(f"🔗 共有価格キャッシュに接続しました (クラスタ {self.cluster_id})")
+            reporter = asyncio.create_task(self.report_status())
+            try:
+                await self.receive(reader)
+            except (ConnectionError, ValueError, asyncio.LimitOverrunError) as e:
+                logger.warning(f"⚠️ 共有価格キャッシュとの通信エラー: {e}")
+            finally:
+                reporter.cancel()
+                self.writer = None
+                writer.close()
+                for future in self.pending.values():
+                    if not future.done():
+                        future.set_exception(CryptoAPIError("⚠️ 価格サーバーとの接続が切れました。再度お試しください。"))
+            self.reconnects += 1
+            await asyncio.sleep(backoff)
+
+
+class ClusterLauncher:
+    """子プロセスを起動・監視し、終了したら間隔を空けて再起動する"""
+    def __init__(self, shard_count: int, processes: int, script: str, socket_path: str = CLUSTER_SOCKET):
+        self.shard_count = shard_count
+        self.shard_ranges = split_shards(shard_count, processes)
+        self.script = script
+        self.socket_path = socket_path
+        self.processes: Dict[int, asyncio.subprocess.Process] = {}
+        self.restarts = Counter()
+        self._tasks: List[asyncio.Task] = []
+    
+    def start(self):
+        for cluster_id, shard_ids in enumerate(self.shard_ranges):
+            self._tasks.append(asyncio.create_task(self.supervise(cluster_id, shard_ids), name=f"cluster:{cluster_id}"))
+    
+    async def supervise(self, cluster_id: int, shard_ids: List[int]):
+        await asyncio.sleep(cluster_id * CLUSTER_STAGGER)
+        env = dict(
+            os.environ,
+            DISCORD_CLUSTER_ID=str(cluster_id),
+            DISCORD_SHARD_IDS=",".join(map(str, shard_ids)),
+            DISCORD_SHARD_COUNT=str(self.shard_count),
+            DISCORD_CLUSTER_SOCKET=self.socket_path,
+        )
+        backoff = 1.0
+        while True:
+            started = time.monotonic()
+            process = await asyncio.create_subprocess_exec(sys.executable, self.script, env=env)
+            self.processes[cluster_id] = process
+            logger.info(f"🧩 クラスタ {cluster_id} を起動しました (PID: {process.pid}, シャード: {shard_ids[0]}-{shard_ids[-1]})")
+            code = await process.wait()
+            
+            # しばらく動いていたなら待ち時間をリセット（起動直後に落ち続ける場合だけ間隔を広げる）
+            if time.monotonic() - started > 60:
+                backoff = 1.0
+            self.restarts[cluster_id] += 1
+            logger.warning(f"⚠️ クラスタ {cluster_id} が終了しました (終了コード: {code})。{backoff:.0f}秒後に再起動します")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+    
+    async def stop(self, timeout: float = 10.0):
+        for task in self._tasks:
+            task.cancel()
+        running = [process for process in self.processes.values() if process.returncode is None]
+        for process in running:
+            process.send_signal(signal.SIGTERM)
+        for process in running:
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+    
+    def status(self) -> Dict[int, dict]:
+        return {
+            cluster_id: {
+                "pid": self.processes[cluster_id].pid if cluster_id in self.processes else None,
+                "running": cluster_id in self.processes and self.processes[cluster_id].returncode is None,
+                "restarts": self.restarts[cluster_id],
+                "shard_ids": shard_ids,
+            }
+            for cluster_id, shard_ids in enumerate(self.shard_ranges)
+        }
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Iterable, Optional
+
+import aiohttp
+
+from utils.metrics import UPSTREAM_LATENCY, UPSTREAM_REQUESTS, UPSTREAM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# CoinGecko APIのベースURL（テストやベンチマークではモックサーバーに向ける）
+COINGECKO_API_URL = os.environ.get("COINGECKO_API_URL", "https://api.coingecko.com/api/v3")
+
+# 1分あたりのリクエスト数の上限（無料プランは約30回/分）
+COINGECKO_RATE_PER_MIN = float(os.environ.get("COINGECKO_RATE_PER_MIN", 30))
+
+
+class CryptoAPIError(Exception):
+    """API呼び出しの失敗。messageはそのままユーザーに表示する"""
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+class RateLimitedError(CryptoAPIError):
+    """レート制限のクールダウン中。呼び出し元はキャッシュで応答する"""
+    def __init__(self, retry_in: float):
+        super().__init__("⚠️ APIのレート制限に達しました。しばらく待ってから再度お試しください。")
+        self.retry_in = retry_in
+
+
+class TokenBucket:
+    """トークンバケット方式のレートリミッター
+    
+    rateは毎秒補充されるトークン数。429を受けたらrateを下げ、成功が続けば元に戻す。
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.max_rate = rate
+        self.min_rate = rate / 8
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    async def acquire(self):
+        """トークンを1つ取得する（足りなければ補充まで待つ。待つ順番は到着順）"""
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+    
+    def slow_down(self):
+        """レート制限を受けたので補充速度を半分にする"""
+        self.rate = max(self.min_rate, self.rate / 2)
+    
+    def speed_up(self):
+        """成功したので補充速度を少しずつ元に戻す"""
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-Afterヘッダー（秒数またはHTTP日付）を秒数に変換"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def create_session() -> aiohttp.ClientSession:
+    """上流API用の共有HTTPセッションを作成（接続を使い回してDNS/TLSのコストを削減）"""
+    connector = aiohttp.TCPConnector(
+        limit=20,                # 全体の同時接続数の上限
+        limit_per_host=10,       # api.coingecko.com への同時接続数の上限
+        ttl_dns_cache=300,       # DNS解決結果を5分間キャッシュ
+        keepalive_timeout=60,    # アイドル接続を60秒間保持
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=10)
+    )
+
+
+class CoinGeckoClient:
+    """Cog全体で共有するCoinGecko APIクライアント
+    
+    - トークンバケットで送信ペースを制御
+    - 429を受けたら全リクエスト共通のクールダウンに入る（Retry-Afterを優先）
+    - クールダウン中の新規リクエストは待たせずにRateLimitedErrorを送出する
+    - 実行中のリクエストのリトライはクールダウン明けにジッターを付けて分散させる
+    """
+    def __init__(self, session: aiohttp.ClientSession, rate_per_min: float = COINGECKO_RATE_PER_MIN,
+                 max_attempts: int = 3, base_url: str = COINGECKO_API_URL):
+        self.session = session
+        self.base_url = base_url
+        self.max_attempts = max_attempts
+        self.bucket = TokenBucket(rate=rate_per_min / 60, capacity=max(1.0, rate_per_min / 6))
+        self.cooldown_until = 0.0
+        self._consecutive_429 = 0
+    
+    @property
+    def cooldown_remaining(self) -> float:
+        return max(0.0, self.cooldown_until - time.monotonic())
+    
+    def _start_cooldown(self, retry_after: Optional[float]):
+        """共通のクールダウンを開始・延長する"""
+        self._consecutive_429 += 1
+        backoff = min(60.0, 2 ** self._consecutive_429)
+        delay = retry_after if retry_after is not None else backoff
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+        self.bucket.slow_down()
+        logger.warning(f"⚠️ CoinGeckoのレート制限: {delay:.1f}秒間クールダウンします")
+    
+    async def _wait_for_retry(self, attempt: int):
+        """クールダウン明け（なければ指数バックオフ）までジッター付きで待つ"""
+        delay = max(self.cooldown_remaining, float(2 ** attempt))
+        await asyncio.sleep(delay + random.uniform(0, 1))
+    
+    async def simple_price(self, ids: Iterable[str], vs_currencies: str = "usd,jpy,btc",
+                           include_market_data: bool = True) -> dict:
+        """/simple/price を呼び出す"""
+        params = {
+            "ids": ",".join(ids),
+            "vs_currencies": vs_currencies,
+            "include_24hr_change": "true",
+        }
+        if include_market_data:
+            params["include_market_cap"] = "true"
+            params["include_24hr_vol"] = "true"
+        return await self.get_json("/simple/price", params)
+    
+    async def get_json(self, path: str, params: Optional[dict] = None):
+        """GETリクエストを送信してJSONを返す（リトライ付き）"""
+        if self.cooldown_remaining > 0:
+            raise RateLimitedError(self.cooldown_remaining)
+        
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.max_attempts):
+            last_attempt = attempt == self.max_attempts - 1
+            await self.bucket.acquire()
+            started = time.perf_counter()
+            try:
+                async with self.session.get(url, params=params) as response:
+                    UPSTREAM_REQUESTS.inc(endpoint=path, status=str(response.status))
+                    if response.status == 200:
+                        self._consecutive_429 = 0
+                        self.bucket.speed_up()
+                        return await response.json()
+                    
+                    elif response.status == 429:
+                        # レート制限
+                        self._start_cooldown(parse_retry_after(response.headers.get("Retry-After")))
+                        if last_attempt:
+                            raise RateLimitedError(self.cooldown_remaining)
+                    
+                    else:
+                        # その他のHTTPエラー
+                        error_text = await response.text()
+                        logger.warning(f"API Error {response.status}: {error_text}")
+                        if last_attempt:
+                            raise CryptoAPIError(
+                                f"❌ API エラー (ステータス: {response.status})\nしばらく待ってから再度お試しください。"
+                            )
+            
+            except CryptoAPIError:
+                raise
+            
+            except asyncio.TimeoutError:
+                UPSTREAM_REQUESTS.inc(endpoint=path, status="timeout")
+                if last_attempt:
+                    raise CryptoAPIError("❌ API接続がタイムアウトしました。")
+            
+            except Exception as e:
+                UPSTREAM_REQUESTS.inc(endpoint=path, status="error")
+                logger.warning(f"予期せぬエラー (試行 {attempt + 1}/{self.max_attempts}): {str(e)}")
+                if last_attempt:
+                    raise CryptoAPIError(f"❌ エラーが発生しました: {str(e)}")
+            
+            finally:
+                UPSTREAM_LATENCY.observe(time.perf_counter() - started, endpoint=path)
+            
+            UPSTREAM_RETRIES.inc(endpoint=path)
+            await self._wait_for_retry(attempt)
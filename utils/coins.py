@@ -0,0 +1,253 @@
+import asyncio
+import heapq
+import logging
+import os
+import sqlite3
+import time
+from bisect import bisect_left
+from itertools import groupby
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from utils.coingecko import CoinGeckoClient, CryptoAPIError
+from utils.metrics import REGISTRY
+from utils.snapshot import DATA_DIR, connect_sqlite
+
+logger = logging.getLogger(__name__)
+
+# コイン一覧（/coins/list）を取り直す間隔（秒）
+COIN_REGISTRY_REFRESH = float(os.environ.get("CRYPTO_COIN_REGISTRY_REFRESH", 24 * 3600))
+
+MAX_CHOICES = 25      # Discordのオートコンプリートで返せる候補数の上限
+HOT_RANGE = 256       # 前方一致する候補がこれより多い入力は、索引の作成時に結果を計算しておく
+LABEL_LIMIT = 100     # 候補の表示名の長さの上限
+
+COIN_REGISTRY_ENTRIES = REGISTRY.gauge("crypto_coin_registry_entries", "コイン一覧の登録数")
+COIN_SEARCH_LATENCY = REGISTRY.histogram(
+    "crypto_coin_search_seconds", "オートコンプリートの検索時間",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01)
+)
+
+
+class Coin(NamedTuple):
+    coin_id: str
+    symbol: str
+    name: str
+    
+    @property
+    def label(self) -> str:
+        return f"{self.name} ({self.symbol.upper()})"[:LABEL_LIMIT]
+
+
+class CoinIndex:
+    """シンボル・名前・IDの前方一致検索用の索引（作成後は変更しない）
+    
+    小文字にしたキーのソート済み配列を二分探索して、前方一致する範囲を取り出す。
+    範囲が HOT_RANGE を超える入力（"b" や "inu" など）は、作成時に上位の結果を計算しておくので、
+    検索時に順位付けするのは常に HOT_RANGE 件以下になる。
+    順位: 優先リスト（メニューに並ぶ主要通貨）の順 > 完全一致 > キーが短い順
+    """
+    def __init__(self, coins: Iterable[Coin], priority: Iterable[str] = ()):
+        self.coins: List[Coin] = list(coins)
+        self.by_id: Dict[str, int] = {coin.coin_id: i for i, coin in enumerate(self.coins)}
+        priority = list(priority)
+        self.rank: Dict[str, int] = {coin_id: rank for rank, coin_id in enumerate(priority)}
+        
+        # (キー, 優先順位, コインの添字)
+        entries: List[Tuple[str, int, int]] = []
+        default_rank = len(priority)
+        for i, coin in enumerate(self.coins):
+            rank = self.rank.get(coin.coin_id, default_rank)
+            name = coin.name.lower()
+            keys = {coin.symbol.lower(), name, coin.coin_id}
+            keys.update(name.split()[1:])  # "Shiba Inu" を "inu" でも探せるように
+            for key in keys:
+                if key:
+                    entries.append((key, rank, i))
+        entries.sort()
+        self.entries = entries
+        self.keys = [key for key, _, _ in entries]
+        
+        # 入力なしのときは優先リストの順
+        self.popular = [self.by_id[coin_id] for coin_id in priority if coin_id in self.by_id][:MAX_CHOICES]
+        
+        # 候補の多い前方一致の結果。ある長さで候補が多かった範囲だけを、1文字長い接頭辞で分け直していく
+        self.hot: Dict[str, List[int]] = {}
+        ranges = [(0, len(entries))]
+        length = 1
+        while ranges:
+            next_ranges = []
+            for lo, hi in ranges:
+                for prefix, group in groupby(range(lo, hi), key=lambda j: self.keys[j][:length]):
+                    group = list(group)
+                    if len(prefix) == length and len(group) > HOT_RANGE:
+                        self.hot[prefix] = self._top(entries[group[0]:group[-1] + 1], prefix)
+                        next_ranges.append((group[0], group[-1] + 1))
+            ranges = next_ranges
+            length += 1
+    
+    def __len__(self) -> int:
+        return len(self.coins)
+    
+    @staticmethod
+    def _top(entries: List[Tuple[str, int, int]], query: str, limit: int = MAX_CHOICES) -> List[int]:
+        """候補を順位付けして、重複を除いた上位のコインの添字を返す"""
+        # 1つのコインは最大で数個のキーを持つため、多めに取ってから重複を除く
+        best = heapq.nsmallest(limit * 4, entries, key=lambda e: (e[1], e[0] != query, len(e[0]), e[0]))
+        results = []
+        seen = set()
+        for _, _, i in best:
+            if i in seen:
+                continue
+            seen.add(i)
+            results.append(i)
+            if len(results) >= limit:
+                break
+        return results
+    
+    def search(self, query: str, limit: int = MAX_CHOICES) -> List[Coin]:
+        """入力に前方一致するコインを順位の高い順に返す"""
+        query = query.strip().lower()
+        if not query:
+            indexes = self.popular
+        elif query in self.hot:
+            indexes = self.hot[query]
+        else:
+            lo = bisect_left(self.keys, query)
+            hi = bisect_left(self.keys, query + "\U0010ffff", lo)
+            indexes = self._top(self.entries[lo:hi], query, limit) if hi > lo else []
+        return [self.coins[i] for i in indexes[:limit]]
+    
+    def get(self, coin_id: str) -> Optional[Coin]:
+        i = self.by_id.get(coin_id)
+        return None if i is None else self.coins[i]
+    
+    def resolve(self, text: str) -> Optional[Coin]:
+        """ID・シンボル・名前の入力を1つのコインに解決（オートコンプリートを使わずに入力された場合）"""
+        coin = self.get(text.strip().lower())
+        if coin is not None:
+            return coin
+        matches = self.search(text, limit=1)
+        if matches and text.strip().lower() in (matches[0].symbol.lower(), matches[0].name.lower()):
+            return matches[0]
+        return None
+
+
+class CoinRegistry:
+    """CoinGeckoの全コイン一覧（/coins/list）をSQLiteに保存し、検索用の索引を持つ
+    
+    client を渡して start() すると定期的に一覧を取り直す。渡さない場合（クラスタモードの子プロセス）は、
+    リーダーが更新した保存ファイルを読み直す。
+    """
+    def __init__(self, path: str = os.path.join(DATA_DIR, "coins.sqlite3"), priority: Iterable[str] = (),
+                 refresh_interval: float = COIN_REGISTRY_REFRESH):
+        self.path = path
+        self.priority = list(priority)
+        self.refresh_interval = refresh_interval
+        self.index = CoinIndex([], self.priority)
+        self.fetched_at: Optional[float] = None
+        self.loaded_mtime: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        COIN_REGISTRY_ENTRIES.set_function(lambda: len(self.index))
+    
+    def _connect(self) -> sqlite3.Connection:
+        return connect_sqlite(
+            self.path,
+            "CREATE TABLE IF NOT EXISTS coins (coin_id TEXT PRIMARY KEY, symbol TEXT NOT NULL, name TEXT NOT NULL)",
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL)"
+        )
+    
+    def load(self) -> int:
+        """保存済みの一覧を読み込んで索引を作る（ブロッキング）"""
+        if not os.path.exists(self.path):
+            return 0
+        mtime = os.path.getmtime(self.path)
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT coin_id, symbol, name FROM coins").fetchall()
+            row = conn.execute("SELECT value FROM meta WHERE key = 'fetched_at'").fetchone()
+        finally:
+            conn.close()
+        self.index = CoinIndex((Coin(*row) for row in rows), self.priority)
+        self.fetched_at = row[0] if row else None
+        self.loaded_mtime = mtime
+        return len(rows)
+    
+    def save(self, coins: List[Coin], fetched_at: float):
+        """一覧を置き換えて保存し、索引を作り直す（ブロッキング）"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM coins")
+                conn.executemany("INSERT OR REPLACE INTO coins (coin_id, symbol, name) VALUES (?, ?, ?)", coins)
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fetched_at', ?)", (fetched_at,))
+        finally:
+            conn.close()
+        self.index = CoinIndex(coins, self.priority)
+        self.fetched_at = fetched_at
+        self.loaded_mtime = os.path.getmtime(self.path)
+    
+    async def refresh(self, client: CoinGeckoClient):
+        """/coins/list を取得して保存"""
+        started = time.perf_counter()
+        data = await client.get_json("/coins/list")
+        coins = [
+            Coin(item["id"], item.get("symbol") or "", item.get("name") or item["id"])
+            for item in data if item.get("id")
+        ]
+        await asyncio.to_thread(self.save, coins, time.time())
+        logger.info(f"📇 コイン一覧を更新しました: {len(coins)}件 ({time.perf_counter() - started:.1f}秒)")
+    
+    async def start(self, client: Optional[CoinGeckoClient] = None):
+        try:
+            count = await asyncio.to_thread(self.load)
+            logger.info(f"📇 コイン一覧を読み込みました: {count}件")
+        except Exception as e:
+            logger.warning(f"⚠️ コイン一覧の読み込みに失敗しました: {e}")
+        self._task = asyncio.create_task(self.run(client), name="coin-registry")
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def run(self, client: Optional[CoinGeckoClient]):
+        while True:
+            if client is None:
+                # 保存ファイルが更新されていれば読み直す
+                await asyncio.sleep(300)
+                try:
+                    if os.path.exists(self.path) and os.path.getmtime(self.path) != self.loaded_mtime:
+                        await asyncio.to_thread(self.load)
+                except Exception as e:
+                    logger.warning(f"⚠️ コイン一覧の読み込みに失敗しました: {e}")
+                continue
+            
+            age = time.time() - self.fetched_at if self.fetched_at else None
+            if age is not None and age < self.refresh_interval:
+                await asyncio.sleep(self.refresh_interval - age)
+                continue
+            try:
+                await self.refresh(client)
+            except CryptoAPIError as e:
+                logger.warning(f"⚠️ コイン一覧の取得に失敗しました: {e.message}")
+                await asyncio.sleep(600)
+            except Exception as e:
+                logger.exception(f"❌ コイン一覧の更新でエラーが発生しました: {e}")
+                await asyncio.sleep(600)
+    
+    def search(self, query: str, limit: int = MAX_CHOICES) -> List[Coin]:
+        started = time.perf_counter()
+        try:
+            return self.index.search(query, limit)
+        finally:
+            COIN_SEARCH_LATENCY.observe(time.perf_counter() - started)
+    
+    def get(self, coin_id: str) -> Optional[Coin]:
+        return self.index.get(coin_id)
+    
+    def resolve(self, text: str) -> Optional[Coin]:
+        return self.index.resolve(text)
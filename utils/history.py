@@ -0,0 +1,152 @@
+import math
+import operator
+import os
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+# 記録する最小間隔（秒）。ストリームで頻繁に更新されても容量あたりの期間を保つ
+HISTORY_RESOLUTION = float(os.environ.get("CRYPTO_HISTORY_RESOLUTION", 30))
+
+# 保持する期間（秒）。/crypto_chart の最長の表示期間（24時間）
+HISTORY_WINDOW = 24 * 3600
+
+# 1通貨あたりの保持件数。未指定なら HISTORY_WINDOW を HISTORY_RESOLUTION 間隔で記録できる件数（30秒なら2881件）
+HISTORY_CAPACITY = (
+    int(os.environ.get("CRYPTO_HISTORY_CAPACITY", 0))
+    or math.ceil(HISTORY_WINDOW / HISTORY_RESOLUTION) + 1
+)
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+class PriceRing:
+    """固定長のリングバッファ（時刻と価格を array('d') で保持）
+    
+    1点あたり16バイト（時刻8 + 価格8）で、メモリ使用量は capacity * 16 バイトで一定。
+    点ごとのdictやfloatオブジェクトは作らない。
+    """
+    __slots__ = ("capacity", "timestamps", "prices", "start", "size")
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.prices = array("d", bytes(8 * capacity))
+        self.start = 0  # 最も古い点の位置
+        self.size = 0
+    
+    def __len__(self) -> int:
+        return self.size
+    
+    @property
+    def nbytes(self) -> int:
+        return (len(self.timestamps) + len(self.prices)) * self.timestamps.itemsize
+    
+    def append(self, timestamp: float, price: float):
+        end = (self.start + self.size) % self.capacity
+        self.timestamps[end] = timestamp
+        self.prices[end] = price
+        if self.size < self.capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+    
+    def last_timestamp(self) -> Optional[float]:
+        if not self.size:
+            return None
+        return self.timestamps[(self.start + self.size - 1) % self.capacity]
+    
+    def _ordered(self, data: array) -> array:
+        """古い順に並べたコピー（最大2回のスライス連結）"""
+        end = self.start + self.size
+        if end <= self.capacity:
+            return data[self.start:end]
+        return data[self.start:] + data[:end - self.capacity]
+    
+    def window(self, since: float) -> Tuple[array, array]:
+        """since以降の (時刻, 価格) を古い順に返す"""
+        timestamps = self._ordered(self.timestamps)
+        prices = self._ordered(self.prices)
+        i = bisect_left(timestamps, since)
+        return timestamps[i:], prices[i:]
+
+
+def summarize(prices: array) -> Dict[str, float]:
+    """価格列の統計。ループはCで実装された組み込み関数に任せる"""
+    n = len(prices)
+    first, last = prices[0], prices[-1]
+    mean = math.fsum(prices) / n
+    
+    # 対数リターンの標準偏差（%）をボラティリティとする
+    returns = list(map(math.log, map(operator.truediv, prices[1:], prices[:-1]))) if min(prices) > 0 else []
+    if len(returns) > 1:
+        r_mean = math.fsum(returns) / len(returns)
+        variance = math.fsum(map(operator.mul, returns, returns)) / len(returns) - r_mean * r_mean
+        volatility = math.sqrt(max(variance, 0.0)) * 100
+    else:
+        volatility = 0.0
+    
+    return {
+        "count": n,
+        "first": first,
+        "last": last,
+        "min": min(prices),
+        "max": max(prices),
+        "mean": mean,
+        "change": (last - first) / first * 100 if first else 0.0,
+        "volatility": volatility,
+    }
+
+
+def sparkline(prices: array, width: int = 40) -> str:
+    """価格列をブロック文字のスパークラインにする（幅に合わせて間引く）"""
+    n = len(prices)
+    if n > width:
+        step = n / width
+        prices = [prices[int(i * step)] for i in range(width - 1)] + [prices[-1]]
+    low, high = min(prices), max(prices)
+    span = high - low
+    if span == 0:
+        return SPARK_CHARS[len(SPARK_CHARS) // 2] * len(prices)
+    scale = (len(SPARK_CHARS) - 1) / span
+    return "".join(SPARK_CHARS[int((p - low) * scale)] for p in prices)
+
+
+class PriceHistory:
+    """通貨ごとの価格履歴
+    
+    メモリ使用量は通貨数 * capacity * 16 バイト（既定では1通貨あたり約46KB）。
+    価格の提供元は点ごとには持たず、通貨ごとに提供元 -> 最後に記録した時刻だけを持つ。
+    """
+    def __init__(self, capacity: int = HISTORY_CAPACITY, resolution: float = HISTORY_RESOLUTION):
+        self.capacity = capacity
+        self.resolution = resolution
+        self.rings: Dict[str, PriceRing] = {}
+        self.providers: Dict[str, Dict[str, float]] = {}
+    
+    def record(self, crypto_id: str, timestamp: float, price: Optional[float], provider: str = "CoinGecko"):
+        if price is None:
+            return
+        ring = self.rings.get(crypto_id)
+        if ring is None:
+            ring = self.rings[crypto_id] = PriceRing(self.capacity)
+        last = ring.last_timestamp()
+        if last is not None and timestamp < last + self.resolution:
+            return  # 記録間隔に満たない更新や時刻の巻き戻りは記録しない
+        ring.append(timestamp, float(price))
+        self.providers.setdefault(crypto_id, {})[provider] = timestamp
+    
+    def window(self, crypto_id: str, since: float) -> Tuple[array, array]:
+        ring = self.rings.get(crypto_id)
+        if ring is None:
+            return array("d"), array("d")
+        return ring.window(since)
+    
+    def providers_since(self, crypto_id: str, since: float) -> List[str]:
+        """since以降に記録した価格の提供元（名前順）"""
+        providers = self.providers.get(crypto_id, {})
+        return sorted(provider for provider, timestamp in providers.items() if timestamp >= since)
+    
+    @property
+    def nbytes(self) -> int:
+        return sum(ring.nbytes for ring in self.rings.values())
@@ -0,0 +1,208 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, List, Optional
+
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# ログの出力形式（json: 1行1レコードのJSON / text: 人が読む形式）とレベル
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# 書き込みスレッドが追いつかない場合にためておくレコード数。超えた分は捨てる（イベントループは待たせない）
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+# この時間（秒）以上かかったインタラクションを遅いトレースとして、TRACE_SAMPLE_RATE の割合で保存する
+SLOW_TRACE_THRESHOLD = float(os.environ.get("SLOW_TRACE_THRESHOLD", 1.0))
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 1.0))
+TRACE_BUFFER_SIZE = 100  # /traces で表示する遅いトレースの件数
+
+LOG_RECORDS_DROPPED = REGISTRY.counter("log_records_dropped_total", "キューが満杯で捨てたログの数")
+TRACES = REGISTRY.counter("interaction_traces_total", "インタラクションのトレース数（slow=遅かったもの）", ["command", "slow"])
+TRACE_SPAN_LATENCY = REGISTRY.histogram(
+    "interaction_span_seconds", "インタラクション内の各処理（スパン）の所要時間", ["span"]
+)
+
+# 標準のLogRecordが持つ属性（これ以外を extra で渡された構造化フィールドとして出力する）
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class Trace:
+    """1つのインタラクションの処理時間の記録"""
+    def __init__(self, trace_id: str, name: str, attrs: dict):
+        self.trace_id = trace_id
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        self.spans: List[dict] = []
+    
+    def add_span(self, name: str, started: float, duration: float):
+        if self.duration is None:  # 終了後に裏の処理から届いたスパンは記録しない
+            self.spans.append({
+                "name": name,
+                "start": round(started - self.started, 4),
+                "duration": round(duration, 4),
+            })
+    
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration": None if self.duration is None else round(self.duration, 4),
+            "error": self.error,
+            "attrs": self.attrs,
+            "spans": self.spans,
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+# サンプリングされた遅いトレース（新しいものが後ろ）
+SLOW_TRACES: Deque[Trace] = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return None if trace is None else trace.trace_id
+
+
+@contextmanager
+def trace(name: str, trace_id: str, **attrs):
+    """インタラクション1件分のトレースを開始する（中で作ったタスクにも引き継がれる）"""
+    current = Trace(trace_id, name, attrs)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        _current_trace.reset(token)
+        current.duration = time.perf_counter() - current.started
+        slow = current.duration >= SLOW_TRACE_THRESHOLD
+        TRACES.inc(command=name, slow=str(slow).lower())
+        if slow and random.random() < TRACE_SAMPLE_RATE:
+            SLOW_TRACES.append(current)
+            logger.warning(
+                "🐢 遅いインタラクション: %s (%.2f秒)", name, current.duration,
+                extra={"trace_id": current.trace_id, "spans": current.spans}
+            )
+
+
+@contextmanager
+def span(name: str):
+    """現在のトレースに処理時間を記録する（トレース外では時間だけを計測）"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        TRACE_SPAN_LATENCY.observe(duration, span=name)
+        current = _current_trace.get()
+        if current is not None:
+            current.add_span(name, started, duration)
+
+
+def slow_traces(limit: int = TRACE_BUFFER_SIZE) -> List[dict]:
+    """保存済みの遅いトレース（新しい順）"""
+    return [trace.to_dict() for trace in reversed(SLOW_TRACES)][:limit]
+
+
+class JsonFormatter(logging.Formatter):
+    """1レコードを1行のJSONにする"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(message)s", "%H:%M:%S")
+    
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        if getattr(record, "trace_id", None):
+            line += f" [trace={record.trace_id}]"
+        return line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """ログをキューに入れるだけのハンドラー（書き込みは QueueListener のスレッドで行う）
+    
+    キューが満杯なら待たずに捨てる。例外のトレースバックだけは呼び出し元で文字列にしておく
+    （exc_info は別スレッドに渡せないため）。
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        trace_id = current_trace_id()
+        if trace_id is not None and not hasattr(record, "trace_id"):
+            record.trace_id = trace_id
+        return record
+    
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging():
+    """ルートロガーをキュー経由の非同期出力に切り替える（プロセスごとに1回）"""
+    global _listener
+    if _listener is not None:
+        return
+    
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    
+    root = logging.getLogger()
+    root.handlers = [NonBlockingQueueHandler(log_queue)]
+    root.setLevel(LOG_LEVEL)
+    logging.getLogger("discord").setLevel(max(root.level, logging.INFO))
+    
+    _listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """キューに残っているログを書き出して書き込みスレッドを止める"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
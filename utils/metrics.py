@@ -0,0 +1,239 @@
+import math
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Prometheusのテキスト形式で /metrics に出力する、依存ライブラリなしの最小実装
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    """メトリクスの基底クラス"""
+    type_name = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._functions: Dict[LabelValues, Callable[[], float]] = {}
+    
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ラベルは {self.labelnames} を指定してください (指定: {tuple(labels)})")
+        return tuple(str(labels[name]) for name in self.labelnames)
+    
+    def set_function(self, function: Callable[[], float], **labels):
+        """出力時にfunctionを呼び出して値を取得する（外部で管理している値の公開用）"""
+        self._functions[self._key(labels)] = function
+    
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """(メトリクス名, ラベル文字列, 値) の一覧"""
+        values = dict(self._values)
+        for key, function in self._functions.items():
+            try:
+                values[key] = float(function())
+            except Exception:
+                values[key] = math.nan
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in sorted(values.items())]
+    
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """単調増加するカウンター"""
+    type_name = "counter"
+    
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    """増減する値"""
+    type_name = "gauge"
+    
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+    
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+    
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """値の分布（レイテンシなど）"""
+    type_name = "histogram"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # ラベルごとに [各バケットの件数..., 合計値, 件数]
+        self._observations: Dict[LabelValues, List[float]] = {}
+    
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._observations.get(key)
+        if state is None:
+            state = self._observations[key] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+        state[-2] += value
+        state[-1] += 1
+    
+    def time(self, **labels) -> "_Timer":
+        """with文で囲んだ処理の所要時間を記録する"""
+        return _Timer(self, labels)
+    
+    def samples(self) -> List[Tuple[str, str, float]]:
+        result = []
+        for key, state in sorted(self._observations.items()):
+            for bound, count in zip(self.buckets, state):
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_value(bound),))
+                result.append((f"{self.name}_bucket", labels, count))
+            labels = _format_labels(self.labelnames, key)
+            result.append((f"{self.name}_sum", labels, state[-2]))
+            result.append((f"{self.name}_count", labels, state[-1]))
+        return result
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = 0.0
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Registry:
+    """メトリクスの登録先"""
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+    
+    def _register(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            # Cogの再読み込みなどで同じメトリクスが再定義された場合は既存のものを使う
+            if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                raise ValueError(f"メトリクス {metric.name} は別の定義で登録済みです")
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+    
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+    
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+    
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+    
+    def render(self) -> str:
+        """Prometheusのテキスト形式で全メトリクスを出力"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+    
+    def collect(self) -> List[dict]:
+        """全メトリクスの現在値（JSONにして別プロセスに渡せる形）"""
+        return [
+            {"name": metric.name, "type": metric.type_name, "help": metric.documentation,
+             "samples": metric.samples()}
+            for metric in self._metrics.values()
+        ]
+    
+    def render_merged(self, remote: Dict[str, List[dict]], label: str = "cluster") -> str:
+        """自プロセスのメトリクスに、他プロセスが collect() したものを label を付けて加えて出力
+        
+        remote は {ラベルの値: collect()の結果}。同じ名前のメトリクスはHELP/TYPEを1回だけ出力する。
+        """
+        families: Dict[str, dict] = {}
+        for family in self.collect():
+            families[family["name"]] = {**family, "samples": list(family["samples"])}
+        for value, collected in sorted(remote.items()):
+            extra = f'{label}="{_escape(str(value))}"'
+            for family in collected:
+                merged = families.setdefault(family["name"], {**family, "samples": []})
+                for name, labels, sample in family["samples"]:
+                    labels = "{" + extra + ("," + labels[1:] if labels else "}")
+                    merged["samples"].append((name, labels, sample))
+        lines = []
+        for family in families.values():
+            lines.append(f"# HELP {family['name']} {family['help']}")
+            lines.append(f"# TYPE {family['name']} {family['type']}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in family["samples"])
+        return "\n".join(lines) + "\n"
+
+
+# プロセス全体で共有するレジストリ
+REGISTRY = Registry()
+
+# --- 共通のメトリクス ---
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "crypto_upstream_request_seconds", "外部価格APIへのリクエスト所要時間", ["endpoint"]
+)
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    "crypto_upstream_requests_total", "外部価格APIへのリクエスト数（ステータス別）", ["endpoint", "status"]
+)
+UPSTREAM_RETRIES = REGISTRY.counter(
+    "crypto_upstream_retries_total", "外部価格APIへのリトライ回数", ["endpoint"]
+)
+INTERACTION_DEFER = REGISTRY.histogram(
+    "discord_interaction_defer_seconds", "インタラクション受信から最初の応答(defer/send_message)までの時間", ["command"]
+)
+INTERACTION_RESPONSE = REGISTRY.histogram(
+    "discord_interaction_response_seconds", "インタラクション受信から結果送信(followup.send)までの時間", ["command"]
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "crypto_cache_lookups_total", "価格キャッシュの参照回数（hit/stale/miss別）", ["result"]
+)
+CACHE_HIT_RATIO = REGISTRY.gauge(
+    "crypto_cache_hit_ratio", "価格キャッシュのヒット率（古いデータでの応答を含む）"
+)
+CACHE_ENTRIES = REGISTRY.gauge(
+    "crypto_cache_entries", "価格キャッシュのエントリ数"
+)
+EMBED_CACHE_LOOKUPS = REGISTRY.counter(
+    "crypto_embed_cache_lookups_total", "作成済みEmbedキャッシュの参照回数（hit/miss別）", ["result"]
+)
+DEADLINE_FALLBACKS = REGISTRY.counter(
+    "discord_deadline_fallbacks_total", "前回のデータで応答した回数（updated/failed: 期限切れ後の書き換えの結果, error: 期限内に取得が失敗）", ["command", "outcome"]
+)
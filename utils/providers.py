@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+import aiohttp
+
+from utils.coingecko import CoinGeckoClient, CryptoAPIError
+from utils.metrics import REGISTRY, UPSTREAM_LATENCY, UPSTREAM_REQUESTS
+from utils.sources import STREAM_SYMBOLS, rescale_prices
+
+logger = logging.getLogger(__name__)
+
+# 代替プロバイダー: "binance" または "none"（無効）
+ALT_PROVIDER = os.environ.get("CRYPTO_ALT_PROVIDER", "binance")
+
+# 代替プロバイダー（Binance REST API）のベースURL
+BINANCE_API_URL = os.environ.get("BINANCE_API_URL", "https://api.binance.com/api/v3")
+
+# ヘッジ（代替プロバイダーへの追加リクエスト）を出すまでの待ち時間の決め方
+HEDGE_PERCENTILE = float(os.environ.get("CRYPTO_HEDGE_PERCENTILE", 95))
+HEDGE_MIN_DELAY = 0.2
+HEDGE_MAX_DELAY = 3.0
+HEDGE_DEFAULT_DELAY = 1.0  # 計測値が少ないうちの既定値
+
+HEDGED_REQUESTS = REGISTRY.counter(
+    "crypto_hedged_requests_total", "ヘッジ・フェイルオーバーで代替プロバイダーに送ったリクエスト数", ["reason"]
+)
+PROVIDER_WINS = REGISTRY.counter(
+    "crypto_provider_wins_total", "最初に有効な応答を返したプロバイダー", ["provider"]
+)
+PROVIDER_HEALTHY = REGISTRY.gauge(
+    "crypto_provider_healthy", "プロバイダーがローテーションに入っているか (1/0)", ["provider"]
+)
+
+
+class PriceProvider:
+    """オンデマンドの価格取得先。/simple/price と同じ形式のdictを返す"""
+    name = "base"
+    
+    def supports(self, crypto_id: str) -> bool:
+        return True
+    
+    async def fetch(self, crypto_ids: List[str]) -> Dict[str, dict]:
+        raise NotImplementedError
+
+
+class CoinGeckoProvider(PriceProvider):
+    """主プロバイダー（共有のCoinGeckoクライアント経由）"""
+    name = "coingecko"
+    
+    def __init__(self, client: CoinGeckoClient):
+        self.client = client
+    
+    async def fetch(self, crypto_ids: List[str]) -> Dict[str, dict]:
+        return await self.client.simple_price(crypto_ids)
+
+
+class BinanceProvider(PriceProvider):
+    """代替プロバイダー（Binanceの24時間ティッカー）
+    
+    USDT建ての価格・変動率・出来高のみ。JPY・BTC建て価格と時価総額は含まれない。
+    """
+    name = "binance"
+    
+    def __init__(self, session: aiohttp.ClientSession, base_url: str = BINANCE_API_URL,
+                 symbols: Dict[str, str] = STREAM_SYMBOLS):
+        self.session = session
+        self.base_url = base_url
+        self.symbols = symbols
+        self.crypto_ids = {symbol: crypto_id for crypto_id, symbol in symbols.items()}
+    
+    def supports(self, crypto_id: str) -> bool:
+        return crypto_id in self.symbols
+    
+    async def fetch(self, crypto_ids: List[str]) -> Dict[str, dict]:
+        symbols = [self.symbols[crypto_id] for crypto_id in crypto_ids if crypto_id in self.symbols]
+        if not symbols:
+            return {}
+        
+        path = "/ticker/24hr"
+        params = {"symbols": "[" + ",".join(f'"{symbol}"' for symbol in symbols) + "]"}
+        started = time.perf_counter()
+        try:
+            async with self.session.get(f"{self.base_url}{path}", params=params) as response:
+                UPSTREAM_REQUESTS.inc(endpoint=f"binance{path}", status=str(response.status))
+                if response.status != 200:
+                    raise CryptoAPIError(f"❌ API エラー (ステータス: {response.status})")
+                tickers = await response.json()
+        except asyncio.TimeoutError:
+            UPSTREAM_REQUESTS.inc(endpoint=f"binance{path}", status="timeout")
+            raise CryptoAPIError("❌ API接続がタイムアウトしました。")
+        except aiohttp.ClientError as e:
+            UPSTREAM_REQUESTS.inc(endpoint=f"binance{path}", status="error")
+            raise CryptoAPIError(f"❌ エラーが発生しました: {str(e)}")
+        finally:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - started, endpoint=f"binance{path}")
+        
+        data = {}
+        for ticker in tickers:
+            crypto_id = self.crypto_ids.get(ticker.get("symbol"))
+            if crypto_id is None:
+                continue
+            data[crypto_id] = {
+                "usd": float(ticker["lastPrice"]),
+                "usd_24h_change": float(ticker["priceChangePercent"]),
+                "usd_24h_vol": float(ticker["quoteVolume"]),
+                "provider": "Binance",
+            }
+        return data
+
+
+class ProviderHealth:
+    """プロバイダーごとの直近のレイテンシと失敗状況
+    
+    連続して max_failures 回失敗したら eject_seconds 秒間ローテーションから外す。
+    """
+    def __init__(self, max_failures: int = 3, eject_seconds: float = 30.0, window: int = 50):
+        self.latencies = deque(maxlen=window)
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.failures = 0
+        self.ejected_until = 0.0
+    
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+    
+    def success(self, latency: float):
+        self.latencies.append(latency)
+        self.failures = 0
+    
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            self.ejected_until = time.monotonic() + self.eject_seconds
+            self.failures = 0
+    
+    def hedge_delay(self, percentile: float = HEDGE_PERCENTILE) -> float:
+        """直近のレイテンシのパーセンタイル（この時間を過ぎたらヘッジする）"""
+        if len(self.latencies) < 10:
+            return HEDGE_DEFAULT_DELAY
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, ordered[index]))
+
+
+class HedgedPriceFetcher:
+    """ヘッジ付きリクエストとフェイルオーバーで価格を取得する
+    
+    1. ローテーション中の先頭プロバイダーに送信
+    2. 直近レイテンシのパーセンタイルを過ぎても応答がない、または失敗した場合は次のプロバイダーにも送信
+    3. 最初に成功した応答を採用し、残りはキャンセル
+    4. 採用したプロバイダーが扱っていない通貨（Binanceにない通貨など）は、扱っているプロバイダーから取得する
+       （そのプロバイダーへのリクエストが実行中ならその応答を使う）
+    """
+    def __init__(self, providers: Iterable[PriceProvider]):
+        self.providers = list(providers)
+        self.health: Dict[str, ProviderHealth] = {provider.name: ProviderHealth() for provider in self.providers}
+        for provider in self.providers:
+            PROVIDER_HEALTHY.set_function(
+                lambda name=provider.name: 1.0 if self.health[name].healthy else 0.0, provider=provider.name
+            )
+    
+    def _candidates(self, crypto_ids: List[str]) -> List[PriceProvider]:
+        supported = [p for p in self.providers if any(p.supports(crypto_id) for crypto_id in crypto_ids)]
+        healthy = [p for p in supported if self.health[p.name].healthy]
+        # 全滅している場合は外したプロバイダーも試す
+        return healthy or supported
+    
+    async def _call(self, provider: PriceProvider, crypto_ids: List[str]) -> Dict[str, dict]:
+        started = time.perf_counter()
+        try:
+            data = await provider.fetch(crypto_ids)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.health[provider.name].failure()
+            raise
+        self.health[provider.name].success(time.perf_counter() - started)
+        return data
+    
+    async def fetch(self, crypto_ids: List[str]) -> Dict[str, dict]:
+        candidates = self._candidates(crypto_ids)
+        if not candidates:
+            return {}
+        
+        pending: Dict[asyncio.Task, PriceProvider] = {}
+        last_error: Optional[BaseException] = None
+        next_index = 0
+        
+        def launch():
+            nonlocal next_index
+            provider = candidates[next_index]
+            next_index += 1
+            pending[asyncio.create_task(self._call(provider, crypto_ids))] = provider
+        
+        launch()
+        try:
+            while pending:
+                can_hedge = next_index < len(candidates)
+                timeout = self.health[candidates[0].name].hedge_delay() if can_hedge else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                
+                if not done:
+                    # 主プロバイダーが遅い → 代替プロバイダーにも送信
+                    HEDGED_REQUESTS.inc(reason="slow")
+                    launch()
+                    continue
+                
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is None:
+                        PROVIDER_WINS.inc(provider=provider.name)
+                        data = task.result()
+                        unsupported = [crypto_id for crypto_id in crypto_ids if not provider.supports(crypto_id)]
+                        if unsupported:
+                            data = {**await self._complete(unsupported, pending), **data}
+                        return data
+                    last_error = task.exception()
+                
+                if not pending and next_index < len(candidates):
+                    # 失敗 → すぐに次のプロバイダーへ
+                    HEDGED_REQUESTS.inc(reason="failure")
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        if isinstance(last_error, CryptoAPIError):
+            raise last_error
+        raise CryptoAPIError(f"❌ エラーが発生しました: {str(last_error)}")
+    
+    async def _complete(self, crypto_ids: List[str], pending: Dict[asyncio.Task, PriceProvider]) -> Dict[str, dict]:
+        """採用した応答に含まれない通貨を取得（取得できなければ空。他の通貨の応答は返せるようにする）"""
+        in_flight = [task for task, provider in pending.items() if any(provider.supports(c) for c in crypto_ids)]
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                in_flight.remove(task)
+                pending.pop(task)
+                if task.exception() is None:
+                    data = task.result()
+                    return {crypto_id: data[crypto_id] for crypto_id in crypto_ids if crypto_id in data}
+        try:
+            return await self.fetch(crypto_ids)
+        except CryptoAPIError as e:
+            logger.warning(f"⚠️ 代替プロバイダーにない通貨の取得に失敗しました: {e.message}")
+            return {}
+
+
+def fill_missing(crypto_data: Optional[dict], previous: Optional[dict], btc_usd: Optional[float] = None) -> Optional[dict]:
+    """代替プロバイダーの応答にない項目を補う
+    
+    JPY建て価格と時価総額は前回の値から価格比で補正する。BTC建て価格はビットコイン自身も動くため
+    前回の値からは求めず、btc_usd（同じ応答のビットコインのUSD価格）で割って求める（不明なら項目なし）。
+    """
+    if crypto_data is None or 'jpy' in crypto_data:
+        return crypto_data
+    merged = {} if previous is None else rescale_prices(dict(previous), crypto_data.get('usd'))
+    merged.pop('btc', None)
+    merged.update(crypto_data)
+    if btc_usd and merged.get('usd'):
+        merged['btc'] = merged['usd'] / btc_usd
+    return merged
+
+
+def create_price_fetcher(session: aiohttp.ClientSession, client: CoinGeckoClient) -> HedgedPriceFetcher:
+    """CRYPTO_ALT_PROVIDER の設定に応じたプロバイダー構成で作成"""
+    providers: List[PriceProvider] = [CoinGeckoProvider(client)]
+    if ALT_PROVIDER == "binance":
+        providers.append(BinanceProvider(session))
+    return HedgedPriceFetcher(providers)
@@ -0,0 +1,69 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Iterable, List, Tuple
+
+# 永続化データの保存先（Renderではディスクをマウントしたパスを指定する）
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+
+
+def connect_sqlite(path: str, *schema: str) -> sqlite3.Connection:
+    """保存先のディレクトリを作ってSQLiteに接続し、schema のSQL（CREATE TABLE IF NOT EXISTS ...）を実行する
+    
+    この接続を使う読み書きはブロッキングI/Oなので、イベントループからは asyncio.to_thread 経由で呼び出すこと。
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path)
+    for statement in schema:
+        conn.execute(statement)
+    return conn
+
+
+class PriceSnapshotStore:
+    """価格キャッシュのスナップショットをSQLiteに保存・復元する
+    
+    スリープ復帰（コールドスタート）直後でも、前回の価格を即座に返せるようにする。
+    ブロッキングI/Oなので、イベントループからは asyncio.to_thread 経由で呼び出すこと。
+    """
+    def __init__(self, path: str = os.path.join(DATA_DIR, "price_snapshot.sqlite3")):
+        self.path = path
+        self.last_load_ms = 0.0
+        self.last_save_ms = 0.0
+    
+    def _connect(self) -> sqlite3.Connection:
+        return connect_sqlite(
+            self.path,
+            "CREATE TABLE IF NOT EXISTS prices (key TEXT PRIMARY KEY, data TEXT NOT NULL, fetched_at REAL NOT NULL)"
+        )
+    
+    def save(self, entries: Iterable[Tuple[str, object, float]]):
+        """(key, data, 取得時刻(UNIX時間)) の一覧でスナップショットを置き換える"""
+        started = time.perf_counter()
+        rows = [(key, json.dumps(data, separators=(",", ":")), fetched_at) for key, data, fetched_at in entries]
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM prices")
+                conn.executemany("INSERT INTO prices (key, data, fetched_at) VALUES (?, ?, ?)", rows)
+        finally:
+            conn.close()
+        self.last_save_ms = (time.perf_counter() - started) * 1000
+    
+    def load(self) -> List[Tuple[str, object, float]]:
+        """保存済みのスナップショットを読み込む（なければ空）"""
+        if not os.path.exists(self.path):
+            return []
+        started = time.perf_counter()
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT key, data, fetched_at FROM prices").fetchall()
+        finally:
+            conn.close()
+        entries = [(key, json.loads(data), fetched_at) for key, data, fetched_at in rows]
+        self.last_load_ms = (time.perf_counter() - started) * 1000
+        return entries
+    
+    @property
+    def size_bytes(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
@@ -0,0 +1,245 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+import aiohttp
+
+from utils.coingecko import CoinGeckoClient, CryptoAPIError
+
+logger = logging.getLogger(__name__)
+
+# 価格の取得方式: "rest"（CoinGeckoを定期ポーリング） / "websocket"（ティッカーストリームを購読）
+PRICE_SOURCE = os.environ.get("CRYPTO_PRICE_SOURCE", "rest")
+
+# WebSocketティッカーの接続先（Binance形式の miniTicker 複合ストリーム）
+STREAM_URL = os.environ.get("CRYPTO_STREAM_URL", "wss://stream.binance.com:9443/stream")
+
+# CoinGeckoの通貨ID -> Binanceのシンボル（ここにない通貨はRESTで補う）
+STREAM_SYMBOLS = {
+    "bitcoin": "BTCUSDT",
+    "ethereum": "ETHUSDT",
+    "ripple": "XRPUSDT",
+    "cardano": "ADAUSDT",
+    "solana": "SOLUSDT",
+    "polkadot": "DOTUSDT",
+    "dogecoin": "DOGEUSDT",
+    "avalanche-2": "AVAXUSDT",
+    "chainlink": "LINKUSDT",
+    "litecoin": "LTCUSDT",
+    "uniswap": "UNIUSDT",
+    "binancecoin": "BNBUSDT",
+    "tron": "TRXUSDT",
+    "stellar": "XLMUSDT",
+    "cosmos": "ATOMUSDT",
+    "algorand": "ALGOUSDT",
+    "vechain": "VETUSDT",
+    "filecoin": "FILUSDT",
+    "tezos": "XTZUSDT",
+    "shiba-inu": "SHIBUSDT",
+    "bitcoin-cash": "BCHUSDT",
+    "aptos": "APTUSDT",
+    "near": "NEARUSDT",
+}
+
+# 価格更新の通知先: (通貨ID -> /simple/price 形式のデータ, 取得時刻(UNIX時間))
+PriceHandler = Callable[[Dict[str, dict], float], Awaitable[None]]
+
+
+def rescale_prices(crypto_data: dict, usd_price: Optional[float],
+                   keys: Iterable[str] = ('jpy', 'usd_market_cap')) -> dict:
+    """USD価格の変化率に合わせて他の通貨建て価格や時価総額を補正（crypto_dataを更新して返す）"""
+    old_usd = crypto_data.get('usd')
+    if not usd_price or not old_usd:
+        return crypto_data
+    ratio = usd_price / old_usd
+    crypto_data['usd'] = usd_price
+    for key in keys:
+        if crypto_data.get(key) is not None:
+            crypto_data[key] = crypto_data[key] * ratio
+    return crypto_data
+
+
+class PriceSource:
+    """価格ソースの基底クラス
+    
+    start() で渡されたハンドラーに、取得した価格を /simple/price と同じ形式でまとめて渡す。
+    """
+    name = "base"
+    
+    def __init__(self):
+        self.handler: Optional[PriceHandler] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self, handler: PriceHandler):
+        self.handler = handler
+        self._task = asyncio.create_task(self.run(), name=f"price-source:{self.name}")
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def run(self):
+        raise NotImplementedError
+
+
+class CoinGeckoRestSource(PriceSource):
+    """CoinGeckoの /simple/price を一定間隔でまとめて取得する"""
+    name = "rest"
+    
+    def __init__(self, client: CoinGeckoClient, crypto_ids: Iterable[str], interval: float):
+        super().__init__()
+        self.client = client
+        self.crypto_ids = list(crypto_ids)
+        self.interval = interval
+    
+    async def poll(self):
+        """全通貨を1回のリクエストで取得してハンドラーに渡す"""
+        try:
+            data = await self.client.simple_price(self.crypto_ids)
+        except CryptoAPIError as e:
+            # クールダウン中などは次の周期に任せる（その間はキャッシュで応答する）
+            logger.warning(f"⚠️ 価格の先読みに失敗しました: {e.message}")
+            return
+        await self.handler(data, time.time())
+    
+    async def run(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.exception(f"❌ 価格の先読みでエラーが発生しました: {e}")
+            await asyncio.sleep(self.interval)
+
+
+class TickerStreamSource(PriceSource):
+    """WebSocketのティッカーストリームで価格を常時更新する
+    
+    ストリームはUSD建ての価格・24時間変動・出来高しか持たないため、
+    JPY・BTC建て価格や時価総額は低頻度のRESTポーリングで取得した値を価格比で補正する。
+    ストリームにない通貨もRESTポーリングで更新する。
+    """
+    name = "websocket"
+    
+    def __init__(self, session: aiohttp.ClientSession, rest: CoinGeckoRestSource,
+                 url: str = STREAM_URL, symbols: Dict[str, str] = STREAM_SYMBOLS,
+                 flush_interval: float = 1.0, max_backoff: float = 60.0):
+        super().__init__()
+        self.session = session
+        self.rest = rest
+        self.url = url
+        self.symbols = {crypto_id: symbol for crypto_id, symbol in symbols.items() if crypto_id in rest.crypto_ids}
+        self.crypto_ids = {symbol: crypto_id for crypto_id, symbol in self.symbols.items()}
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        
+        self.latest: Dict[str, dict] = {}   # 通貨ID -> 最新の価格データ（RESTの値をストリームで更新）
+        self._pending: Dict[str, dict] = {}  # 次のflushでハンドラーに渡す更新
+        self.connected = False
+        self.reconnects = 0
+    
+    async def start(self, handler: PriceHandler):
+        await super().start(handler)
+        await self.rest.start(self._on_rest_prices)
+    
+    async def stop(self):
+        await self.rest.stop()
+        await super().stop()
+    
+    async def _on_rest_prices(self, data: Dict[str, dict], fetched_at: float):
+        """RESTの完全なデータで基準値を更新（ストリームの方が新しい価格は残す）"""
+        for crypto_id, crypto_data in data.items():
+            current = self.latest.get(crypto_id)
+            merged = dict(crypto_data)
+            if current is not None and crypto_id in self.symbols:
+                merged = rescale_prices(merged, current.get('usd'))
+                for key in ('usd_24h_change', 'usd_24h_vol', 'provider'):
+                    if key in current:
+                        merged[key] = current[key]
+            self.latest[crypto_id] = merged
+        await self.handler({crypto_id: self.latest[crypto_id] for crypto_id in data}, fetched_at)
+    
+    def _on_ticker(self, ticker: dict):
+        """miniTickerイベント（s: シンボル, c: 終値, o: 24時間前の始値, q: 出来高(USDT)）を反映"""
+        crypto_id = self.crypto_ids.get(ticker.get('s'))
+        if crypto_id is None:
+            return
+        price = float(ticker['c'])
+        open_price = float(ticker.get('o') or 0)
+        
+        crypto_data = rescale_prices(dict(self.latest.get(crypto_id) or {'usd': price}), price)
+        crypto_data['provider'] = "Binance"  # USD価格はストリームの値
+        if open_price:
+            crypto_data['usd_24h_change'] = (price - open_price) / open_price * 100
+        if ticker.get('q') is not None:
+            crypto_data['usd_24h_vol'] = float(ticker['q'])
+        self.latest[crypto_id] = crypto_data
+        self._pending[crypto_id] = crypto_data
+        
+        # BTC建て価格はビットコインのUSD価格から算出
+        btc_usd = (self.latest.get('bitcoin') or {}).get('usd')
+        if btc_usd:
+            crypto_data['btc'] = price / btc_usd
+    
+    async def _flush_loop(self):
+        """受信した更新を一定間隔でまとめてハンドラーに渡す"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._pending:
+                pending, self._pending = self._pending, {}
+                try:
+                    await self.handler(pending, time.time())
+                except Exception as e:
+                    logger.exception(f"❌ ストリーム価格の反映でエラーが発生しました: {e}")
+    
+    async def run(self):
+        flusher = asyncio.create_task(self._flush_loop())
+        streams = "/".join(f"{symbol.lower()}@miniTicker" for symbol in self.symbols.values())
+        url = f"{self.url}?streams={streams}"
+        backoff = 1.0
+        try:
+            while True:
+                try:
+                    async with self.session.ws_connect(url, heartbeat=30) as ws:
+                        self.connected = True
+                        backoff = 1.0
+                        logger.info(f"📡 価格ストリームに接続しました ({len(self.symbols)}通貨)")
+                        async for message in ws:
+                            if message.type == aiohttp.WSMsgType.TEXT:
+                                payload = json.loads(message.data)
+                                self._on_ticker(payload.get('data', payload))
+                            elif message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                                break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"⚠️ 価格ストリームのエラー: {e}")
+                
+                # 切断されたらジッター付きの指数バックオフで再接続
+                self.connected = False
+                self.reconnects += 1
+                delay = backoff + random.uniform(0, backoff / 2)
+                logger.info(f"🔄 価格ストリームに {delay:.1f}秒後に再接続します")
+                await asyncio.sleep(delay)
+                backoff = min(self.max_backoff, backoff * 2)
+        finally:
+            self.connected = False
+            flusher.cancel()
+
+
+def create_price_source(session: aiohttp.ClientSession, client: CoinGeckoClient,
+                        crypto_ids: Iterable[str], interval: float) -> PriceSource:
+    """CRYPTO_PRICE_SOURCE の設定に応じた価格ソースを作成"""
+    if PRICE_SOURCE == "websocket":
+        # ストリーム利用時のRESTは、JPY建て価格などの補完用に低頻度で呼び出す
+        rest = CoinGeckoRestSource(client, crypto_ids, interval=max(interval, 300.0))
+        return TickerStreamSource(session, rest)
+    return CoinGeckoRestSource(client, crypto_ids, interval)
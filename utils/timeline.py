@@ -0,0 +1,65 @@
+import time
+from typing import Dict, List, Optional
+
+from utils.metrics import REGISTRY
+
+# 起動フェーズ（記録順）と表示名
+PHASES = {
+    "process_start": "プロセス開始",
+    "imports_done": "モジュール読み込み完了",
+    "login": "Discordログイン",
+    "web_server_up": "Webサーバー起動",
+    "cogs_loaded": "Cogs読み込み完了",
+    "tree_synced": "コマンド同期完了",
+    "gateway_ready": "ゲートウェイREADY",
+    "first_interaction": "最初のインタラクション受信",
+}
+
+STARTUP_PHASE = REGISTRY.gauge(
+    "bot_startup_phase_seconds", "プロセス開始から各起動フェーズまでの時間", ["phase"]
+)
+
+
+class Timeline:
+    """起動フェーズの時刻を単調時計で記録する"""
+    def __init__(self):
+        self.origin = time.monotonic()
+        self.marks: Dict[str, float] = {"process_start": self.origin}
+        STARTUP_PHASE.set(0.0, phase="process_start")
+    
+    def mark(self, phase: str):
+        """フェーズの到達を記録（最初の1回のみ）"""
+        if phase in self.marks:
+            return
+        self.marks[phase] = time.monotonic()
+        STARTUP_PHASE.set(self.marks[phase] - self.origin, phase=phase)
+    
+    def elapsed(self, phase: str) -> Optional[float]:
+        """プロセス開始からフェーズ到達までの秒数"""
+        at = self.marks.get(phase)
+        return None if at is None else at - self.origin
+    
+    def breakdown(self) -> List[dict]:
+        """到達済みのフェーズを時刻順に、直前のフェーズからの所要時間付きで返す"""
+        result = []
+        previous = self.origin
+        for phase, at in sorted(self.marks.items(), key=lambda item: item[1]):
+            result.append({
+                "phase": phase,
+                "label": PHASES.get(phase, phase),
+                "at": round(at - self.origin, 4),
+                "delta": round(at - previous, 4),
+            })
+            previous = at
+        return result
+    
+    def to_dict(self) -> dict:
+        return {
+            "uptime": round(time.monotonic() - self.origin, 4),
+            "phases": self.breakdown(),
+            "pending": [phase for phase in PHASES if phase not in self.marks],
+        }
+
+
+# プロセス全体で共有するタイムライン（main.py の最初に読み込むこと）
+TIMELINE = Timeline()
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from utils.metrics import REGISTRY
+from utils.snapshot import DATA_DIR, connect_sqlite
+
+WATCH_ACTIVE = REGISTRY.gauge("crypto_watch_active", "自動更新中のメッセージ数")
+WATCH_EDITS = REGISTRY.counter(
+    "crypto_watch_edits_total", "自動更新メッセージの処理結果（edited/unchanged/removed/error別）", ["result"]
+)
+
+
+class Watch(NamedTuple):
+    watch_id: int
+    guild_id: Optional[int]
+    channel_id: int
+    message_id: int
+    user_id: int
+    crypto_ids: Tuple[str, ...]
+    created_at: float
+
+
+class WatchStore:
+    """自動更新するメッセージ（/crypto_watch）の保存
+    
+    再起動後も同じメッセージの更新を続けられるように、メッセージIDと通貨をSQLiteに保存する。
+    メモリ上の一覧（replace / track / untrack）は、更新ループが反復している最中に変わらないよう
+    イベントループのスレッドで変更し、保存データの読み書きだけを別スレッドに任せる。
+    """
+    def __init__(self, path: str = os.path.join(DATA_DIR, "watches.sqlite3")):
+        self.path = path
+        self.watches: Dict[int, Watch] = {}
+        WATCH_ACTIVE.set_function(lambda: len(self.watches))
+    
+    def _connect(self) -> sqlite3.Connection:
+        return connect_sqlite(
+            self.path,
+            "CREATE TABLE IF NOT EXISTS watches ("
+            "watch_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, channel_id INTEGER NOT NULL, "
+            "message_id INTEGER NOT NULL, user_id INTEGER NOT NULL, crypto_ids TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+    
+    def __len__(self) -> int:
+        return len(self.watches)
+    
+    def read_saved(self, owns: Optional[Callable[[Optional[int]], bool]] = None) -> List[Watch]:
+        """保存済みのウォッチを読み込む（owns を渡すと、guild_id についてTrueを返すものだけ）"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT watch_id, guild_id, channel_id, message_id, user_id, crypto_ids, created_at FROM watches"
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            Watch(watch_id, guild_id, channel_id, message_id, user_id, tuple(crypto_ids.split(",")), created_at)
+            for watch_id, guild_id, channel_id, message_id, user_id, crypto_ids, created_at in rows
+            if owns is None or owns(guild_id)
+        ]
+    
+    def replace(self, watches: List[Watch]) -> int:
+        """メモリ上の一覧を読み込んだウォッチで置き換える"""
+        self.watches = {watch.watch_id: watch for watch in watches}
+        return len(self.watches)
+    
+    def track(self, watch: Watch):
+        """保存したウォッチを更新対象に加える"""
+        self.watches[watch.watch_id] = watch
+    
+    def untrack(self, watch_ids: List[int]):
+        """ウォッチを更新対象から外す（保存データの削除は delete_saved で行う）"""
+        for watch_id in watch_ids:
+            self.watches.pop(watch_id, None)
+    
+    def save(self, guild_id: Optional[int], channel_id: int, message_id: int, user_id: int,
+             crypto_ids: List[str]) -> Watch:
+        """ウォッチを保存して返す（更新対象への追加は track で行う）"""
+        created_at = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    "INSERT INTO watches (guild_id, channel_id, message_id, user_id, crypto_ids, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (guild_id, channel_id, message_id, user_id, ",".join(crypto_ids), created_at)
+                )
+        finally:
+            conn.close()
+        return Watch(cursor.lastrowid, guild_id, channel_id, message_id, user_id, tuple(crypto_ids), created_at)
+    
+    def delete_saved(self, watch_ids: List[int]):
+        """保存済みのウォッチを削除"""
+        if not watch_ids:
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("DELETE FROM watches WHERE watch_id = ?", [(watch_id,) for watch_id in watch_ids])
+        finally:
+            conn.close()
+    
+    def for_guild(self, guild_id: Optional[int]) -> List[Watch]:
+        return sorted((w for w in self.watches.values() if w.guild_id == guild_id), key=lambda w: w.watch_id)
+    
+    def crypto_ids(self) -> List[str]:
+        """全ウォッチの通貨の和集合（登録順）"""
+        return list(dict.fromkeys(crypto_id for watch in self.watches.values() for crypto_id in watch.crypto_ids))